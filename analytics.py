@@ -0,0 +1,147 @@
+#!/usr/bin/python
+
+# analytics.py
+
+# This file defines the per-cycle analysis of a run. As each cycle
+# arrives its anodic and cathodic peaks and its charge are measured from
+# the cycle's arrays, and kept with their change from the previous cycle
+# in a small summary table, one row per cycle, so trends can be followed
+# while the run goes on without going back to the raw current.
+
+import numpy as np
+
+# columns of the summary table
+FIELDS = ["cycle",
+          "anodicV","anodicI", # potential (V) and current (A) of the
+          "cathodicV","cathodicI", # highest and lowest current
+          "charge","anodicCharge","cathodicCharge", # integrated current (C)
+          "o2", # O2 value of the cycle
+          "dAnodicI","dCathodicI","dCharge"] # change from the last cycle
+
+# This function measures one cycle from its time (s), voltage (V) and
+# current (A) arrays, returning the values of the summary columns up to
+# o2, without the changes.
+def measureCycle(t,v,a):
+    n = min(len(t),len(v),len(a))
+    t = np.asarray(t[:n],dtype=np.float64)
+    v = np.asarray(v[:n],dtype=np.float64)
+    a = np.asarray(a[:n],dtype=np.float64)
+    if n < 2: return [np.nan]*7
+    high,low = a.argmax(),a.argmin()
+    return [v[high],a[high],v[low],a[low],np.trapz(a,t),
+            np.trapz(np.maximum(a,0),t),np.trapz(np.minimum(a,0),t)]
+
+# This class holds the summary table of a run, a preallocated cycles x
+# fields array that doubles its rows as it fills.
+class Summary(object):
+
+    def __init__(self,capacity=16):
+        self.table = np.full((capacity,len(FIELDS)),np.nan)
+        self.cycles = 0 # number of rows
+
+    def __len__(self):
+        return self.cycles
+
+    # This function measures a cycle, adds its row and returns it.
+    def addCycle(self,t,v,a,o2=np.nan):
+        if self.cycles == len(self.table):
+            table = np.full((2*len(self.table),len(FIELDS)),np.nan)
+            table[:self.cycles] = self.table[:self.cycles]
+            self.table = table
+        row = self.table[self.cycles]
+        row[0] = self.cycles
+        row[1:8] = measureCycle(t,v,a)
+        row[8] = o2
+        if self.cycles > 0:
+            last = self.table[self.cycles-1]
+            row[9:12] = row[[2,4,5]]-last[[2,4,5]]
+        self.cycles += 1
+        return row
+
+    # This function returns the rows so far, without copying.
+    def rows(self):
+        return self.table[:self.cycles]
+
+    # This function returns a column of the table by name.
+    def column(self,name):
+        return self.rows()[:,FIELDS.index(name)]
+
+    # This function returns the change of a column over the run as a
+    # fraction of its first value, or nan before two cycles.
+    def drift(self,name):
+        values = self.column(name)
+        if len(values) < 2 or values[0] == 0: return np.nan
+        return (values[-1]-values[0])/abs(values[0])
+
+# This function describes the last cycle of a summary in one line, for
+# the UI and the command line.
+def formatTrend(summary):
+    if len(summary) == 0: return ""
+    row = summary.rows()[-1]
+    text = "peak %.3g A at %.3g V" % (row[2],row[1])
+    drift = summary.drift("anodicI")
+    if not np.isnan(drift): text += " (%+.1f%%)" % (100*drift)
+    return text
+
+# This class follows how much each cycle of a run differs from the one
+# before, to tell when the voltammogram has settled. A cycle's change is
+# the RMS difference of its current from the last cycle's, as a fraction
+# of the last cycle's RMS current, and its shift the largest move of the
+# anodic or cathodic peak potential (V). The run has converged once the
+# change has stayed within tolerance, and the shift within shift if
+# given, for the given number of cycles in a row.
+class Convergence(object):
+
+    def __init__(self,tolerance,cycles=3,shift=None):
+        self.tolerance = tolerance
+        self.cycles = cycles
+        self.shift = shift
+        self.last = None # current of the last cycle
+        self.lastPeaks = None # its anodic and cathodic peak potentials
+        # change and shift of each cycle, nan for the first
+        self.changes = []
+        self.shifts = []
+        self.held = 0 # cycles in a row within tolerance
+        self.converged = None # cycle the run converged at, once it has
+
+    # This function compares a cycle's voltage and current with the last
+    # cycle's, returning whether the run has converged. A shorter cycle
+    # is compared over the samples it has.
+    def addCycle(self,v,a):
+        n = min(len(v),len(a))
+        v = np.asarray(v[:n],dtype=np.float64)
+        a = np.asarray(a[:n],dtype=np.float64)
+        change = shift = np.nan
+        peaks = None
+        if n > 0: peaks = np.array([v[a.argmax()],v[a.argmin()]])
+        if self.last is not None and peaks is not None:
+            m = min(n,len(self.last))
+            scale = np.sqrt(np.mean(self.last[:m]**2))
+            diff = np.sqrt(np.mean((a[:m]-self.last[:m])**2))
+            if scale > 0: change = diff/scale
+            elif diff == 0: change = 0.0
+            else: change = np.inf
+            shift = np.abs(peaks-self.lastPeaks).max()
+        self.changes.append(change)
+        self.shifts.append(shift)
+        if n > 0: self.last,self.lastPeaks = a,peaks
+        # comparisons with nan are false, so the first cycle never counts
+        within = change <= self.tolerance and (self.shift == None or
+                                               shift <= self.shift)
+        self.held = self.held+1 if within else 0
+        if self.converged == None and self.held >= self.cycles:
+            self.converged = len(self.changes)
+        return self.converged != None
+
+    # This function describes why the run converged, or returns None if
+    # it has not.
+    def reason(self):
+        if self.converged == None: return None
+        recent = self.changes[self.converged-self.cycles:self.converged]
+        text = ("converged at cycle %d: current within %.3g%% of the last "
+                "cycle's for %d cycles" % (self.converged,
+                                           100*max(recent),self.cycles))
+        if self.shift != None:
+            recent = self.shifts[self.converged-self.cycles:self.converged]
+            text += ", peaks within %.3g V" % max(recent)
+        return text
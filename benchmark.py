@@ -0,0 +1,507 @@
+#!/usr/bin/python
+
+# benchmark.py
+
+# This file measures the hot paths of a run against synthetic data, from
+# 1k to 10M samples, laid out as different numbers of samples per cycle
+# and cycles: acquiring and storing cycles from a simulated Cook source,
+# exporting them as text, drawing and scaling the graph, reading a signal
+# file and fitting the log graph. Each stage runs in its own process and
+# records its throughput (samples per second), latency and peak memory.
+# Results can be saved as a baseline, and a later run compared against
+# it fails on any stage that got slower or bigger. It needs no display:
+# the graph is drawn on a stand-in for the Tk canvas, or on a hidden one
+# with --tk.
+
+#   python benchmark.py --save baseline.json
+#   python benchmark.py --baseline baseline.json
+
+import os
+import sys
+import time
+import json
+import Queue
+import shutil
+import resource
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+
+import numpy as np
+
+import gamry
+import perf
+import waveform
+import potentiostat
+from dataset import Dataset
+from runfile import TextWriter
+from o2logger import formatO2
+
+# (samples per cycle, cycles) of each case
+CASES = [(1000,1),(10000,1),(100000,1),(1000,10),(10000,10),(1000,1000),
+         (10000,100),(100000,10)]
+FULL_CASES = CASES+[(10000,1000),(100000,100)]
+
+# stages whose inputs are Python lists of every sample only run up to
+# this many samples, to keep the suite within memory
+LIST_LIMIT = 1000000
+
+# runs of each stage, of which the median is kept; a stage quicker than
+# MIN_SECONDS is run over and over for that long and its time averaged,
+# so timer noise does not swamp it
+REPEAT = 3
+MIN_SECONDS = 0.1
+
+# seconds to wait for a stage's result before it counts as failed; the
+# process is checked every POLL seconds in case it died without one
+STAGE_TIMEOUT = 1800.0
+POLL = 1.0
+
+# fraction a stage may lose in throughput, or gain in peak memory, over
+# its baseline before it counts as a regression; memory also gets a few
+# MB of slack for the noise of small stages
+TOLERANCE = 0.25
+MEMORY_SLACK = 4.0
+
+####################################
+# Synthetic data
+####################################
+
+# This function returns the voltage and current of one cycle of a
+# triangle sweep over a simulated cell.
+def syntheticCycle(samples):
+    v = waveform.triangle(0.0,1.0,samples).values
+    dvdt = np.gradient(v)
+    a = np.array([gamry.cellCurrent(x,d) for (x,d) in zip(v,dvdt)])
+    return v,a
+
+# This function returns a dataset of cycles of synthetic data, with
+# noise so no two cycles are the same.
+def syntheticDataset(samples,cycles,sRate=0.001):
+    v,a = syntheticCycle(samples)
+    t = np.arange(samples)*sRate
+    dataset = Dataset(cycles)
+    random = np.random.RandomState(0)
+    for _ in range(cycles):
+        dataset.addCycle(t,v,a+random.normal(0,2e-8,samples))
+    return dataset
+
+# This class simulates GamryDtaqCpiv like the one in gamry.py, but hands
+# out prepared points instead of computing each one, so the benchmark
+# measures the acquisition code rather than the simulator.
+class ReplayDtaqCpiv(gamry.SimDtaqCpiv):
+
+    def Run(self,state):
+        gamry.SimDtaqCpiv.Run(self,state)
+        if state: self.columns = self.backend.replay(self.signal)
+
+    def Cook(self,num):
+        count = max(min(num,self.acquired()-self.cooked),0)
+        idx = np.arange(self.cooked,self.cooked+count)
+        points = tuple(tuple(column.take(idx,mode="wrap").tolist())
+                       for column in self.columns)
+        self.cooked += count
+        return count,points
+
+# This class is a simulated backend whose Cook replays one prepared
+# cycle of points over and over.
+class ReplayBackend(gamry.SimBackend):
+
+    def __init__(self):
+        gamry.SimBackend.__init__(self,noise=0.0)
+        self.prepared = {}
+
+    def dtaqcpiv(self):
+        return ReplayDtaqCpiv(self)
+
+    # This function returns the Cook columns of one cycle of a signal.
+    def replay(self,signal):
+        key = id(signal.array)
+        if key not in self.prepared:
+            v = np.asarray(signal.array)
+            t = np.arange(len(v))*signal.sRate
+            a = np.asarray(signal.response)
+            zeros = np.zeros(len(v))
+            self.prepared[key] = [t,a,zeros,a,v,zeros,zeros+5.0,zeros,zeros]
+        return self.prepared[key]
+
+# This class stands in for a Tk canvas, keeping only what is drawn.
+class StubCanvas(object):
+
+    def __init__(self):
+        self.items = {}
+        self.count = 0
+
+    def create(self,*args,**options):
+        self.count += 1
+        self.items[self.count] = (args,options)
+        return self.count
+
+    create_rectangle = create_line = create_text = create_image = create
+
+    def coords(self,item,*coords):
+        self.items[item] = (coords,self.items[item][1])
+
+    def itemconfig(self,item,**options):
+        self.items[item][1].update(options)
+
+    def delete(self,item):
+        del self.items[item]
+
+# This function returns the canvas to draw on: a hidden Tk canvas if
+# asked for, otherwise a stand-in.
+def makeCanvas(tk=False):
+    if not tk: return StubCanvas()
+    import Tkinter
+    root = Tkinter.Tk()
+    root.withdraw()
+    canvas = Tkinter.Canvas(root,width=600,height=400)
+    canvas.pack()
+    return canvas
+
+# This class holds the parts of the UI state the stages use.
+class Struct(object): pass
+
+# This function returns UI state for a run of a case.
+def makeData(samples,cycles):
+    data = Struct()
+    data.width,data.height,data.margin = 600,400,5
+    data.backend = ReplayBackend()
+    data.section = None
+    data.channels = None
+    data.converge = data.convergeCycles = None
+    data.sRate = 0.001
+    data.cycles = cycles
+    data.array = waveform.triangle(0.0,1.0,samples).array
+    data.bText = [["Folder name","","",""],["Signal file","","",""],
+                  ["File name","","",""]]
+    data.lb = data.ub = None
+    data.bound = [None,None]
+    return data
+
+####################################
+# Stages
+####################################
+
+# Each stage sets up its inputs for a case and returns a function that
+# runs it once, which may return the latency of each unit of work in it,
+# and the number of samples it handles. It may also return a function
+# called before each run, outside the timing, and one that removes what
+# it made once the runs are over. A stage returns None for a case it
+# does not run.
+
+# Cycles read from the simulated Cook source and stored, as the
+# acquisition thread and addData do; the latency is per cycle. The
+# simulated cell is modelled once, before the runs.
+def acquireStage(samples,cycles,options):
+    data = makeData(samples,cycles)
+    potentiostat.initPstat(data)
+    potentiostat.setSignal(data,cycles)
+    def run():
+        potentiostat.initDataset(data)
+        potentiostat.resetSignal(data)
+        potentiostat.setSignal(data,cycles)
+        potentiostat.runSignal(data)
+        latencies = []
+        def store(columns):
+            start = time.time()
+            potentiostat.addColumns(data,columns)
+            latencies.append(time.time()-start)
+        potentiostat.readRun(data,cycles,store)
+        return latencies
+    return run,samples*cycles
+
+# The whole run as text, the way save() wrote it before the streamed
+# writers.
+def contentsStage(samples,cycles,options):
+    if samples*cycles > LIST_LIMIT: return None
+    data = Struct()
+    data.dataset = syntheticDataset(samples,cycles)
+    data.O2vals = formatO2(np.linspace(21,20,100))
+    def run():
+        potentiostat.getContents(data)
+    return run,samples*cycles
+
+# The run written by the streamed text writer, cycle by cycle and then
+# finished; the latency is per cycle, and the finish is timed on its own
+# by textFinishStage.
+def textStage(samples,cycles,options):
+    dataset = syntheticDataset(samples,cycles)
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder,"bench.txt")
+    def run():
+        writer = TextWriter(path,cycles)
+        latencies = []
+        for cycle in range(cycles):
+            start = time.time()
+            writer.addCycle(dataset.time,dataset.voltage,
+                            dataset.current(cycle))
+            latencies.append(time.time()-start)
+        writer.finish(formatO2([]))
+        os.remove(path)
+        return latencies
+    return run,samples*cycles,None,lambda: shutil.rmtree(folder)
+
+# The finish of the streamed text writer, which lays the cycles out as
+# columns once the run stops; the cycles are written before each run,
+# outside the timing.
+def textFinishStage(samples,cycles,options):
+    dataset = syntheticDataset(samples,cycles)
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder,"bench.txt")
+    writers = []
+    def prepare():
+        writer = TextWriter(path,cycles)
+        for cycle in range(cycles):
+            writer.addCycle(dataset.time,dataset.voltage,
+                            dataset.current(cycle))
+        writers.append(writer)
+    def run():
+        writers.pop().finish(formatO2([]))
+    return run,samples*cycles,prepare,lambda: shutil.rmtree(folder)
+
+# The graph trace redrawn from a list of every point.
+def drawStage(samples,cycles,options):
+    if samples*cycles > LIST_LIMIT: return None
+    data = makeData(samples,cycles)
+    dataset = syntheticDataset(samples,cycles)
+    points = []
+    for cycle in range(cycles):
+        points.extend(zip(dataset.voltage.tolist(),
+                          dataset.current(cycle).tolist()))
+    canvas = makeCanvas(options.get("tk",False))
+    graph = potentiostat.initGraph(data)
+    graph.points = points
+    potentiostat.fitGraph(graph,*potentiostat.ranges(dataset.voltage,
+                                                      dataset.matrix()))
+    graph.drawGraph(canvas)
+    def run():
+        graph.drawn = None # draws the trace again
+        graph.drawPoints(canvas)
+    return run,samples*cycles
+
+# The domain and range of every sample, as used to scale the graph.
+def rangesStage(samples,cycles,options):
+    dataset = syntheticDataset(samples,cycles)
+    xs = np.tile(dataset.voltage,cycles)
+    ys = dataset.matrix()
+    def run():
+        potentiostat.ranges(xs,ys)
+    return run,samples*cycles
+
+# A signal file of one cycle's voltages read and checked, as convert does
+# when the user picks one; the cache is emptied so it is parsed each
+# time.
+def convertStage(samples,cycles,options):
+    if samples > waveform.MAX_POINTS or cycles != 1: return None
+    data = makeData(samples,1)
+    folder = tempfile.mkdtemp()
+    data.bText[1][1] = os.path.join(folder,"signal.txt")
+    waveform.save(data.bText[1][1],data.array)
+    def run():
+        waveform.cache.clear()
+        waveform.compiled.clear()
+        waveform.files.clear()
+        potentiostat.convert(data)
+    return run,samples,None,lambda: shutil.rmtree(folder)
+
+# The log graph made and fitted from a graph of every point.
+def logGraphStage(samples,cycles,options):
+    if samples*cycles > LIST_LIMIT: return None
+    data = makeData(samples,cycles)
+    dataset = syntheticDataset(samples,cycles)
+    graph = potentiostat.initGraph(data)
+    for cycle in range(cycles):
+        graph.points.extend(zip(dataset.time.tolist(),
+                                dataset.current(cycle).tolist()))
+    def run():
+        graph.makeLogGraph(data)
+    return run,samples*cycles
+
+STAGES = OrderedDict([("acquire",acquireStage),("getContents",contentsStage),
+                      ("textWriter",textStage),
+                      ("textFinish",textFinishStage),
+                      ("drawPoints",drawStage),
+                      ("ranges",rangesStage),("convert",convertStage),
+                      ("makeLogGraph",logGraphStage)])
+
+####################################
+# Measurement
+####################################
+
+# This function returns the resident memory of the process in MB, and
+# starts its peak over from there where Linux allows it.
+def resetMemory():
+    try:
+        with open("/proc/self/clear_refs","w") as f: f.write("5")
+    except (IOError,OSError): pass
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages*resource.getpagesize()/1048576.0
+    except (IOError,OSError): return None
+
+# This function returns the peak resident memory of the process in MB.
+def peakMemory():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])/1024.0
+    except (IOError,OSError): pass
+    # ru_maxrss is in kB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0
+
+# This function runs one stage on one case, in a process of its own, and
+# puts its result on a queue: the median time of a run, its throughput,
+# the median and 90th percentile latency, and the memory the stage used
+# above what its inputs took, or None if the stage skips the case.
+def measure(name,samples,cycles,options,queue):
+    cleanup = None
+    try:
+        perf.setEnabled(False)
+        setup = STAGES[name](samples,cycles,options)
+        if setup == None:
+            queue.put(None)
+            return
+        run,count,prepare,cleanup = tuple(setup)+(None,)*(4-len(setup))
+        before = resetMemory()
+        times,latencies = [],[]
+        for _ in range(options.get("repeat",REPEAT)):
+            seconds,loops = 0.0,0
+            while loops == 0 or seconds < MIN_SECONDS:
+                if prepare != None: prepare()
+                start = time.time()
+                result = run()
+                seconds += time.time()-start
+                loops += 1
+            times.append(seconds/loops)
+            latencies.extend(result if result != None else [times[-1]])
+        peak = peakMemory()
+        seconds = float(np.median(times))
+        queue.put({"samples": count, "seconds": seconds,
+                   "throughput": count/max(seconds,1e-9),
+                   "latency": float(np.median(latencies)),
+                   "p90": float(np.percentile(latencies,90)),
+                   "peakMB": max(peak-before,0.0) if before != None
+                             else None})
+    except Exception as error:
+        queue.put({"error": "%s: %s" % (type(error).__name__,error)})
+    finally:
+        if cleanup != None: cleanup()
+
+# This function returns the name of a case in the results.
+def caseName(name,samples,cycles):
+    return "%s/%dx%d" % (name,samples,cycles)
+
+# This function waits for the result of a stage's process. A process
+# that dies without one, killed for running out of memory say, or that
+# runs past the timeout, gives an error result instead.
+def collect(worker,queue,timeout=STAGE_TIMEOUT):
+    waited = 0.0
+    while waited < timeout:
+        try: return queue.get(timeout=POLL)
+        except Queue.Empty: waited += POLL
+        if not worker.is_alive():
+            # the result may have arrived as the process exited
+            try: return queue.get(timeout=POLL)
+            except Queue.Empty: pass
+            return {"error": "worker exited with code %s" % worker.exitcode}
+    worker.terminate()
+    return {"error": "worker timed out after %d s" % timeout}
+
+# This function runs the stages on the cases, returning the results by
+# case name, in order, and calling report with each one.
+def runSuite(cases,stages,options,report=None):
+    results = OrderedDict()
+    for samples,cycles in cases:
+        for name in stages:
+            queue = multiprocessing.Queue()
+            worker = multiprocessing.Process(target=measure,
+                args=(name,samples,cycles,options,queue))
+            worker.start()
+            result = collect(worker,queue)
+            worker.join()
+            if result == None: continue
+            key = caseName(name,samples,cycles)
+            results[key] = result
+            if report != None: report(key,result)
+    return results
+
+# This function compares results with a baseline, returning a line for
+# each stage that lost throughput or gained memory beyond the tolerance.
+def regressions(results,baseline,tolerance=TOLERANCE):
+    found = []
+    for key,result in results.items():
+        old = baseline.get(key)
+        if old == None or "error" in old: continue
+        if "error" in result:
+            found.append("%s failed: %s" % (key,result["error"]))
+            continue
+        if result["throughput"] < old["throughput"]*(1-tolerance):
+            found.append("%s throughput %.3g/s, baseline %.3g/s" %
+                         (key,result["throughput"],old["throughput"]))
+        if (result["peakMB"] != None and old["peakMB"] != None and
+                result["peakMB"] > old["peakMB"]*(1+tolerance)+MEMORY_SLACK):
+            found.append("%s peak memory %.1f MB, baseline %.1f MB" %
+                         (key,result["peakMB"],old["peakMB"]))
+    return found
+
+# This function describes one result as a line of the results table.
+def formatResult(key,result):
+    if "error" in result: return "%-28s %s" % (key,result["error"])
+    memory = result["peakMB"]
+    return "%-28s %10.3g %12.3g %10.3f %10.3f %9s" % (key,
+        result["samples"],result["throughput"],result["latency"]*1000,
+        result["p90"]*1000,"-" if memory == None else "%.1f" % memory)
+
+# This function runs the benchmark from the command line. It exits with
+# status 1 if a stage failed or regressed against the baseline.
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Benchmark the acquisition, storage, export and "
+                    "drawing code on synthetic data.")
+    parser.add_argument("--full",action="store_true",
+                        help="also run the 10M sample cases")
+    parser.add_argument("--stages",nargs="*",default=None,
+                        choices=list(STAGES),help="stages to run")
+    parser.add_argument("--repeat",type=int,default=REPEAT)
+    parser.add_argument("--tk",action="store_true",
+                        help="draw on a hidden Tk canvas")
+    parser.add_argument("--baseline",default=None,
+                        help="results file to compare against")
+    parser.add_argument("--tolerance",type=float,default=TOLERANCE)
+    parser.add_argument("--save",default=None,
+                        help="file to save the results to, as a baseline")
+    args = parser.parse_args()
+
+    options = {"repeat": args.repeat, "tk": args.tk}
+    cases = FULL_CASES if args.full else CASES
+    stages = args.stages or list(STAGES)
+
+    print("%-28s %10s %12s %10s %10s %9s" % ("stage/samples x cycles",
+        "samples","samples/s","median ms","p90 ms","peak MB"))
+    def report(key,result):
+        print(formatResult(key,result))
+        sys.stdout.flush()
+    results = runSuite(cases,stages,options,report)
+
+    failed = ["%s failed: %s" % (key,result["error"])
+              for key,result in results.items() if "error" in result]
+    if args.baseline != None:
+        with open(args.baseline,"rt") as f:
+            baseline = json.load(f)["results"]
+        failed += [line for line in regressions(results,baseline,
+                                                args.tolerance)
+                   if line not in failed]
+    if args.save != None:
+        with open(args.save,"wt") as f:
+            json.dump({"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                       "results": results},f,indent=1)
+    for line in failed:
+        print("REGRESSION " + line)
+    if failed: raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
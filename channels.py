@@ -0,0 +1,50 @@
+#!/usr/bin/python
+
+# channels.py
+
+# This file defines the channel map of the nine columns returned by
+# Cook. Time, current and voltage are always kept; any of the other
+# columns can be kept as well, as typed arrays stored with the run and
+# saved with it. Columns that are not kept are never copied out of the
+# Cook buffer.
+
+import numpy as np
+
+# names of the Cook columns, in the order Cook returns them
+COLUMNS = ["time","current","vu","im","voltage","ach","ierange",
+           "overload","stoptest"]
+
+# type of the array each column is stored as
+TYPES = {"time": np.float64, "current": np.float64, "vu": np.float64,
+         "im": np.float64, "voltage": np.float64, "ach": np.float64,
+         "ierange": np.int32, "overload": np.int32, "stoptest": np.int32}
+
+# columns every run keeps
+CORE = ["time","current","voltage"]
+
+# This function returns the indices of the Cook columns to keep: the
+# core columns and the named extra ones.
+def keptColumns(names=()):
+    for name in names:
+        if name not in COLUMNS:
+            raise ValueError("unknown Cook channel: " + str(name))
+    return sorted(set(COLUMNS.index(name) for name in list(CORE)+list(names)))
+
+# This function returns the names of the extra channels among the kept
+# columns.
+def extraNames(keep):
+    return [COLUMNS[idx] for idx in keep if COLUMNS[idx] not in CORE]
+
+# This function returns the extra channels kept in a cycle's columns, as
+# a dict of typed arrays by name.
+def extraChannels(columns,keep):
+    extra = {}
+    for name in extraNames(keep):
+        values = columns[COLUMNS.index(name)]
+        extra[name] = np.asarray(values,dtype=TYPES[name])
+    return extra
+
+# This function returns the tag of a channel's records in a binary run
+# file.
+def channelTag(name):
+    return ("C%d  " % COLUMNS.index(name)).encode("ascii")
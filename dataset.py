@@ -0,0 +1,111 @@
+#!/usr/bin/python
+
+# dataset.py
+
+# This file defines the in-memory store for the data of a run. Time and
+# voltage are the same for every cycle, so they are kept once, and the
+# current of each cycle is a row of a preallocated cycles x samples
+# matrix of float64 values. Each cycle also has the O2 value lined up
+# with it, if O2 was streamed. Extra Cook channels kept by the run are
+# stored like the current, one typed matrix per channel.
+
+import numpy as np
+
+# This class stores the time, voltage, and current data of a run.
+class Dataset(object):
+
+    def __init__(self,capacity=16):
+        self.time = np.empty(0) # time of each sample in a cycle
+        self.voltage = np.empty(0) # voltage of each sample in a cycle
+        self.currents = np.empty((capacity,0)) # current, one row per cycle
+        self.lengths = np.zeros(capacity,dtype=np.int64) # samples per cycle
+        self.o2 = np.full(capacity,np.nan) # O2 value of each cycle
+        self.channels = {} # matrix of each extra channel, like currents
+        self.cycles = 0 # number of stored cycles
+
+    def __len__(self):
+        return self.cycles
+
+    # This function adds the current of a cycle, and any extra channels
+    # given as a dict of arrays by name. The time and voltage are taken
+    # from the first cycle only.
+    def addCycle(self,t,v,a,o2=np.nan,channels=None):
+        a = np.asarray(a,dtype=np.float64)
+        if self.cycles == 0:
+            self.time = np.array(t,dtype=np.float64)
+            self.voltage = np.array(v,dtype=np.float64)
+        self.reserve(self.cycles+1,len(a))
+        self.currents[self.cycles,:len(a)] = a
+        self.lengths[self.cycles] = len(a)
+        self.o2[self.cycles] = o2
+        for name,values in (channels or {}).items():
+            matrix = self.channels.get(name)
+            if matrix is None or matrix.shape != self.currents.shape:
+                matrix = self.grow(matrix,values.dtype)
+                self.channels[name] = matrix
+            n = min(len(values),matrix.shape[1])
+            matrix[self.cycles,:n] = values[:n]
+        self.cycles += 1
+
+    # This function grows the current matrix, doubling its rows so that
+    # adding a cycle takes constant time on average.
+    def reserve(self,rows,samples):
+        capacity,width = self.currents.shape
+        if rows <= capacity and samples <= width: return
+        capacity = max(capacity,1)
+        while capacity < rows: capacity *= 2
+        currents = np.empty((capacity,max(width,samples)))
+        currents[:self.cycles,:width] = self.currents[:self.cycles]
+        self.currents = currents
+        lengths = np.zeros(capacity,dtype=np.int64)
+        lengths[:self.cycles] = self.lengths[:self.cycles]
+        self.lengths = lengths
+        o2 = np.full(capacity,np.nan)
+        o2[:self.cycles] = self.o2[:self.cycles]
+        self.o2 = o2
+
+    # This function returns a channel matrix the shape of the current
+    # matrix, holding the stored cycles of an old one.
+    def grow(self,matrix,dtype):
+        grown = np.zeros(self.currents.shape,dtype=dtype)
+        if matrix is not None:
+            rows,width = matrix.shape
+            grown[:min(rows,self.cycles),:width] = matrix[:self.cycles]
+        return grown
+
+    # This function returns the current of a cycle, without copying.
+    def current(self,cycle):
+        return self.currents[cycle,:self.lengths[cycle]]
+
+    # This function returns the stored currents as a cycles x samples
+    # matrix, without copying. Samples past the end of a shorter cycle
+    # are not valid.
+    def matrix(self):
+        return self.currents[:self.cycles]
+
+    # This function returns the number of samples stored in every column,
+    # so the data can be read as a complete array.
+    def minLength(self):
+        if self.cycles == 0: return 0
+        return int(min(self.lengths[:self.cycles].min(),len(self.time)))
+
+    # This function returns the time, voltage, and current columns of the
+    # run, in the order they are saved, without copying.
+    def columns(self):
+        columns = [self.time,self.voltage]
+        for cycle in range(self.cycles):
+            columns.append(self.current(cycle))
+        return columns
+
+    # This function returns an extra channel of a cycle, without copying.
+    def channel(self,name,cycle):
+        return self.channels[name][cycle,:self.lengths[cycle]]
+
+    # This function returns the O2 value of each cycle, without copying.
+    def cycleO2(self):
+        return self.o2[:self.cycles]
+
+    # This function returns the memory held by the stored samples.
+    def nbytes(self):
+        return (self.time.nbytes+self.voltage.nbytes+self.currents.nbytes+
+                sum(matrix.nbytes for matrix in self.channels.values()))
@@ -0,0 +1,66 @@
+#!/usr/bin/python
+
+# fitting.py
+
+# This file defines the lifetime fit used by Graph.makeLogGraph. A decay
+# y = A*exp(-x/lifetime) is a line in (x, ln y), so the fit is a least
+# squares line through the log of the data. Every cycle of a run is
+# fitted in one call over the cycles x samples current matrix.
+
+import numpy as np
+
+# This function returns a mask of the samples of x within the bounds,
+# where a bound of None leaves that side open.
+def inBounds(x,lb=None,ub=None):
+    mask = np.ones(len(x),dtype=bool)
+    if lb != None: mask &= x >= lb
+    if ub != None: mask &= x <= ub
+    return mask
+
+# This function returns the log of y, with nan where y is not positive.
+def logValues(y):
+    y = np.asarray(y,dtype=np.float64)
+    positive = y > 0
+    return np.where(positive,np.log(np.where(positive,y,1.0)),np.nan)
+
+# This function fits ln(y) = intercept - x/lifetime to every row of ys.
+# Only samples within the bounds, within each row's length and with
+# y > 0 are used. Each sample is weighted by y^2, the inverse variance of
+# ln(y) for constant noise on y, unless weighted is False. Returns the
+# lifetimes, intercepts and RMS residuals of ln(y) per row, with nan for
+# rows with fewer than two usable samples.
+def fitLifetimes(x,ys,lengths=None,lb=None,ub=None,weighted=True):
+    x = np.asarray(x,dtype=np.float64)
+    ys = np.atleast_2d(np.asarray(ys,dtype=np.float64))
+    n = min(len(x),ys.shape[1])
+    x,ys = x[:n],ys[:,:n]
+    mask = ys > 0
+    mask &= inBounds(x,lb,ub)
+    if lengths is not None:
+        lengths = np.asarray(lengths)
+        mask &= np.arange(n) < lengths[:,None]
+    logs = np.where(mask,np.log(np.where(mask,ys,1.0)),0.0)
+    weights = np.where(mask,ys*ys if weighted else 1.0,0.0)
+
+    # weighted sums for the normal equations of each row
+    s = weights.sum(axis=1)
+    sx = weights.dot(x)
+    sxx = weights.dot(x*x)
+    sy = (weights*logs).sum(axis=1)
+    sxy = (weights*logs).dot(x)
+    with np.errstate(divide="ignore",invalid="ignore"):
+        det = s*sxx-sx*sx
+        slopes = (s*sxy-sx*sy)/det
+        intercepts = (sy-slopes*sx)/s
+        lifetimes = -1.0/slopes
+        errors = np.where(mask,logs-intercepts[:,None]-slopes[:,None]*x,0)
+        residuals = np.sqrt((errors*errors).sum(axis=1)/mask.sum(axis=1))
+    bad = (mask.sum(axis=1) < 2) | (det == 0)
+    lifetimes[bad] = intercepts[bad] = residuals[bad] = np.nan
+    return lifetimes,intercepts,residuals
+
+# This function fits the lifetime of every cycle of a Dataset against
+# its time column.
+def fitDataset(dataset,lb=None,ub=None,weighted=True):
+    return fitLifetimes(dataset.time,dataset.matrix(),
+        dataset.lengths[:dataset.cycles],lb,ub,weighted)
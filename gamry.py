@@ -0,0 +1,390 @@
+#!/usr/bin/python
+
+# gamry.py
+
+# This file defines the instrument backends used by potentiostat.py. A
+# backend hands out the Gamry objects the acquisition code talks to:
+# either the real GamryCOM objects on the bench PC, or an in-process
+# simulation of them so the acquisition pipeline can be run, profiled
+# and load-tested on any machine.
+
+# The simulated objects follow the GamryCOM calls used in potentiostat.py:
+#   GamryDeviceList  - Count, EnumSections
+#   GamryPstat       - Init, Open, Close, SetSignal, SetCell
+#   GamryDtaqCpiv    - Init, Run, Cook
+#   GamrySignalArray - Init, Tweak
+# Cook returns (count, points), where points holds the 9 Cook columns
+# (time, current, _, _, voltage, _, _, _, _) as read in getreading.
+
+import time
+import math
+import random
+
+####################################
+# Backends
+####################################
+
+# This class defines the interface shared by all instrument backends.
+class Backend(object):
+
+    name = None
+
+    # These functions create the Gamry objects used for a run.
+    def deviceList(self):
+        raise NotImplementedError
+
+    def pstat(self):
+        raise NotImplementedError
+
+    def dtaqcpiv(self):
+        raise NotImplementedError
+
+    def signalArray(self):
+        raise NotImplementedError
+
+    # This function waits while the instrument acquires data.
+    def wait(self,seconds):
+        time.sleep(seconds)
+
+    # This function returns the instrument time in seconds.
+    def clock(self):
+        return time.time()
+
+    # These functions prepare and release a thread that talks to the
+    # instrument.
+    def threadInit(self):
+        pass
+
+    def threadExit(self):
+        pass
+
+# This class creates the real Gamry objects through COM. win32com is
+# only imported once this backend is selected.
+class ComBackend(Backend):
+
+    name = "com"
+
+    def __init__(self):
+        import win32com.client
+        self.client = win32com.client
+
+    def deviceList(self):
+        return self.client.Dispatch('GamryCOM.GamryDeviceList')
+
+    def pstat(self):
+        return self.client.Dispatch('GamryCOM.GamryPstat')
+
+    def dtaqcpiv(self):
+        return self.client.Dispatch('GamryCOM.GamryDtaqCpiv')
+
+    def signalArray(self):
+        return self.client.Dispatch('GamryCOM.GamrySignalArray')
+
+    # COM objects belong to the thread that created them, so each
+    # acquisition thread joins its own apartment.
+    def threadInit(self):
+        import pythoncom
+        pythoncom.CoInitialize()
+
+    def threadExit(self):
+        import pythoncom
+        pythoncom.CoUninitialize()
+
+# This class creates simulated Gamry objects. The simulation runs on its
+# own clock: with a speed it follows real time scaled by that factor,
+# and without one it only advances when the acquisition code waits, so
+# runs complete as fast as the code path allows.
+class SimBackend(Backend):
+
+    name = "sim"
+
+    def __init__(self,devices=1,speed=None,noise=2e-8,latency=0.0,
+                 seed=None):
+        self.devices = devices # number of simulated instruments
+        self.speed = speed # simulated seconds per real second
+        self.noise = noise # standard deviation of current noise (A)
+        self.latency = latency # cost of one simulated COM call (s)
+        self.random = random.Random(seed)
+        self.elapsed = 0.0 # simulated time advanced by wait
+        self.started = time.time()
+        self.responses = {} # cell response per uploaded signal
+
+    def deviceList(self):
+        return SimDeviceList(self)
+
+    def pstat(self):
+        return SimPstat(self)
+
+    def dtaqcpiv(self):
+        return SimDtaqCpiv(self)
+
+    def signalArray(self):
+        return SimSignalArray(self)
+
+    # This function returns the simulated time in seconds.
+    def clock(self):
+        if self.speed == None: return self.elapsed
+        return (time.time()-self.started)*self.speed
+
+    def wait(self,seconds):
+        if self.speed == None: self.elapsed += seconds
+        else: time.sleep(seconds/float(self.speed))
+
+    # This function models the cost of a call across COM.
+    def call(self):
+        if self.latency > 0: time.sleep(self.latency)
+
+# This function returns the backend with the given name.
+def getBackend(name="com",**options):
+    if name == "com": return ComBackend(**options)
+    if name == "sim": return SimBackend(**options)
+    raise ValueError("unknown backend: " + str(name))
+
+####################################
+# Simulated instrument
+####################################
+
+# This function models the cell current at a potential v (V) swept at
+# dvdt (V/s): double-layer charging plus a reversible redox couple whose
+# peak is anodic on the forward sweep and cathodic on the reverse sweep.
+def cellCurrent(v,dvdt,e0=0.5,ip=2e-6,width=0.06,cdl=2e-6):
+    current = cdl*dvdt
+    if dvdt > 0:
+        x = (v-e0-0.03)/width
+        current += ip*(math.exp(-x*x)+0.3/(1+math.exp(-4*x)))
+    elif dvdt < 0:
+        x = (v-e0+0.03)/width
+        current -= ip*(math.exp(-x*x)+0.3/(1+math.exp(4*x)))
+    return current
+
+# This class simulates GamryCOM.GamryDeviceList.
+class SimDeviceList(object):
+
+    def __init__(self,backend):
+        self.backend = backend
+
+    def Count(self):
+        return self.backend.devices
+
+    def EnumSections(self):
+        return tuple("PCI4SIM-%d" % i for i in range(self.backend.devices))
+
+# This class simulates GamryCOM.GamryPstat.
+class SimPstat(object):
+
+    def __init__(self,backend):
+        self.backend = backend
+        self.section = None
+        self.opened = False
+        self.signal = None
+        self.cell = 0
+
+    def Init(self,section):
+        if section not in SimDeviceList(self.backend).EnumSections():
+            raise ValueError("no such device: " + str(section))
+        self.section = section
+
+    def Open(self):
+        if self.section == None:
+            raise RuntimeError("potentiostat not initialized")
+        self.opened = True
+
+    def Close(self):
+        self.opened = False
+
+    def SetSignal(self,signal):
+        self.backend.call()
+        self.signal = signal
+
+    def SetCell(self,state):
+        self.cell = state
+
+# This class simulates GamryCOM.GamrySignalArray. The clean cell
+# response is computed once per distinct signal, and noise is added as
+# points are cooked.
+class SimSignalArray(object):
+
+    def __init__(self,backend):
+        self.backend = backend
+        self.cycles = 0
+        self.sRate = None
+        self.array = ()
+        self.response = ()
+
+    def Init(self,pstat,cycles,sRate,npts,array,sigType):
+        self.backend.call()
+        self.Tweak(cycles,sRate,npts,array,sigType)
+
+    def Tweak(self,cycles,sRate,npts,array,sigType):
+        self.backend.call()
+        self.cycles = cycles
+        self.sRate = float(sRate)
+        self.array = tuple(array[:npts])
+        key = (self.sRate,self.array)
+        if key not in self.backend.responses:
+            self.backend.responses[key] = self.model()
+        self.response = self.backend.responses[key]
+
+    # This function computes the noise-free current for one pass of
+    # the signal.
+    def model(self):
+        n = len(self.array)
+        response = []
+        for i in range(n):
+            if n < 2: dvdt = 0.0
+            else:
+                before = self.array[max(i-1,0)]
+                after = self.array[min(i+1,n-1)]
+                dvdt = (after-before)/(self.sRate*(min(i+1,n-1)-max(i-1,0)))
+            response.append(cellCurrent(self.array[i],dvdt))
+        return tuple(response)
+
+    # This function returns the number of points in the whole signal.
+    def length(self):
+        return self.cycles*len(self.array)
+
+# This class simulates GamryCOM.GamryDtaqCpiv.
+class SimDtaqCpiv(object):
+
+    def __init__(self,backend):
+        self.backend = backend
+        self.pstat = None
+        self.signal = None
+        self.start = None
+        self.cooked = 0
+
+    def Init(self,pstat):
+        self.pstat = pstat
+
+    def Run(self,state):
+        self.backend.call()
+        if not state:
+            self.start = None
+            return
+        if self.pstat == None or not self.pstat.opened:
+            raise RuntimeError("potentiostat not open")
+        if self.pstat.signal == None:
+            raise RuntimeError("no signal set")
+        self.signal = self.pstat.signal
+        self.start = self.backend.clock()
+        self.cooked = 0
+
+    # This function returns how many points have been acquired so far.
+    def acquired(self):
+        if self.start == None: return self.cooked
+        elapsed = self.backend.clock()-self.start
+        count = int(elapsed/self.signal.sRate)+1
+        return min(count,self.signal.length())
+
+    def Cook(self,num):
+        self.backend.call()
+        count = max(min(num,self.acquired()-self.cooked),0)
+        sig = self.signal
+        gauss = self.backend.random.gauss
+        noise = self.backend.noise
+        columns = [[] for _ in range(9)]
+        npts = len(sig.array) if sig != None else 0
+        for i in range(self.cooked,self.cooked+count):
+            voltage = sig.array[i % npts]
+            current = sig.response[i % npts]+gauss(0,noise)
+            columns[0].append(i*sig.sRate) # time
+            columns[1].append(current) # current
+            columns[2].append(gauss(0,1e-4)) # uncompensated voltage
+            columns[3].append(current)
+            columns[4].append(voltage) # voltage
+            columns[5].append(0.0)
+            columns[6].append(5.0) # current range
+            columns[7].append(0.0) # overload
+            columns[8].append(0.0) # stop test
+        self.cooked += count
+        return count,tuple(tuple(column) for column in columns)
+
+####################################
+# Simulated runs
+####################################
+
+# This function pushes a number of cycles through the acquisition code
+# in potentiostat.py against the simulator, reporting the time taken
+# and optionally a profile of where it went. With --thread the cycles
+# are streamed by the acquisition thread, as in the UI.
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run potentiostat cycles against a simulated Gamry.")
+    parser.add_argument("--cycles",type=int,default=100)
+    parser.add_argument("--points",type=int,default=1000)
+    parser.add_argument("--srate",type=float,default=0.001)
+    parser.add_argument("--speed",type=float,default=None)
+    parser.add_argument("--noise",type=float,default=2e-8)
+    parser.add_argument("--latency",type=float,default=0.0)
+    parser.add_argument("--profile",action="store_true")
+    parser.add_argument("--thread",action="store_true")
+    parser.add_argument("--per-cycle",action="store_true",
+                        help="start the potentiostat again for each cycle")
+    parser.add_argument("--channels",nargs="*",default=None,
+                        help="extra Cook channels to keep")
+    parser.add_argument("--timing",action="store_true",
+                        help="print the time spent in each stage")
+    parser.add_argument("--no-timing",action="store_true",
+                        help="turn timing off")
+    args = parser.parse_args()
+
+    import perf
+    import potentiostat
+    import waveform
+    potentiostat.CONTINUOUS = not args.per_cycle
+    perf.setEnabled(not args.no_timing)
+    class Struct(object): pass
+    data = Struct()
+    data.backend = SimBackend(speed=args.speed,noise=args.noise,
+                              latency=args.latency)
+    data.section = None
+    data.channels = args.channels
+    data.converge = data.convergeCycles = None
+    data.sRate = args.srate
+    data.cycles = args.cycles
+    data.array = waveform.ramp(0,1,args.points).array
+    firstPoint = []
+
+    def run():
+        potentiostat.initWaveform(data)
+        if potentiostat.CONTINUOUS: potentiostat.getreadings(data)
+        while data.cyclesRun < data.cycles:
+            potentiostat.getreading(data)
+            data.first = False
+
+    def runThread():
+        potentiostat.initDataset(data)
+        worker = potentiostat.Acquisition(data)
+        worker.start()
+        while data.cyclesRun < data.cycles:
+            kind,value = worker.queue.get()
+            if kind == "points" and firstPoint == []:
+                firstPoint.append(time.time()-start)
+            elif kind == "cycle":
+                potentiostat.addColumns(data,value)
+                data.cyclesRun += 1
+                data.first = False
+            elif kind == "error": raise value
+        worker.halt()
+
+    start = time.time()
+    if args.profile:
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        profile.runcall(runThread if args.thread else run)
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(15)
+    elif args.thread: runThread()
+    else: run()
+    total = time.time()-start
+    points = int(data.dataset.lengths.sum())
+    print("%d cycles, %d points in %.3f s" % (data.cyclesRun,points,total))
+    calls,perCall = potentiostat.cookRate(data)
+    print("%.1f Cook calls per cycle, %.1f points per call" % (calls,perCall))
+    if firstPoint != []:
+        print("first point after %.1f ms" % (firstPoint[0]*1000))
+    if args.timing: print(perf.formatReport(data.perf))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/python
+
+# jobqueue.py
+
+# This file defines a queue of runs kept in a file, and a scheduler that
+# works through it with no one at the UI. Each job holds what the UI
+# buttons hold for a run: signal file, sample rate, cycles and output
+# name, plus the O2 logger settings and optionally the potentiostat to
+# use. The queue is written back after every change of state, so a
+# scheduler that is restarted carries on with the next pending job.
+
+#   python jobqueue.py queue.json add --waveform sig.txt --cycles 50 \
+#       --output runs/a.txt
+#   python jobqueue.py queue.json run
+
+import os
+import sys
+import time
+import json
+import threading
+
+import gamry
+from session import Session
+
+# settings of a new job
+JOB_DEFAULTS = {"waveform": "", "sRate": None, "cycles": None,
+                "output": None, "o2": None, "stream": True, "binary": None,
+                "section": None, "channels": None, "converge": None,
+                "convergeCycles": None}
+
+# Session arguments taken from a job
+RUN_KEYS = ["waveform","sRate","cycles","output","o2","stream","binary",
+            "channels","converge","convergeCycles"]
+
+# This class holds the jobs, in the order they run, and the file they
+# are kept in. A job is a dict of its settings and its state: pending,
+# running, done, failed or stopped. A job that was running when the
+# file was last written did not finish, so it is pending again.
+class JobQueue(object):
+
+    def __init__(self,path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.jobs = []
+        if os.path.exists(path): self.load()
+
+    # This function reads the jobs from the file.
+    def load(self):
+        with open(self.path,"rt") as f:
+            self.jobs = json.load(f)
+        for job in self.jobs:
+            if job["state"] == "running": job["state"] = "pending"
+
+    # This function writes the jobs to the file, replacing it only once
+    # they are all written.
+    def save(self):
+        temp = self.path + ".tmp"
+        with open(temp,"wt") as f:
+            json.dump(self.jobs,f,indent=1,sort_keys=True)
+        # Windows will not rename over an existing file
+        if os.name == "nt" and os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(temp,self.path)
+
+    # This function adds a job to the end of the queue and returns it.
+    def add(self,**settings):
+        for key in settings:
+            if key not in JOB_DEFAULTS:
+                raise ValueError("unknown job setting: " + str(key))
+        job = dict(JOB_DEFAULTS)
+        job.update(settings)
+        with self.lock:
+            job["id"] = max([j["id"] for j in self.jobs]+[0])+1
+            job["state"] = "pending"
+            job["error"] = None
+            job["cyclesRun"] = 0
+            self.jobs.append(job)
+            self.save()
+        return job
+
+    # This function marks the next pending job as running and returns
+    # it, or None if there is none. Given a section, only jobs for that
+    # potentiostat or for any potentiostat are taken.
+    def take(self,section=None):
+        with self.lock:
+            for job in self.jobs:
+                if job["state"] != "pending": continue
+                if section != None and job["section"] not in [None,section]:
+                    continue
+                job["state"] = "running"
+                job["started"] = time.time()
+                self.save()
+                return job
+        return None
+
+    # This function records how a job ended.
+    def finish(self,job,state,cyclesRun=0,error=None):
+        with self.lock:
+            job["state"] = state
+            job["cyclesRun"] = cyclesRun
+            job["error"] = error
+            job["finished"] = time.time()
+            self.save()
+
+# This class runs the jobs of a queue back to back. Each potentiostat
+# used gets one Session that stays open from one job to the next, so a
+# job only uploads its signal. By default the jobs run one at a time, in
+# order; with parallel set every potentiostat runs on its own thread,
+# taking the next job meant for it or for any potentiostat.
+class Scheduler(object):
+
+    def __init__(self,queue,backend="com",parallel=False):
+        if isinstance(backend,str): backend = gamry.getBackend(backend)
+        self.queue = queue
+        self.backend = backend
+        self.parallel = parallel
+        self.sections = list(backend.deviceList().EnumSections())
+        self.sessions = {} # open session of each potentiostat
+        self.stopped = threading.Event()
+        self.report = None # called with each job as it ends
+
+    # This function returns the open session of a potentiostat.
+    def session(self,section):
+        if section == None: section = self.sections[0]
+        if section not in self.sessions:
+            self.sessions[section] = Session(self.backend,section=section)
+        return self.sessions[section]
+
+    # This function runs one job on a potentiostat's session. A failed
+    # job closes the potentiostat, so the next job opens it afresh.
+    def runJob(self,job,section):
+        session = self.session(section)
+        # queues written before a setting existed lack it
+        settings = dict((key,job.get(key,JOB_DEFAULTS[key]))
+                        for key in RUN_KEYS)
+        try:
+            session.configure(**settings)
+            session.run(close=False)
+        except KeyboardInterrupt:
+            self.queue.finish(job,"stopped",session.cyclesRun)
+            raise
+        except Exception as error:
+            session.close()
+            self.queue.finish(job,"failed",session.cyclesRun,str(error))
+        else:
+            state = "stopped" if self.stopped.is_set() else "done"
+            self.queue.finish(job,state,session.cyclesRun)
+        if self.report != None: self.report(job)
+
+    # This function runs jobs on one potentiostat, or on whichever each
+    # job names, until none are left.
+    def work(self,section=None):
+        self.backend.threadInit()
+        try:
+            while not self.stopped.is_set():
+                job = self.queue.take(section)
+                if job == None: break
+                self.runJob(job,job["section"] or section)
+        finally:
+            for session in self.sessions.values():
+                if section == None or session.section == section:
+                    session.close()
+            self.backend.threadExit()
+
+    # This function ends the jobs once their cycle in progress is read.
+    # It can be called from another thread.
+    def halt(self):
+        self.stopped.set()
+        for session in self.sessions.values():
+            session.halt()
+
+    # This function runs every pending job.
+    def run(self):
+        if not self.parallel:
+            self.work()
+            return
+        # sessions are made before the threads start, so that the threads
+        # never change the dict
+        for section in self.sections:
+            self.session(section)
+        workers = [threading.Thread(target=self.work,args=(section,))
+                   for section in self.sections]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            while True in [worker.is_alive() for worker in workers]:
+                for worker in workers:
+                    worker.join(0.5)
+        except KeyboardInterrupt:
+            self.halt()
+            for worker in workers:
+                worker.join()
+            raise
+
+# This function returns a job as one line of text.
+def formatJob(job):
+    cycles = job["cycles"] if job["cycles"] != None else "-"
+    line = "%3d %-8s %5s/%-5s %-12s %s" % (job["id"],job["state"],
+        job["cyclesRun"],cycles,job["section"] or "any",
+        job["output"] or "(not saved)")
+    if job["error"] != None: line += "  " + job["error"]
+    return line
+
+# This function adds to, lists or runs a queue from the command line.
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Queue potentiostat runs and run them back to back.")
+    parser.add_argument("queue",help="file the queue is kept in")
+    commands = parser.add_subparsers(dest="command")
+    add = commands.add_parser("add",help="add a job to the queue")
+    add.add_argument("--waveform",default="")
+    add.add_argument("--srate",type=float,default=None)
+    add.add_argument("--cycles",type=int,default=None)
+    add.add_argument("--output",default=None)
+    add.add_argument("--o2",default=None,
+                     help="serial port of the O2 logger")
+    add.add_argument("--no-stream",action="store_true")
+    add.add_argument("--binary",action="store_true")
+    add.add_argument("--section",default=None,
+                     help="potentiostat to run on")
+    add.add_argument("--channels",nargs="*",default=None,
+                     help="extra Cook channels to keep")
+    add.add_argument("--converge",type=float,default=None,
+                     help="stop once the cycles are within this tolerance")
+    add.add_argument("--converge-cycles",type=int,default=None)
+    commands.add_parser("list",help="list the jobs")
+    run = commands.add_parser("run",help="run the pending jobs")
+    run.add_argument("--backend",default="com",choices=["com","sim"])
+    run.add_argument("--devices",type=int,default=1,
+                     help="number of simulated potentiostats")
+    run.add_argument("--parallel",action="store_true",
+                     help="run jobs on every potentiostat at once")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queue)
+    if args.command == "add":
+        job = queue.add(waveform=args.waveform,sRate=args.srate,
+                        cycles=args.cycles,output=args.output,o2=args.o2,
+                        stream=not args.no_stream,
+                        binary=args.binary or None,section=args.section,
+                        channels=args.channels,converge=args.converge,
+                        convergeCycles=args.converge_cycles)
+        print(formatJob(job))
+    elif args.command == "list":
+        for job in queue.jobs:
+            print(formatJob(job))
+    else:
+        if args.backend == "sim":
+            backend = gamry.SimBackend(devices=args.devices)
+        else: backend = gamry.getBackend(args.backend)
+        scheduler = Scheduler(queue,backend,args.parallel)
+        def report(job):
+            print(formatJob(job))
+            sys.stdout.flush()
+        scheduler.report = report
+        scheduler.run()
+
+if __name__ == "__main__":
+    main()
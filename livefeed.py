@@ -0,0 +1,291 @@
+#!/usr/bin/python
+
+# livefeed.py
+
+# This file shares a run in progress with other processes. A Publisher
+# is one of the writers of a run: each completed cycle's time, voltage
+# and current arrays, its O2 value and the O2 readings streamed since the
+# last cycle are copied into a memory-mapped file holding a ring of
+# slots, after a small header. Any number of Subscribers map the same
+# file read-only and read the cycles in place, without copying and
+# without any locking, so they cannot slow the acquisition down.
+#
+# Each record has a sequence number. A slot's number is cleared while
+# the slot is rewritten and set once it is complete, and the header's
+# count of records published is raised after that; a reader checks the
+# slot's number before and after using it, to tell if the publisher has
+# lapped it in between.
+
+#   python livefeed.py runs/sample1.feed
+
+import os
+import sys
+import time
+import mmap
+import struct
+
+import numpy as np
+
+MAGIC = b"PSTATFD1"
+VERSION = 1
+
+# magic, version, slots, samples and O2 readings per slot, records
+# published, time the run started, run finished
+HEADER = struct.Struct("<8sIIIIQdI")
+HEADER_SIZE = 64
+
+# record number plus one (0 while written), samples, O2 readings, O2
+# value of the cycle, time published; the record number is the cycle's
+SLOT = struct.Struct("<QIIdd")
+
+# slots in the ring, and O2 readings kept per slot
+SLOTS = 16
+O2_READINGS = 256
+
+# This function returns the path of the feed file of a text file.
+def feedPath(path):
+    return os.path.splitext(path)[0] + ".feed"
+
+# This function returns the bytes of one slot.
+def slotSize(samples,readings):
+    return SLOT.size+8*(3*samples+2*readings)
+
+####################################
+# Publisher
+####################################
+
+# This class publishes the cycles of a run to a feed file, taking room
+# for slots cycles of up to samples samples each; longer cycles are cut
+# to fit. dataset holds the O2 value of each cycle, and o2stream is a
+# function returning the O2 stream of the run, or None, whose readings
+# are published with the cycles. An existing feed file of the same size
+# is rewritten in place, so subscribers still holding it see the new run.
+class Publisher(object):
+
+    def __init__(self,path,samples,dataset=None,o2stream=None,slots=SLOTS,
+                 readings=O2_READINGS):
+        self.path = path
+        self.samples = max(int(samples),1)
+        self.readings = readings
+        self.slots = slots
+        self.dataset = dataset
+        self.o2stream = o2stream
+        self.slotSize = slotSize(self.samples,readings)
+        size = HEADER_SIZE+slots*self.slotSize
+        mode = "w+b"
+        if os.path.exists(path):
+            if os.path.getsize(path) == size: mode = "r+b"
+            # a file of another layout is replaced rather than resized
+            # under subscribers still mapping it
+            else: os.remove(path)
+        self.file = open(path,mode)
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(),size)
+        self.published = 0
+        self.started = time.time()
+        self.lastO2 = None # time of the last O2 reading published
+        self.header(False)
+        # slots of the last run are no longer valid
+        self.map[HEADER_SIZE:size] = b"\0"*(size-HEADER_SIZE)
+
+    # This function writes the header.
+    def header(self,finished):
+        self.map[:HEADER.size] = HEADER.pack(MAGIC,VERSION,self.slots,
+            self.samples,self.readings,self.published,self.started,
+            int(finished))
+
+    # This function returns an array over part of the file, in place.
+    def view(self,offset,count):
+        return np.frombuffer(self.map,dtype="<f8",count=count,offset=offset)
+
+    # This function publishes a completed cycle.
+    def addCycle(self,t,v,a,channels=None):
+        n = min(len(t),len(v),len(a),self.samples)
+        o2 = np.nan
+        if self.dataset != None and len(self.dataset) > 0:
+            o2 = self.dataset.cycleO2()[-1]
+        times,values = self.newReadings()
+        record = self.published
+        offset = HEADER_SIZE+(record % self.slots)*self.slotSize
+        # clears the slot's number while it is rewritten
+        self.map[offset:offset+SLOT.size] = SLOT.pack(0,n,len(times),o2,
+                                                      time.time())
+        data = offset+SLOT.size
+        for column in [t,v,a]:
+            self.view(data,n)[:] = column[:n]
+            data += 8*self.samples
+        self.view(data,len(times))[:] = times
+        self.view(data+8*self.readings,len(values))[:] = values
+        self.map[offset:offset+8] = struct.pack("<Q",record+1)
+        self.published += 1
+        self.header(False)
+
+    # This function returns the O2 readings streamed since the last cycle
+    # was published, as arrays of host times and values, the latest
+    # readings only if there are more than a slot holds.
+    def newReadings(self):
+        stream = self.o2stream() if self.o2stream != None else None
+        if stream == None: return np.empty(0),np.empty(0)
+        times,values = stream.readings(self.lastO2)
+        if self.lastO2 != None:
+            keep = times > self.lastO2
+            times,values = times[keep],values[keep]
+        if len(times) > 0: self.lastO2 = times[-1]
+        return times[-self.readings:],values[-self.readings:]
+
+    # This function marks the run as finished and closes the file, which
+    # is left for subscribers to read.
+    def finish(self,O2vals,cycleO2=None):
+        self.header(True)
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+####################################
+# Subscriber
+####################################
+
+# This class is a cycle read from a feed: its record number, cycle, O2
+# value and publish time, with its time, voltage and current arrays and
+# its O2 readings (o2Times, o2Values) as arrays over the feed file. They
+# are not copied, so they change if the publisher laps the ring; valid
+# says whether they still hold this cycle, and copy takes them out of the
+# file.
+class Cycle(object):
+
+    def __init__(self,feed,offset):
+        self.feed = feed
+        self.offset = offset
+        (seq,n,readings,self.o2,
+         self.published) = SLOT.unpack_from(feed.map,offset)
+        self.record = self.cycle = seq-1
+        data = offset+SLOT.size
+        self.time = feed.view(data,n)
+        self.voltage = feed.view(data+8*feed.samples,n)
+        self.current = feed.view(data+16*feed.samples,n)
+        data += 24*feed.samples
+        self.o2Times = feed.view(data,readings)
+        self.o2Values = feed.view(data+8*feed.readings,readings)
+
+    # This function returns whether the slot still holds this cycle.
+    def valid(self):
+        seq = struct.unpack_from("<Q",self.feed.map,self.offset)[0]
+        return seq == self.record+1
+
+    # This function copies the arrays out of the feed file, returning
+    # None if the publisher has already lapped the cycle.
+    def copy(self):
+        arrays = [np.array(x) for x in [self.time,self.voltage,self.current,
+                                        self.o2Times,self.o2Values]]
+        if not self.valid(): return None
+        return arrays
+
+# This class reads the cycles of a feed file as they are published.
+# Reading starts from the oldest cycle still in the ring, or only from
+# cycles published after it is opened if latest is set. A new run in the
+# same file starts over from its first cycle.
+class Subscriber(object):
+
+    def __init__(self,path,latest=False):
+        self.path = path
+        self.map = None
+        self.started = None
+        self.dropped = 0 # cycles lapped before they were read
+        self.open()
+        self.next = self.published if latest else self.oldest()
+
+    # This function maps the feed file and reads its layout.
+    def open(self):
+        if self.map != None: self.map.close()
+        with open(self.path,"rb") as f:
+            self.map = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino,stat.st_size)
+        (magic,version,self.slots,self.samples,self.readings,self.published,
+         self.started,finished) = HEADER.unpack_from(self.map,0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("not a feed file: " + str(self.path))
+        self.slotSize = slotSize(self.samples,self.readings)
+        self.finished = bool(finished)
+
+    # This function returns an array over part of the file, in place.
+    def view(self,offset,count):
+        return np.frombuffer(self.map,dtype="<f8",count=count,offset=offset)
+
+    # This function reads the header again, following the publisher to a
+    # new run if one has started, in this file or in a new one.
+    def refresh(self):
+        (_,_,_,_,_,self.published,started,
+         finished) = HEADER.unpack_from(self.map,0)
+        if finished and self.replaced(): started = None
+        if started != self.started:
+            self.open()
+            self.next = 0
+        self.finished = bool(finished)
+
+    # This function returns whether the feed file has been replaced by
+    # a new one since it was mapped.
+    def replaced(self):
+        try: stat = os.stat(self.path)
+        except OSError: return False
+        return (stat.st_ino,stat.st_size) != self.identity
+
+    # This function returns the record number of the oldest cycle held.
+    def oldest(self):
+        return max(self.published-self.slots,0)
+
+    # This function returns the cycles published since the last call.
+    # Cycles the publisher has lapped are skipped and counted in dropped.
+    def poll(self):
+        self.refresh()
+        if self.next < self.oldest():
+            self.dropped += self.oldest()-self.next
+            self.next = self.oldest()
+        cycles = []
+        while self.next < self.published:
+            offset = HEADER_SIZE+(self.next % self.slots)*self.slotSize
+            cycle = Cycle(self,offset)
+            if cycle.record != self.next:
+                # lapped while reading
+                self.dropped += 1
+            else: cycles.append(cycle)
+            self.next += 1
+        return cycles
+
+    # This function waits for new cycles, returning them, or an empty
+    # list once the run has finished or the timeout has passed.
+    def wait(self,timeout=None,interval=0.01):
+        end = None if timeout == None else time.time()+timeout
+        while True:
+            cycles = self.poll()
+            if cycles != [] or self.finished: return cycles
+            if end != None and time.time() >= end: return []
+            time.sleep(interval)
+
+    def close(self):
+        self.map.close()
+
+# This function follows a feed from the command line, printing each
+# cycle as it is published.
+def main():
+    if len(sys.argv) != 2:
+        print("usage: livefeed.py FEED")
+        raise SystemExit(2)
+    feed = Subscriber(sys.argv[1])
+    try:
+        while True:
+            for cycle in feed.wait():
+                current = cycle.current
+                if len(current) == 0: continue
+                line = "cycle %d: %d samples, current %.3g to %.3g A" % (
+                    cycle.cycle,len(current),current.min(),current.max())
+                if not np.isnan(cycle.o2): line += ", O2 %.2f" % cycle.o2
+                if cycle.valid(): print(line)
+            sys.stdout.flush()
+            if feed.finished and feed.next == feed.published: break
+    except KeyboardInterrupt: pass
+    if feed.dropped: print("%d cycles dropped" % feed.dropped)
+    feed.close()
+
+if __name__ == "__main__":
+    main()
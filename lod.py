@@ -0,0 +1,143 @@
+#!/usr/bin/python
+
+# lod.py
+
+# This file defines a level-of-detail index of a run: the lowest and
+# highest time, voltage and current of every bin of samples, at a ladder
+# of bin sizes. The finest level has LEAF samples per bin and each level
+# above it FANOUT bins of the one below per bin. Adding samples only
+# touches the last bins of each level, and a view of any span of the run
+# is read from the level whose bins are about one pixel wide, so drawing
+# and scaling a view takes time in proportion to its width in pixels,
+# not to the samples it covers.
+
+import numpy as np
+
+# samples per bin of the finest level, and bins per bin of the next
+LEAF = 16
+FANOUT = 8
+
+# columns of the index
+COLUMNS = ["time","voltage","current"]
+
+# This class holds one level of the index: the lows and highs of each
+# bin as bins x columns arrays that double their rows as they fill.
+class Level(object):
+
+    def __init__(self,size,columns):
+        self.size = size # samples per bin
+        self.lows = np.empty((16,columns))
+        self.highs = np.empty((16,columns))
+        self.bins = 0 # number of bins in use; the last may be partial
+
+    # This function makes room for a number of bins.
+    def reserve(self,bins):
+        if bins <= len(self.lows): return
+        capacity = len(self.lows)
+        while capacity < bins: capacity *= 2
+        for name in ["lows","highs"]:
+            old = getattr(self,name)
+            new = np.empty((capacity,old.shape[1]))
+            new[:self.bins] = old[:self.bins]
+            setattr(self,name,new)
+
+    # This function sets bins from first onwards to lows and highs
+    # covering them, merging the first with what that bin held already
+    # if partial is set.
+    def update(self,first,lows,highs,partial):
+        self.reserve(first+len(lows))
+        if partial:
+            lows[0] = np.minimum(lows[0],self.lows[first])
+            highs[0] = np.maximum(highs[0],self.highs[first])
+        self.lows[first:first+len(lows)] = lows
+        self.highs[first:first+len(highs)] = highs
+        self.bins = first+len(lows)
+
+# This class holds the index of a run, with the number of samples added.
+class Pyramid(object):
+
+    def __init__(self,columns=len(COLUMNS),leaf=LEAF,fanout=FANOUT):
+        self.columns = columns
+        self.leaf = leaf
+        self.fanout = fanout
+        self.levels = [Level(leaf,columns)]
+        self.count = 0 # samples added
+
+    def __len__(self):
+        return self.count
+
+    # This function adds samples to the end of the index, given as one
+    # array per column. Only the bins the samples fall in are updated,
+    # and on each level above only the bins holding those.
+    def extend(self,*columns):
+        values = np.column_stack([np.asarray(c,dtype=np.float64)
+                                  for c in columns])
+        n = len(values)
+        if n == 0: return
+        # splits the samples at the edges of the finest bins
+        start = self.count
+        bins = (start+np.arange(n))//self.leaf
+        edges = np.flatnonzero(np.diff(bins))+1
+        cuts = np.concatenate(([0],edges))
+        lows = np.minimum.reduceat(values,cuts,axis=0)
+        highs = np.maximum.reduceat(values,cuts,axis=0)
+        self.levels[0].update(bins[0],lows,highs,start % self.leaf != 0)
+        self.count += n
+        # rebuilds the bins above the changed ones, level by level
+        level = 0
+        while self.levels[level].bins > 1:
+            below = self.levels[level]
+            if level+1 == len(self.levels):
+                self.levels.append(Level(below.size*self.fanout,
+                                         self.columns))
+            first = bins[0]//self.fanout
+            cuts = np.arange(first*self.fanout,below.bins,self.fanout)
+            lows = np.minimum.reduceat(below.lows[:below.bins],cuts,axis=0)
+            highs = np.maximum.reduceat(below.highs[:below.bins],cuts,axis=0)
+            self.levels[level+1].update(first,lows,highs,False)
+            bins = np.array([first])
+            level += 1
+
+    # This function returns the level whose bins cover a span of samples
+    # in at most about the given number of bins.
+    def levelFor(self,span,bins):
+        for level in self.levels:
+            if span <= level.size*max(bins,1): return level
+        return self.levels[-1]
+
+    # This function returns the bins of the level chosen for a span of
+    # samples, as the first sample of each bin and the bins x columns
+    # lows and highs, without copying. The bins at either end may hold
+    # samples just outside the span.
+    def query(self,start,stop,bins):
+        start,stop = max(int(start),0),min(int(stop),self.count)
+        if stop <= start:
+            empty = np.empty((0,self.columns))
+            return np.empty(0,dtype=np.int64),empty,empty
+        level = self.levelFor(stop-start,bins)
+        first = start//level.size
+        last = (stop-1)//level.size+1
+        return (np.arange(first,last)*level.size,level.lows[first:last],
+                level.highs[first:last])
+
+    # This function returns the lowest and highest value of each column
+    # over a span of samples, to the nearest bin, or None for an empty
+    # span.
+    def bounds(self,start=0,stop=None,bins=64):
+        if stop == None: stop = self.count
+        _,lows,highs = self.query(start,stop,bins)
+        if len(lows) == 0: return None
+        return lows.min(axis=0),highs.max(axis=0)
+
+    # This function returns a column over a span of samples as a trace of
+    # about two points per bin, the low and high of each bin, for drawing,
+    # as arrays of sample numbers and values.
+    def trace(self,column,start,stop,bins):
+        firsts,lows,highs = self.query(start,stop,bins)
+        if len(firsts) == 0: return np.empty(0),np.empty(0)
+        size = self.levelFor(min(stop,self.count)-max(start,0),bins).size
+        xs = np.repeat(firsts+size/2.0,2)
+        ys = np.empty(2*len(firsts))
+        ys[0::2] = lows[:,column]
+        ys[1::2] = highs[:,column]
+        return xs,ys
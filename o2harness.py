@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+# o2harness.py
+
+# This file defines a stand-in for the Arduino O2 logger on a
+# pseudo-terminal, so the host side of the serial link (o2logger.py) can
+# be exercised without the hardware. Running the file checks the binary
+# download, its checksum retry, the fallback to text mode, streaming,
+# and starting an old logger without it.
+
+import os
+import pty
+import time
+import tty
+import select
+import struct
+import threading
+
+from o2logger import FRAME_START, crc16
+
+# This class answers the logger's serial commands on a pseudo-terminal.
+# The host opens the port at self.port. An old logger only knows the
+# text commands, sent bare, and does not answer start; corrupt makes the
+# first binary frames fail their checksum.
+class FakeLogger(threading.Thread):
+
+    def __init__(self,values,old=False,corrupt=0,delay=0.0,period=3.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.values = list(values) # values logged so far
+        self.old = old # only answers start and send
+        self.corrupt = corrupt # number of frames sent with a bad checksum
+        self.delay = delay # seconds between text lines (100 ms on board)
+        self.period = period # seconds between streamed readings
+        self.streaming = False
+        self.started = time.time() # when the board was powered
+        self.lastReading = 0.0
+        self.commands = [] # commands received, in order
+        self.pending = b"" # bytes received after the last command
+        self.master,slave = pty.openpty()
+        tty.setraw(slave)
+        self.port = os.ttyname(slave)
+        self.slave = slave
+        self.running = True
+        self.start()
+
+    # This function reads one command: a line, or whatever arrives before
+    # the line goes quiet. An old logger takes everything up to the quiet,
+    # line endings and all.
+    def readCommand(self):
+        data,self.pending = self.pending,b""
+        while self.running:
+            if not self.old and b"\n" in data:
+                line,_,self.pending = data.partition(b"\n")
+                return line.strip().decode("ascii")
+            self.stream()
+            ready,_,_ = select.select([self.master],[],[],0.01)
+            if ready: data += os.read(self.master,1024)
+            elif data != b"":
+                if not self.old: data = data.strip()
+                return data.decode("ascii")
+        return None
+
+    def write(self,data):
+        os.write(self.master,data)
+
+    # This function takes and streams a reading when one is due.
+    def stream(self):
+        now = time.time()
+        if not self.streaming or now-self.lastReading < self.period: return
+        self.lastReading = now
+        value = 20.9-0.01*len(self.values)
+        self.values.append(value)
+        millis = int((now-self.started)*1000)
+        self.write(("O2,%d,%.2f\r\n" % (millis,value)).encode("ascii"))
+
+    def run(self):
+        while self.running:
+            command = self.readCommand()
+            if command == None: break
+            self.commands.append(command)
+            if command == "start":
+                self.values = []
+                self.streaming = False
+                if not self.old: self.write(b"ok\r\n")
+            elif command == "send":
+                self.write(("%d\r\n" % len(self.values)).encode("ascii"))
+                for value in self.values:
+                    self.write(("%.2f\r\n" % value).encode("ascii"))
+                    time.sleep(self.delay)
+            elif self.old: continue
+            elif command == "stream": self.streaming = True
+            elif command == "stop": self.streaming = False
+            elif command == "dump": self.write(self.frame())
+            elif command.startswith("baud"): self.write(b"ok\r\n")
+
+    # This function builds a binary frame of the logged values.
+    def frame(self):
+        body = struct.pack("<H%df" % len(self.values),len(self.values),
+                           *self.values)
+        check = crc16(body)
+        if self.corrupt > 0:
+            self.corrupt -= 1
+            check ^= 0xFFFF
+        return FRAME_START+body+struct.pack("<H",check)
+
+    def close(self):
+        self.running = False
+        self.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+# This function downloads from a fake logger, returning the values, the
+# commands the logger received and the time taken.
+def download(values,**options):
+    import serial
+    from o2logger import O2Logger
+    logger = FakeLogger(values,**options)
+    ser = serial.Serial(logger.port,9600,timeout=1)
+    host = O2Logger(ser,timeout=1.0)
+    start = time.time()
+    got = host.download()
+    taken = time.time()-start
+    ser.close()
+    logger.close()
+    return got,logger.commands,taken
+
+# This function streams from a fake logger for a while, returning the
+# stream and the times it was started and stopped.
+def stream(seconds,**options):
+    import serial
+    from o2logger import O2Logger
+    logger = FakeLogger([],**options)
+    ser = serial.Serial(logger.port,9600,timeout=1)
+    host = O2Logger(ser,timeout=1.0,ackTimeout=0.3)
+    host.start()
+    started = time.time()
+    readings = host.stream()
+    time.sleep(seconds)
+    if readings != None: host.stopStream(readings)
+    stopped = time.time()
+    ser.close()
+    logger.close()
+    return readings,started,stopped,logger.commands
+
+# This function checks each way a download can go, and streaming.
+def main():
+    values = [20.9-0.01*i for i in range(1000)]
+    expected = [round(value,2) for value in values]
+    checks = [("binary",{},["baud115200","dump","baud9600"]),
+              ("checksum retry",{"corrupt":1},
+               ["baud115200","dump","dump","baud9600"]),
+              ("bad frames",{"corrupt":2},
+               ["baud115200","dump","dump","send","baud9600"]),
+              ("old logger",{"old":True,"delay":0.001},
+               ["baud115200","send"])]
+    failed = 0
+    for name,options,commands in checks:
+        got,received,taken = download(values,**options)
+        ok = ([round(x,2) for x in got] == expected and
+              received == commands)
+        if not ok: failed += 1
+        print("%-16s %s  %.3f s  %s" % (name,"ok" if ok else "FAILED",taken,
+                                        ",".join(received)))
+    # a reading every 50 ms, lined up with a cycle in the middle
+    readings,started,stopped,received = stream(1.0,period=0.05)
+    times,got = readings.readings()
+    middle = (started+stopped)/2.0
+    value = readings.cycleValue(middle,[0.0,0.0])
+    ok = (readings.count >= 15 and got[0] > got[-1] and
+          started <= times[0] and times[-1] <= stopped and
+          got.min() <= value <= got.max() and
+          received == ["start","stream","stop"])
+    if not ok: failed += 1
+    print("%-16s %s  %d readings" % ("stream","ok" if ok else "FAILED",
+                                     readings.count))
+    # an old logger is started with the bare command and not streamed
+    readings,_,_,received = stream(0.2,old=True,period=0.05)
+    ok = readings == None and received == ["start"]
+    if not ok: failed += 1
+    print("%-16s %s  %s" % ("old logger start","ok" if ok else "FAILED",
+                            ",".join(received)))
+    raise SystemExit(failed)
+
+if __name__ == "__main__":
+    main()
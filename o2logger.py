@@ -0,0 +1,260 @@
+#!/usr/bin/python
+
+# o2logger.py
+
+# This file defines the host side of the serial link to the Arduino O2
+# logger (potentiostat_O2.ino). The logger can stream its readings as they
+# are taken, which are read on a background thread and matched to the
+# host clock so they can be lined up with the potentiostat cycles. The
+# logged values can also be downloaded at the end, as one binary frame at
+# a negotiated higher baud rate, falling back to the original
+# one-value-per-line text mode if the logger does not answer.
+#
+# Commands are lines ending in a newline once the logger has shown it
+# reads them that way, by answering "ok" to start. Until then they are
+# sent bare, as the original sketch wants them, and a logger that never
+# answers is driven the original way: it is started, and its values are
+# downloaded as text at the end, without streaming.
+
+import time
+import struct
+import binascii
+import threading
+from collections import deque
+
+import numpy as np
+
+FRAME_START = b"\xa5\x5a"
+FAST_BAUD = 115200
+COMMAND_GAP = 0.15 # seconds between bare commands, so they are read apart
+ACK_TIMEOUT = 1.0 # seconds to wait for the logger to answer start
+STREAM_KEEP = 100000 # streamed readings kept, about 3 days at one per 3 s
+
+# This class is raised when a frame fails its checksum.
+class FrameError(IOError):
+    pass
+
+# This function returns the CRC-16/CCITT of some bytes, as computed by
+# the logger.
+def crc16(data,crc=0xFFFF):
+    return binascii.crc_hqx(data,crc)
+
+# This function reads exactly n bytes from the port, or fails once the
+# port times out.
+def readExact(ser,n):
+    data = b""
+    while len(data) < n:
+        chunk = ser.read(n-len(data))
+        if len(chunk) == 0:
+            raise IOError("timed out reading from O2 logger")
+        data += chunk
+    return data
+
+# This function reads a binary frame of float32 values from the port,
+# skipping anything before the start of the frame.
+def readFrame(ser):
+    window = b""
+    while window != FRAME_START:
+        window = (window+readExact(ser,1))[-2:]
+    header = readExact(ser,2)
+    count = struct.unpack("<H",header)[0]
+    payload = readExact(ser,4*count)
+    check = struct.unpack("<H",readExact(ser,2))[0]
+    if crc16(header+payload) != check:
+        raise FrameError("O2 frame failed its checksum")
+    return list(struct.unpack("<%df" % count,payload))
+
+# This function formats O2 values as the last line of the output file.
+def formatO2(values):
+    return "O2,vals" + "".join(",%.2f" % value for value in values)
+
+# This class talks to the O2 logger over an open serial port.
+class O2Logger(object):
+
+    def __init__(self,ser,fast=FAST_BAUD,timeout=5.0,retries=2,
+                 ackTimeout=ACK_TIMEOUT):
+        self.ser = ser
+        self.baud = ser.baudrate # rate the logger starts at
+        self.fast = fast # rate to download at, or None for text mode
+        self.timeout = timeout # seconds to wait for the logger to answer
+        self.retries = retries # binary downloads tried before text mode
+        self.ackTimeout = ackTimeout # seconds to wait for start's answer
+        self.sent = 0 # time the last command was sent
+        # the original sketch, which neither answers nor reads lines;
+        # None until the logger has shown which it is
+        self.legacy = None
+
+    # This function sends a command: a line once the logger is known to
+    # read lines, otherwise the bare command after a gap since the last.
+    def command(self,text):
+        if self.legacy == False: text += "\n"
+        else:
+            wait = self.sent+COMMAND_GAP-time.time()
+            if wait > 0: time.sleep(wait)
+        self.ser.write(text.encode("ascii"))
+        self.sent = time.time()
+
+    # This function returns the next line from the logger that is not a
+    # streamed reading, or None if none comes within timeout seconds.
+    def reply(self,timeout):
+        old = self.ser.timeout
+        end = time.time()+timeout
+        try:
+            while True:
+                self.ser.timeout = max(end-time.time(),0.001)
+                line = self.ser.readline()
+                if not line.endswith(b"\n"): return None
+                if not line.startswith(b"O2,"): return line.strip()
+        finally:
+            self.ser.timeout = old
+
+    # This function starts a new log. A logger that does not answer is
+    # taken to be running the original sketch.
+    def start(self):
+        self.ser.reset_input_buffer()
+        self.command("start")
+        if self.legacy == True: return
+        self.legacy = self.reply(self.ackTimeout) != b"ok"
+
+    # This function has the logger stream its readings as they are taken,
+    # returning the stream that reads them, or None for a logger that
+    # has not answered start, which only downloads its values.
+    def stream(self,keep=STREAM_KEEP):
+        if self.legacy != False: return None
+        self.command("stream")
+        return O2Stream(self.ser,keep)
+
+    # This function stops the logger and the stream reading it.
+    def stopStream(self,stream):
+        self.command("stop")
+        stream.halt()
+
+    # This function stops logging and returns the logged values.
+    def download(self):
+        timeout = self.ser.timeout
+        self.ser.timeout = self.timeout
+        try:
+            switched = self.fast != None and self.setBaud(self.fast)
+            values = None
+            if switched:
+                for _ in range(self.retries):
+                    try:
+                        values = self.downloadBinary()
+                        break
+                    except IOError:
+                        self.ser.reset_input_buffer()
+            if values == None: values = self.downloadText()
+            if switched: self.setBaud(self.baud)
+            return values
+        finally:
+            self.ser.timeout = timeout
+
+    # This function asks the logger to change its baud rate and follows
+    # it, returning whether the logger agreed. A logger that does not
+    # answer is taken to be running the original sketch.
+    def setBaud(self,baud):
+        if self.legacy == True: return False
+        self.ser.reset_input_buffer()
+        self.command("baud%d" % baud)
+        reply = self.reply(self.timeout)
+        if self.legacy == None: self.legacy = reply == None
+        if reply != b"ok": return False
+        self.ser.baudrate = baud
+        time.sleep(0.05)
+        return True
+
+    # This function downloads the values as one binary frame.
+    def downloadBinary(self):
+        self.command("dump")
+        return readFrame(self.ser)
+
+    # This function downloads the values one line at a time.
+    def downloadText(self):
+        self.command("send")
+        num = int(self.ser.readline().strip())
+        values = []
+        for _ in range(num):
+            line = self.ser.readline().strip()
+            try: values.append(float(line))
+            except ValueError: pass
+        return values
+
+# This class reads streamed readings ("O2,<millis>,<value>" lines) from
+# the logger on a background thread. Each reading is put on the host
+# clock using the smallest recent difference between its arrival time
+# and the logger's millis(), which follows any drift between the clocks
+# without the jitter of the serial link. Only the last keep readings are
+# held.
+class O2Stream(threading.Thread):
+
+    def __init__(self,ser,keep=STREAM_KEEP,window=20):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.ser = ser
+        self.timeout = ser.timeout
+        self.ser.timeout = 0.5 # lets the thread notice when it is halted
+        self.samples = deque(maxlen=keep) # (host time, value)
+        self.offsets = deque(maxlen=window) # arrival time - logger time
+        self.lock = threading.Lock()
+        self.count = 0 # readings received
+        self.running = True
+        self.start()
+
+    def run(self):
+        while self.running:
+            line = self.ser.readline()
+            received = time.time()
+            parts = line.strip().split(b",")
+            if len(parts) != 3 or parts[0] != b"O2": continue
+            try: millis,value = int(parts[1]),float(parts[2])
+            except ValueError: continue
+            self.offsets.append(received-millis/1000.0)
+            with self.lock:
+                self.samples.append((millis/1000.0+min(self.offsets),value))
+                self.count += 1
+
+    # This function stops reading, once the line in progress is read.
+    def halt(self):
+        self.running = False
+        if self.is_alive(): self.join()
+        self.ser.timeout = self.timeout
+
+    # This function returns the readings held, as arrays of host times
+    # and values. Given a time, only the readings from the last one
+    # before it onwards are returned.
+    def readings(self,since=None):
+        with self.lock:
+            if since == None: samples = list(self.samples)
+            else:
+                samples = []
+                for sample in reversed(self.samples):
+                    samples.append(sample)
+                    if sample[0] < since: break
+                samples.reverse()
+        if samples == []: return np.empty(0),np.empty(0)
+        times,values = zip(*samples)
+        return np.array(times),np.array(values)
+
+    # This function returns the values of the readings held.
+    def values(self):
+        return self.readings()[1].tolist()
+
+    # This function returns the O2 value at each of the given host times,
+    # interpolated between readings and held beyond the first and last;
+    # nan while there are no readings.
+    def interpolate(self,times):
+        times = np.asarray(times,dtype=np.float64)
+        if len(times) == 0: return times
+        sampleTimes,values = self.readings(times.min())
+        if len(values) == 0: return np.full(times.shape,np.nan)
+        return np.interp(times,sampleTimes,values)
+
+    # This function returns the O2 value of each sample of a cycle that
+    # started at host time start, from the cycle's time column t.
+    def align(self,start,t):
+        return self.interpolate(start+np.asarray(t,dtype=np.float64))
+
+    # This function returns the O2 value at the middle of a cycle.
+    def cycleValue(self,start,t):
+        if len(t) == 0: return np.nan
+        return float(self.interpolate([start+(t[0]+t[-1])/2.0])[0])
@@ -0,0 +1,229 @@
+#!/usr/bin/python
+
+# perf.py
+
+# This file defines the timing of a run: named spans around the stages
+# of the acquisition and drawing code, counters, and a histogram of the
+# durations of each span, written as a JSON report next to the data file
+# at the end of the run. Each run has its own Recorder, which the threads
+# working on the run bind with use(), so runs going on at once on other
+# threads are timed apart. setEnabled(False) turns it all off, leaving
+# one flag test per call.
+
+import time
+import json
+import threading
+
+import numpy as np
+
+# histogram buckets of a span: bucket i holds durations from 2**(i-OFFSET)
+# up to twice that, so the buckets run from about 1 us to 2000 s
+BUCKETS = 32
+OFFSET = 20
+
+# durations held before they are added to the histogram
+FOLD = 4096
+
+# This class holds the durations of one span: their count, total and
+# extremes, and a histogram on a log2 scale. New durations are only
+# appended to a list, and added to the histogram in blocks.
+class Timing(object):
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.low = None
+        self.high = 0.0
+        self.buckets = np.zeros(BUCKETS,dtype=np.int64)
+        self.pending = [] # durations not yet in the histogram
+        self.lock = threading.Lock()
+
+    def add(self,seconds):
+        with self.lock:
+            self.pending.append(seconds)
+            full = len(self.pending) >= FOLD
+        if full: self.fold()
+
+    # This function adds the pending durations to the histogram.
+    def fold(self):
+        with self.lock:
+            values,self.pending = self.pending,[]
+            if values == []: return
+            values = np.array(values)
+            self.count += len(values)
+            self.total += values.sum()
+            low = values.min()
+            if self.low == None or low < self.low: self.low = float(low)
+            self.high = max(self.high,float(values.max()))
+            exponents = np.frexp(np.maximum(values,0))[1]-1+OFFSET
+            exponents[values <= 0] = 0
+            self.buckets += np.bincount(np.clip(exponents,0,BUCKETS-1),
+                                        minlength=BUCKETS)
+
+    # This function returns the upper edge of the bucket holding a
+    # fraction of the durations, an estimate of that percentile kept
+    # within the shortest and longest duration, or None without any.
+    def quantile(self,fraction):
+        if self.count == 0: return None
+        seen = 0
+        edge = self.high
+        for i,count in enumerate(self.buckets):
+            seen += count
+            if seen >= fraction*self.count:
+                edge = 2.0**(i+1-OFFSET)
+                break
+        return min(max(edge,self.low),self.high)
+
+    def report(self):
+        self.fold()
+        used = [i for i in range(BUCKETS) if self.buckets[i] > 0]
+        histogram = {}
+        if used != []:
+            first,last = used[0],used[-1]
+            histogram = {"edges": [2.0**(i-OFFSET) for i in
+                                   range(first,last+2)],
+                         "counts": self.buckets[first:last+1].tolist()}
+        return {"count": self.count, "total": self.total,
+                "mean": self.total/self.count if self.count else 0.0,
+                "min": self.low, "max": self.high,
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9),
+                "p99": self.quantile(0.99), "histogram": histogram}
+
+# This class collects the spans and counters of a run. It is shared by
+# the UI and acquisition threads of the run, so counters and laps are
+# updated under its lock.
+class Recorder(object):
+
+    def __init__(self):
+        self.started = time.time()
+        self.timings = {} # Timing of each span
+        self.counters = {} # value of each counter
+        self.laps = {} # time of the last lap of each name
+        self.lock = threading.Lock()
+
+    def record(self,name,seconds):
+        timing = self.timings.get(name)
+        if timing == None:
+            with self.lock:
+                timing = self.timings.setdefault(name,Timing())
+        timing.add(seconds)
+
+    def count(self,name,n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name,0)+n
+
+    # This function records the time since the last lap of the same name.
+    def lap(self,name):
+        now = time.time()
+        with self.lock:
+            last = self.laps.get(name)
+            self.laps[name] = now
+        if last != None: self.record(name,now-last)
+
+    def report(self,meta=None):
+        with self.lock:
+            timings = list(self.timings.items())
+            counters = dict(self.counters)
+        spans = dict((name,timing.report()) for (name,timing) in timings)
+        return {"started": self.started,
+                "elapsed": time.time()-self.started,
+                "meta": meta or {}, "counters": counters, "spans": spans}
+
+# This class times the code in a with block as a span.
+class Span(object):
+
+    def __init__(self,name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self,kind,value,traceback):
+        current().record(self.name,time.time()-self.start)
+        return False
+
+# This class stands in for a span while timing is off.
+class NoSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,kind,value,traceback):
+        return False
+
+NOSPAN = NoSpan()
+
+enabled = True
+default = Recorder() # recorder of threads not working on a run
+bound = threading.local() # recorder of each thread
+
+# This function turns timing on or off.
+def setEnabled(on):
+    global enabled
+    enabled = on
+
+# This function has the calling thread record into a recorder, the one
+# of the run it works on.
+def use(recorder):
+    bound.recorder = recorder
+
+# This function returns the recorder of the calling thread.
+def current():
+    return getattr(bound,"recorder",default)
+
+# This function starts a new recorder for the calling thread, for a new
+# run, and returns it.
+def reset():
+    recorder = Recorder()
+    use(recorder)
+    return recorder
+
+# These functions are the instrumentation points, doing nothing while
+# timing is off.
+def span(name):
+    if not enabled: return NOSPAN
+    return Span(name)
+
+def count(name,n=1):
+    if enabled: current().count(name,n)
+
+def lap(name):
+    if enabled: current().lap(name)
+
+# This function times every call of a function as a span.
+def timed(name):
+    def wrap(function):
+        def timedFunction(*args,**kwargs):
+            if not enabled: return function(*args,**kwargs)
+            start = time.time()
+            try: return function(*args,**kwargs)
+            finally: current().record(name,time.time()-start)
+        timedFunction.__name__ = function.__name__
+        timedFunction.__doc__ = function.__doc__
+        return timedFunction
+    return wrap
+
+# This function writes the report of a run to a JSON file, from its
+# recorder or the calling thread's.
+def writeReport(path,meta=None,recorder=None):
+    if not enabled: return
+    if recorder == None: recorder = current()
+    with open(path,"wt") as f:
+        json.dump(recorder.report(meta),f,indent=1,sort_keys=True)
+
+# This function returns the spans and counters of a run as a table, from
+# its recorder or the calling thread's.
+def formatReport(recorder=None):
+    if recorder == None: recorder = current()
+    report = recorder.report()
+    lines = ["%-12s %8s %10s %10s %10s %10s" %
+             ("span","count","total s","mean ms","p90 ms","max ms")]
+    for name in sorted(report["spans"]):
+        s = report["spans"][name]
+        lines.append("%-12s %8d %10.3f %10.3f %10.3f %10.3f" %
+                     (name,s["count"],s["total"],s["mean"]*1000,
+                      s["p90"]*1000,s["max"]*1000))
+    for name in sorted(report["counters"]):
+        lines.append("%-12s %8d" % (name,report["counters"][name]))
+    return "\n".join(lines)
@@ -5,6 +5,8 @@
 
 # This file defines a UI and reading system to gather data from a
 # Gamry python-controllable potentiostat for many voltage cycles.
+# The acquisition functions can also be run without the UI, from scripts
+# or the command line, through session.py.
 
 # How to set up the potentiostat
 #   - Install compatible software (v6.33)
@@ -13,17 +15,86 @@
 
 # How to set up computer
 #   - Install python 2
-#   - Add win32com as module to python
+#   - Add win32com, pyserial and numpy as modules to python
 #   - After adding module, close and reopen python
 
 import time
-import win32com.client as client
 import os
+import sys
 import math
-import serial
-
-from Tkinter import *
-import tkFileDialog
+import json
+import threading
+import Queue
+
+import numpy as np
+
+import gamry
+import perf
+import waveform
+from channels import keptColumns, extraNames, extraChannels
+from dataset import Dataset
+from analytics import Summary, Convergence, formatTrend
+from runfile import TextWriter, BinaryWriter, SummaryWriter, summaryPath
+from runfile import ChannelWriter, channelPath, timestamp
+from livefeed import Publisher, feedPath
+from render import decimate, flatten, Raster, cycleColour, hexColour
+from lod import Pyramid, LEAF
+from fitting import inBounds, logValues, fitLifetimes
+from o2logger import O2Logger, formatO2
+
+# points requested per Cook call; with adaptive reads the request doubles
+# each time a block comes back full, up to COOK_MAX
+COOK_CHUNK = 1024
+COOK_MAX = 262144
+COOK_ADAPTIVE = True
+
+# Cook columns kept by a run besides time, current and voltage, by name
+# (see channels.py), unless the run names its own
+KEEP_CHANNELS = []
+
+# draws every OVERLAY_EVERY-th completed cycle on the graph, coloured by
+# cycle, with the cycle being measured drawn over them; without it the
+# graph shows the first cycle only
+OVERLAY = True
+OVERLAY_EVERY = 1
+
+# seconds between Cook polls while a cycle is streamed
+POLL_INTERVAL = 0.01
+
+# seconds a continuous run goes on polling past its nominal end while no
+# new points arrive, for points held up by the instrument starting late
+# or buffering
+END_GRACE = 1.0
+
+# runs every cycle of a run as one acquisition, split into cycles as the
+# points arrive, instead of starting the potentiostat again for each
+CONTINUOUS = True
+
+# serial port of the O2 logger; None, or a port that cannot be opened,
+# runs the UI without one
+O2_PORT = 'COM8'
+
+# has the O2 logger stream its readings during the run, so each cycle
+# gets the O2 value measured while it ran
+O2_STREAM = True
+
+# also saves each run as a binary file (.run) next to the text file,
+# optionally zlib compressed at the given level
+SAVE_BINARY = False
+BINARY_COMPRESS = 0
+
+# publishes each cycle to a shared memory feed file (.feed) next to the
+# text file while the run goes on, for other processes to read
+LIVE_FEED = True
+
+# ends a run early once its voltammogram has settled: each cycle's
+# current differs from the last cycle's by at most CONVERGE_TOLERANCE
+# (RMS, as a fraction of the last cycle's RMS current), and its peak
+# potentials have moved by at most CONVERGE_SHIFT volts unless that is
+# None, for CONVERGE_CYCLES cycles in a row; None runs every cycle
+CONVERGE_TOLERANCE = None
+CONVERGE_CYCLES = 3
+CONVERGE_SHIFT = None
 
 ####################################
 # Graph Class 
@@ -43,6 +114,12 @@ class Graph(object):
         self.margin = 20
         self.limits() # tkinter graph edges
         self.scales() # conversion from data to tkinter space
+        self.items = None # canvas items, once drawn
+        self.drawn = None # points and limits shown by the trace
+        self.colour = "black" # colour of the trace
+        self.overlay = None # Raster of completed cycles, in overlay mode
+        self.photo = None # image the overlay is shown through
+        self.shownOverlay = None # version of the overlay shown
 
     # This function determines the edges of the graph in the given
     # tkinter space.
@@ -81,11 +158,26 @@ class Graph(object):
         self.points.append(point)
 
     # This function updates the x and y limits of the data,
-    # changing the scaling factor.
+    # changing the scaling factor. Cycles already in the overlay no
+    # longer line up, so it is cleared.
     def updateLimits(self,xlim,ylim):
         self.xlim = xlim
         self.ylim = ylim
         self.scales()
+        if self.overlay != None and self.overlay.drawn > 0:
+            self.overlay.clear()
+
+    # This function starts drawing completed cycles into an off-screen
+    # image the size of the plot area.
+    def startOverlay(self):
+        x1,y1,x2,y2 = self.axisLimits
+        self.overlay = Raster(x2-x1,y2-y1)
+
+    # This function draws a completed cycle into the overlay.
+    def overlayCycle(self,xs,ys,colour):
+        xs,ys = self.getCoord((np.asarray(xs),np.asarray(ys)))
+        self.overlay.drawLine(xs-self.axisLimits[0],ys-self.axisLimits[1],
+                              colour)
 
     # This function determines if a graph is empty.
     def isEmpty(self):
@@ -97,44 +189,70 @@ class Graph(object):
         return (self.axisLimits[0] < x < self.axisLimits[2] and
             self.axisLimits[1] < y < self.axisLimits[3])
 
-    # This function makes a log graph from a linear graph.
+    # This function makes a log graph from a linear graph, and fits the
+    # lifetime of its data into data.lifetime.
     def makeLogGraph(self, data):
-        # This function checks if a point is within bounds.
-        def inBound(point):
-            x,y = point
-            # if the bound isn't set, all points are in
-            if data.bound[0] != None:
-                if data.lb > x: return False
-            if data.bound[1] != None:
-                if data.ub < x: return False
-            return True
-        # This function gets the correct value out of a tuple.
-        def getTuple(point,idx):
-            return point[idx]
-        # This function checks if a value is None.
-        def notNone(point):
-            x,y = point
-            return y != None
+        # if a bound isn't set, all points are in on that side
+        lb = data.lb if data.bound[0] != None else None
+        ub = data.ub if data.bound[1] != None else None
+        points = np.asarray(self.points,dtype=np.float64).reshape(-1,2)
+        xs,ys = points[:,0],points[:,1]
         # gets the points in the log graph
-        points = filter(notNone, map(yLog, filter(inBound,self.points)))
-        ys = map(lambda x: getTuple(x,1), points)
-        xs = map(lambda x: getTuple(x,0), points)
-        ylow,xlow = min(ys),min(xs)
-        yup,xup = max(ys),max(xs)
+        keep = inBounds(xs,lb,ub) & (ys > 0)
+        xs,ys = xs[keep],logValues(ys[keep])
+        ylow,xlow = ys.min(),xs.min()
+        yup,xup = ys.max(),xs.max()
         # finds the lifetime of the data
-        linReg(data,xs,ys)
-        return Graph((xlow,xup),(ylow,yup),self.xaxis,self.yaxis,points,
-            self.title,self.coord)
-
-    # This function draws the graph.
+        fit = fitLifetimes(points[:,0],points[:,1],lb=lb,ub=ub)
+        data.lifetime,data.intercept,data.residual = [x[0] for x in fit]
+        return Graph((xlow,xup),(ylow,yup),self.xaxis,self.yaxis,
+            zip(xs.tolist(),ys.tolist()),self.title,self.coord)
+
+    # This function draws the graph. The canvas items are created the
+    # first time, and after that only the tick labels and the data trace
+    # are updated in place.
     def drawGraph(self,canvas):
-        canvas.create_rectangle(self.axisLimits,fill="white")
-        self.drawAxes(canvas)
+        if self.items == None:
+            self.items = [canvas.create_rectangle(self.axisLimits,
+                fill="white")]
+            # the overlay goes under the grid lines and the trace
+            self.image = canvas.create_image(self.axisLimits[0],
+                self.axisLimits[1],anchor="nw",state="hidden")
+            self.items.append(self.image)
+            self.drawAxes(canvas)
+            self.drawLabels(canvas)
+            self.trace = canvas.create_line(0,0,0,0,fill="black",width=2)
+            self.items.append(self.trace)
+        self.drawTicks(canvas)
+        self.drawOverlay(canvas)
         self.drawPoints(canvas)
-        self.drawLabels(canvas)
+
+    # This function removes the graph from the canvas.
+    def eraseGraph(self,canvas):
+        if self.items == None: return
+        for item in self.items:
+            canvas.delete(item)
+        self.items = None
+        self.drawn = None
+        self.shownOverlay = None
+
+    # This function shows the overlay image, handing it to the canvas
+    # again only when cycles have been drawn into it since the last
+    # frame, however many cycles it holds.
+    def drawOverlay(self,canvas):
+        if self.overlay == None: return
+        if self.overlay.version == self.shownOverlay: return
+        self.shownOverlay = self.overlay.version
+        if self.photo == None:
+            import Tkinter
+            self.photo = Tkinter.PhotoImage(master=canvas,
+                width=self.overlay.width,height=self.overlay.height)
+        self.photo.configure(data=self.overlay.encoded(),format="ppm")
+        canvas.itemconfig(self.image,image=self.photo,state="normal")
 
     # This function draws the graph axes, with numberings.
     def drawAxes(self,canvas):
+        self.ticks = [] # (text item, value shown)
 
         # y axes, in volts
         xl,yl,xu,yu = self.axisLimits
@@ -142,10 +260,9 @@ class Graph(object):
         for i in range(5):
             x1,y1 = xl,yl+i*(yu-yl)/4.0
             x2,y2 = xu,yl+i*(yu-yl)/4.0
-            # determines graph marking
-            val = round(self.ylim[1]-(self.ylim[1]-self.ylim[0])/4.0*i,2)
-            canvas.create_line(x1,y1,x2,y2)
-            canvas.create_text(self.axisLimits[0]-5,y2,anchor="e",text=str(val))
+            self.items.append(canvas.create_line(x1,y1,x2,y2))
+            item = canvas.create_text(self.axisLimits[0]-5,y2,anchor="e")
+            self.ticks.append([item,None])
         
         # x axes, in ns
         xl,yl,xu,yu = self.axisLimits
@@ -153,29 +270,50 @@ class Graph(object):
         for i in range(5):
             x1,y1 = xl+i*(xu-xl)/4.0,yl
             x2,y2 = xl+i*(xu-xl)/4.0,yu
-            # determines graph marking
-            val = round((self.xlim[0]+(self.xlim[1]-self.xlim[0])/4.0*i),2)
-            canvas.create_line(x1,y1,x2,y2)
-            canvas.create_text(x2,y2+20,anchor="n",text=str(val))
-
-    # This function draws the points on the graph.
+            self.items.append(canvas.create_line(x1,y1,x2,y2))
+            item = canvas.create_text(x2,y2+20,anchor="n")
+            self.ticks.append([item,None])
+        self.items.extend([item for (item,_) in self.ticks])
+
+    # This function updates the axis numberings to the graph limits.
+    def drawTicks(self,canvas):
+        # determines graph markings, y axis then x axis
+        vals = [round(self.ylim[1]-(self.ylim[1]-self.ylim[0])/4.0*i,2)
+                for i in range(5)]
+        vals += [round((self.xlim[0]+(self.xlim[1]-self.xlim[0])/4.0*i),2)
+                 for i in range(5)]
+        for tick,val in zip(self.ticks,vals):
+            if tick[1] != val:
+                canvas.itemconfig(tick[0],text=str(val))
+                tick[1] = val
+
+    # This function draws the points on the graph as a single line,
+    # reduced to at most two points per pixel column. The line is only
+    # recomputed when the points or limits change.
     def drawPoints(self,canvas):
-        for point in self.points:
-            x,y = self.getCoord(point)
-            if y == None: continue
-            x1,y1 = x-2,y-2
-            x2,y2 = x+2,y+2
-            canvas.create_oval(x1,y1,x2,y2,fill="black")
+        shown = (id(self.points),len(self.points),self.xlim,self.ylim,
+                 self.colour)
+        if shown == self.drawn: return
+        self.drawn = shown
+        points = [point for point in self.points if point[1] != None]
+        if len(points) < 2:
+            canvas.itemconfig(self.trace,state="hidden")
+            return
+        points = np.asarray(points,dtype=np.float64)
+        xs,ys = self.getCoord((points[:,0],points[:,1]))
+        xs,ys = decimate(xs,ys,int(self.axisLimits[2]-self.axisLimits[0]))
+        canvas.coords(self.trace,*flatten(xs,ys))
+        canvas.itemconfig(self.trace,state="normal",fill=self.colour)
 
     # This function draws the graph labels.
     def drawLabels(self,canvas):
         x1,y1,x2,y2 = self.coord
-        canvas.create_text((x2-x1)/2+x1,y1+5,text=self.title,
-            font="Arial 10 bold")
-        canvas.create_text((x2-x1)/2+x1,y2-5,text=self.xaxis,
-            font = "Arial 8 bold")
-        canvas.create_text(x1+5,(y2-y1)/2+y1,text=self.yaxis,
-            font = "Arial 8 bold")
+        self.items.append(canvas.create_text((x2-x1)/2+x1,y1+5,
+            text=self.title,font="Arial 10 bold"))
+        self.items.append(canvas.create_text((x2-x1)/2+x1,y2-5,
+            text=self.xaxis,font = "Arial 8 bold"))
+        self.items.append(canvas.create_text(x1+5,(y2-y1)/2+y1,
+            text=self.yaxis,font = "Arial 8 bold"))
 
 ####################################
 # File functions
@@ -197,6 +335,7 @@ def trimFileName(fileName):
 
 # This function allows the user to select an existing folder.
 def folderExplorer():
+    import tkFileDialog
     location = os.getcwd()
     name = tkFileDialog.askdirectory()
     if name == (): name = ""
@@ -204,6 +343,7 @@ def folderExplorer():
 
 # This function allows the user to select an existing text file.
 def fileExplorer():
+    import tkFileDialog
     location = os.getcwd()
     name = tkFileDialog.askopenfilename(initialdir=location,
             title="Select File",filetypes=(("text","*.txt"),("all files","*.*")))
@@ -221,21 +361,71 @@ def initGraph(data):
         [],"Current vs. Voltage",(data.margin,data.height/2,
         data.width-data.margin,data.height-data.margin))
 
+# This function creates a blank current vs. time graph of the whole run.
+def initRunGraph(data):
+    return Graph((0,1),(-0.5,0.5),"Time (s)",
+                "C\nu\nr\nr\ne\nn\nt\n \n(\nu\nA\n)",
+        [],"Current vs. Time",(data.margin,data.height/2,
+        data.width-data.margin,data.height-data.margin))
+
 # This function initializes the potentiostat and waveform data. It is meant
 # to be run each time the user starts a run, not just when the file runs.
 def initWaveform(data):
-    devicelist = client.Dispatch('GamryCOM.GamryDeviceList')
-    data.pstat = client.Dispatch('GamryCOM.GamryPstat')
-    data.pstat.Init(devicelist.EnumSections()[0])
+    initPstat(data)
+    initDataset(data)
+
+# This function opens the potentiostat in data.section, or the first one
+# found if no section is given. It must run on the thread that talks to
+# the instrument.
+def initPstat(data):
+    devicelist = data.backend.deviceList()
+    section = data.section
+    if section == None: section = devicelist.EnumSections()[0]
+    data.pstat = data.backend.pstat()
+    data.pstat.Init(section)
 
     data.pstat.Open()
 
-    data.dtaqcpiv=client.Dispatch('GamryCOM.GamryDtaqCpiv')
+    data.dtaqcpiv = data.backend.dtaqcpiv()
     data.dtaqcpiv.Init(data.pstat)
-    
-    data.dataset = []
+
+    data.cookChunk = COOK_CHUNK
+    resetSignal(data)
+
+# This function has the next cycle upload the signal again, so a run can
+# use a new signal on a potentiostat that is already open.
+def resetSignal(data):
+    data.uploaded = False
+    data.signalKey = None # signal and sample rate uploaded
+    data.cookCalls = [] # (Cook calls, points) for each cycle
+
+# This function empties the stored data for a new run.
+def initDataset(data):
+    data.perf = perf.reset() # timing of the run, on the threads it uses
+    data.dataset = Dataset()
+    data.summary = Summary() # peaks and charge of each cycle
+    data.lod = Pyramid() # time, voltage and current bounds by sample
+    names = data.channels if data.channels != None else KEEP_CHANNELS
+    data.keep = keptColumns(names) # indices of the Cook columns kept
+    tolerance = data.converge
+    if tolerance == None: tolerance = CONVERGE_TOLERANCE
+    data.convergence = None # follows the cycles settling, if asked to
+    if tolerance != None:
+        cycles = data.convergeCycles
+        if cycles == None: cycles = CONVERGE_CYCLES
+        data.convergence = Convergence(tolerance,cycles,CONVERGE_SHIFT)
+    data.stopReason = None # why the run ended, once it has
     data.first = True
     data.cyclesRun = 0
+    data.writers = []
+    data.o2stream = None
+    data.cycleStart = time.time()
+
+# This function fills in the run parameters the user did not give.
+def setDefaults(data):
+    if data.sRate == None: data.sRate = 0.001
+    if data.cycles == None: data.cycles = 5
+    if data.array == None: data.array = waveform.ramp(0,1,1000).array
 
 # This function initializes the UI. It is called once per run of the file.
 def init(data):
@@ -243,68 +433,112 @@ def init(data):
     data.margin = 5
     data.graph = initGraph(data)
 
+    # talks to the bench potentiostat unless another backend was given
+    if data.backend == None: data.backend = gamry.ComBackend()
+    data.section = None # first potentiostat found
+
     data.sRate = None
     data.cycles = None
     data.array = None
 
     data.running = False
     data.count = 0
-
-    data.ser = serial.Serial('COM8', 9600)
+    data.worker = None
+
+    data.channels = None # extra Cook channels kept, KEEP_CHANNELS if None
+    data.converge = None # CONVERGE_TOLERANCE if None
+    data.convergeCycles = None # CONVERGE_CYCLES if None
+    data.buttonText = None # button text items, once drawn
+    data.summary = None # analysis of each cycle, once a run starts
+    data.drawnGraph = None # graph currently on the canvas
+    data.runGraph = initRunGraph(data)
+    data.view = "iv" # graph shown: current vs. voltage ("iv") or time
+    data.window = None # samples shown by the time graph, None for all
+    data.runShown = None # samples and window the time graph shows
+    data.drag = None # x of the last mouse position while dragging
+    data.lod = None # index of the run's samples, once a run starts
+    data.liveRanges = None # bounds of the first cycle as it is measured
+    data.stopReason = None # why the last run ended
+
+    data.o2 = None # O2 logger, if one could be opened
+    if O2_PORT != None:
+        # a missing logger, or pyserial, leaves an empty O2 line
+        try: data.o2 = openO2(O2_PORT)
+        except (ImportError,IOError,OSError) as error:
+            print("O2 logger unavailable: " + str(error))
 
     data.editing = [False]*6
     data.pipe = [False]*6
 
-    data.lastReading = time.time()
+    data.lastFrame = None # time of the last frame
     data.bText = [["Folder name","","Sample rate\n(s/sample)",""],
                   ["Signal file","","# Cycles",""],
                   ["File name","","",""]]
 
-# This function stores data from the potentiostat in an internal
-# datastructure. The minLength variable is used to ensure that the
-# data is stored in a complete array with no out-of-bound access.
-def store(data,lst):
-    if len(data.dataset) == 0:
-        data.dataset.append(lst)
-        data.minLength = len(lst)
-    else:
-        data.dataset.append(lst)
-        if len(lst) < data.minLength: data.minLength = len(lst)
+# This function opens the O2 logger on a serial port. pyserial is only
+# imported once a logger is used.
+def openO2(port,baud=9600):
+    import serial
+    return O2Logger(serial.Serial(port,baud))
 
 # This function gathers and stores the time, voltage, and current
-# data from each cycle.
-def addData(data,graphPoints,t):
-    # time and voltage are only collected the first cycle (identical per cycle) 
-    if data.first:
-        v = [x for (x,_) in graphPoints]
-        store(data,t)
-        store(data,v)
-        a = [y for (_,y) in graphPoints]
-        store(data,a)
-    else:
-        a = [y for (_,y) in graphPoints]
-        store(data,a)
-
-# This function sets the signal to send to the potentiostat.
-def setSignal(data):
+# data from each cycle, and any extra channels kept, given as a dict of
+# arrays by name. Once the cycles have converged, the reason is set as
+# the run's stopReason, for the run to stop.
+@perf.timed("addData")
+def addData(data,t,v,a,channels=None):
+    perf.lap("cycle")
+    perf.count("cycles")
+    perf.count("points",len(a))
+    # time and voltage are only kept from the first cycle (identical per
+    # cycle)
+    o2 = cycleO2(data,t)
+    data.dataset.addCycle(t,v,a,o2,channels)
+    data.summary.addCycle(t,v,a,o2)
+    n = min(len(t),len(v),len(a))
+    data.lod.extend(t[:n],v[:n],a[:n])
+    for writer in data.writers:
+        writer.addCycle(t,v,a,channels)
+    if data.convergence != None and data.stopReason == None:
+        with perf.span("convergence"):
+            if data.convergence.addCycle(v,a):
+                data.stopReason = data.convergence.reason()
+
+# This function stores a cycle from its Cook columns, which are
+# (time,current,_,_,voltage,_,_,_,_) and the extra channels kept,
+# returning its (voltage, current) points.
+def addColumns(data,columns):
+    t,v,a = columns[0],columns[4],columns[1]
+    addData(data,t,v,a,extraChannels(columns,data.keep))
+    return zip(v,a)
+
+# This function returns the streamed O2 value at the middle of the
+# cycle with time column t, or nan without streamed O2.
+def cycleO2(data,t):
+    if data.o2stream == None: return float("nan")
+    return data.o2stream.cycleValue(data.cycleStart,t)
+
+# This function sets the signal to send to the potentiostat, repeated
+# for a number of cycles. The signal is only uploaded when it, the
+# cycles or the sample rate have changed since the last cycle; otherwise
+# the potentiostat runs the signal it already has.
+@perf.timed("setSignal")
+def setSignal(data,cycles=1):
+    wave = waveform.compileSignal(data.array)
+    key = (wave.key,data.sRate,cycles)
+    if data.uploaded and data.signalKey == key: return
     # initializes signal to potentiostat
-    data.sig=client.Dispatch('GamryCOM.GamrySignalArray')
-    if data.first:
-        data.sig.Init(data.pstat, 1, data.sRate,
-             len(data.array), data.array, 1) 
-        data.pstat.SetSignal(data.sig)
-        data.pstat.SetCell(1)
-    # updates signal to potentiostat
-    else:
-        data.sig.Init(data.pstat, 1, data.sRate,
-             len(data.array), data.array, 1)
-        data.sig.Tweak(data.cycles,data.sRate*10,len(data.array),
-                       data.array, 0)
-        data.pstat.SetSignal(data.sig)
-
-# This function sends the potentiostat signal and waits for the measurement
-# to terminate.
+    data.sig = data.backend.signalArray()
+    data.sig.Init(data.pstat, cycles, data.sRate,
+         wave.points, wave.array, 1) 
+    data.pstat.SetSignal(data.sig)
+    if not data.uploaded: data.pstat.SetCell(1)
+    data.uploaded = True
+    data.signalKey = key
+
+# This function sends the potentiostat signal, starting the measurement.
 #*#*#*#*# data.complete, and try/except may not be necessary
+@perf.timed("runSignal")
 def runSignal(data):
     # ensures no error in reading
     data.complete = False
@@ -313,45 +547,154 @@ def runSignal(data):
     except:
         data.pstat.Close()
         raise
-
-    # waits for the acquisition to complete
-    wait = len(data.array)*data.sRate
-    time.sleep(wait)
+    data.cycleStart = time.time()
+
+# This function reads the points the potentiostat has acquired so far as
+# columns, returning them with the number of Cook calls made. Points are
+# pulled in blocks of data.cookChunk, and the block grows while the
+# potentiostat keeps filling it, so a cycle takes a handful of Cook calls
+# instead of one per point. Only the columns in data.keep are copied out
+# of the Cook buffer; the others stay empty.
+@perf.timed("cook")
+def cook(data):
+    columns = [[] for _ in range(9)]
+    calls = 0
+    count = data.cookChunk
+    while count == data.cookChunk:
+        count, points = data.dtaqcpiv.Cook(data.cookChunk)
+        calls += 1
+        if count == 0: break
+        for idx in data.keep:
+            columns[idx].extend(points[idx])
+        if COOK_ADAPTIVE and count == data.cookChunk:
+            data.cookChunk = min(data.cookChunk*2,COOK_MAX)
+            count = data.cookChunk
+    perf.count("cookCalls",calls)
+    return columns,calls
+
+# This function reads one cycle from the potentiostat once it has been
+# started. Given a batch function, it polls Cook while the cycle runs and
+# passes each new block of columns on as it arrives; otherwise it waits
+# for the cycle to finish and reads it all at once. Setting the stopped
+# event ends the read early.
+def readCycle(data,batch=None,stopped=None):
+    columns = [[] for _ in range(9)]
+    calls = 0
+    end = data.backend.clock()+len(data.array)*data.sRate
+    last = False
+    while not last:
+        # waits for the next poll, or for the acquisition to complete
+        remaining = end-data.backend.clock()
+        if batch == None or remaining <= POLL_INTERVAL:
+            last = True
+            wait = remaining
+        else: wait = POLL_INTERVAL
+        if wait > 0:
+            with perf.span("wait"): data.backend.wait(wait)
+        new,n = cook(data)
+        calls += n
+        if len(new[0]) > 0:
+            for column,values in zip(columns,new):
+                column.extend(values)
+            if batch != None: batch(new)
+        if stopped != None and stopped.is_set(): break
+    data.cookCalls.append((calls,len(columns[0])))
+    return columns
+
+# This function reads a number of cycles run as one acquisition, once it
+# has been started. The points are polled as they arrive, passed on to
+# batch if given, and split into cycles by sample index, one signal
+# length each; every cycle is passed to cycle as soon as its last point
+# is read. Past the nominal end of the acquisition polling goes on until
+# every point has arrived, or until END_GRACE seconds pass without new
+# points; points left over then make an incomplete cycle, which is
+# dropped like one cut short by stop, so it does not cut every row of
+# the output to its length. Setting the
+# stopped event ends the read early, dropping the cycle in progress.
+# Returns the number of cycles read.
+def readRun(data,cycles,cycle,batch=None,stopped=None):
+    npts = len(data.array)
+    pending = [[] for _ in range(9)]
+    calls = 0
+    done = 0
+    end = data.backend.clock()+cycles*npts*data.sRate
+    arrived = data.backend.clock() # time new points last arrived
+    while done < cycles:
+        # waits for the next poll, or for the acquisition to complete
+        remaining = end-data.backend.clock()
+        with perf.span("wait"):
+            if remaining > 0:
+                data.backend.wait(min(remaining,POLL_INTERVAL))
+            else: data.backend.wait(POLL_INTERVAL)
+        new,n = cook(data)
+        calls += n
+        if len(new[0]) > 0:
+            arrived = data.backend.clock()
+            for column,values in zip(pending,new):
+                column.extend(values)
+            if batch != None: batch(new)
+        # passes on every cycle whose points have all arrived
+        start = 0
+        while len(pending[0])-start >= npts and done < cycles:
+            cycle([column[start:start+npts] for column in pending])
+            data.cookCalls.append((calls,npts))
+            calls = 0
+            start += npts
+            done += 1
+        if start > 0: pending = [column[start:] for column in pending]
+        if stopped != None and stopped.is_set(): return done
+        if remaining <= 0 and data.backend.clock()-arrived >= END_GRACE:
+            break
+    return done
+
+# This function reports the average Cook calls per cycle and points per
+# Cook call over the run so far.
+def cookRate(data):
+    if len(data.cookCalls) == 0: return 0.0,0.0
+    calls = sum([c for (c,_) in data.cookCalls])
+    points = sum([p for (_,p) in data.cookCalls])
+    return float(calls)/len(data.cookCalls),float(points)/calls
+
+# This function runs the cycles left in the run as one acquisition,
+# storing each cycle as soon as it is read and then calling progress,
+# if given. Setting the stopped event ends the run early, as do the
+# cycles converging, which sets it.
+def getreadings(data,progress=None,stopped=None):
+
+    # if no input is given, use the default parameters
+    setDefaults(data)
+
+    cycles = data.cycles-data.cyclesRun
+    if cycles <= 0: return
+    setSignal(data,cycles)
+    runSignal(data)
+    if stopped == None: stopped = threading.Event()
+
+    # stores each cycle as it is read
+    def store(columns):
+        addColumns(data,columns)
+        data.cyclesRun += 1
+        if progress != None: progress()
+        if data.stopReason != None: stopped.set()
+
+    readRun(data,cycles,store,stopped=stopped)
+    data.complete = True
 
 # This function gets the voltage output from the potentiostat and stores
 # the acquired data in an internal datastructure.
 def getreading(data):
 
-    # if no input is given, use these parameters
-    if data.sRate == None: data.sRate = 0.001
-    if data.cycles == None: data.cycles = 5
-    if data.array == None: data.array = map(lambda x: x/1000.0,range(1000))
+    # if no input is given, use the default parameters
+    setDefaults(data)
 
     setSignal(data)
     runSignal(data) 
 
     # collects the data from the potentiostat
-    acquired_points = []
-    count = 1
-    while count > 0:
-        count, points = data.dtaqcpiv.Cook(1) 
-        acquired_points.extend(zip(*points))
-
-    # returns certain tuple values
-    def getXY(tup):
-        # (time,current,_,_,voltage,_,_,_,_)
-        (_,y,_,_,x,_,_,_,_) = tup
-        return x,y
-    def getZ(tup):
-        (z,_,_,_,_,_,_,_,_) = tup
-        return z
-
-    # gathers data for time, voltage, and current
-    t = map(getZ, acquired_points)
-    graphPoints = map(getXY,acquired_points)
+    columns = readCycle(data)
 
     # stores collected data and completes acquisition
-    addData(data,graphPoints,t)
+    graphPoints = addColumns(data,columns)
     data.complete = True
     data.cyclesRun += 1
 
@@ -365,22 +708,62 @@ def getName(data):
     name = data.bText[0][1] + "/" + data.bText[2][1] + ".txt"
     return name
 
+# This function opens the output files of a run, which are written as
+# the cycles complete. The binary file is written if SAVE_BINARY is set,
+# unless binary says otherwise, and the live feed likewise with
+# LIVE_FEED and feed.
+def openWriters(data,binary=None,compress=None,feed=None):
+    if binary == None: binary = SAVE_BINARY
+    if compress == None: compress = BINARY_COMPRESS
+    if feed == None: feed = LIVE_FEED
+    name = getName(data)
+    if name == None: return
+    data.writers.append(TextWriter(name,data.cycles))
+    data.writers.append(SummaryWriter(summaryPath(name),data.summary))
+    extra = extraNames(data.keep)
+    for channel in extra:
+        data.writers.append(ChannelWriter(channelPath(name,channel),
+                                          data.cycles,channel))
+    if binary:
+        meta = {"sRate": data.sRate, "cycles": data.cycles,
+                "waveform": data.bText[1][1], "channels": extra}
+        data.writers.append(BinaryWriter(name[:-4] + ".run",meta,
+                                         compress))
+    if feed:
+        # the run goes on without a feed another process holds open
+        try:
+            data.writers.append(Publisher(feedPath(name),len(data.array),
+                data.dataset,lambda: data.o2stream))
+        except (IOError,OSError,ValueError) as error:
+            print("live feed unavailable: " + str(error))
+
 # This function gathers all stored data and converts it to the
 # format of a text file.
 def getContents(data):
     contents = ""
+    columns = [column.tolist() for column in data.dataset.columns()]
     # ensures no out-of-bound array access
-    for i in range(data.minLength):
+    for i in range(data.dataset.minLength()):
         line = ""
-        for j in range(len(data.dataset)):
-            line += str(data.dataset[j][i]) + ", "
+        for j in range(len(columns)):
+            line += str(columns[j][i]) + ", "
         contents += line + "\n"
     # removes extra formatting from end of string
     return contents[:-3] + "\n" + data.O2vals
 
 # This function writes all data to the specified file or does nothing
-# if there is no data or no specified file.
+# if there is no data or no specified file. A run streamed to its files
+# only needs the files completed.
 def save(data):
+    if data.writers != []:
+        for writer in data.writers:
+            if isinstance(writer,BinaryWriter):
+                writer.meta["stopReason"] = data.stopReason
+            writer.finish(data.O2vals,data.dataset.cycleO2())
+        data.writers = []
+        writeMeta(data)
+        writeReport(data)
+        return
     if len(data.dataset) == 0: return  
     # write text file
     name = getName(data)
@@ -388,31 +771,152 @@ def save(data):
     # store data.dataset in file
     contents = getContents(data)  
     writeFile(name, contents)
+    writeMeta(data)
+    writeReport(data)
 
-# This function stops the potentiostat from cycling.
-def stop(data):
+# This function writes the metadata of the run next to its text file, as
+# <name>_meta.json: its settings, the cycles it ran and why it ended.
+def writeMeta(data):
+    name = getName(data)
+    if name == None: return
+    meta = {"cycles": data.cycles, "cyclesRun": data.cyclesRun,
+            "sRate": data.sRate, "points": len(data.array),
+            "waveform": data.bText[1][1], "continuous": CONTINUOUS,
+            "stopReason": data.stopReason, "finished": timestamp()}
+    if data.convergence != None:
+        meta["converge"] = data.convergence.tolerance
+        meta["convergeCycles"] = data.convergence.cycles
+    with open(name[:-4] + "_meta.json","wt") as f:
+        json.dump(meta,f,indent=1,sort_keys=True)
+
+# This function writes the timing report of the run next to its text
+# file, as <name>_perf.json.
+def writeReport(data):
+    name = getName(data)
+    if name == None: return
+    meta = {"cycles": data.cyclesRun, "sRate": data.sRate,
+            "points": len(data.array), "continuous": CONTINUOUS,
+            "stopReason": data.stopReason}
+    perf.writeReport(name[:-4] + "_perf.json",meta,data.perf)
+
+####################################
+# Acquisition thread
+####################################
+
+# This class runs the potentiostat cycles on their own thread, so the UI
+# keeps drawing while the instrument measures. Each cycle is polled as it
+# runs; the time it started goes on the queue as ("start", time), new
+# points as ("points", columns) batches and the finished cycle as
+# ("cycle", columns), to be stored by the UI thread, and once the
+# acquisition is over ("done", cycles read).
+# With CONTINUOUS set, all cycles are one acquisition with a single
+# start, and each cycle is sent as soon as its points are in; otherwise
+# the next cycle starts as soon as the previous one has been read.
+class Acquisition(threading.Thread):
+
+    def __init__(self,data):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.data = data
+        self.queue = Queue.Queue()
+        self.stopped = threading.Event()
+
+    def run(self):
+        data = self.data
+        data.backend.threadInit()
+        perf.use(data.perf)
+        try:
+            initPstat(data)
+            if CONTINUOUS:
+                setSignal(data,data.cycles)
+                runSignal(data)
+                self.queue.put(("start",data.cycleStart))
+                done = readRun(data,data.cycles,self.cycle,self.batch,
+                               self.stopped)
+                self.queue.put(("done",done))
+                return
+            cycle = 0
+            while cycle < data.cycles and not self.stopped.is_set():
+                setSignal(data)
+                runSignal(data)
+                self.queue.put(("start",data.cycleStart))
+                columns = readCycle(data,self.batch,self.stopped)
+                # a cycle interrupted by stop is incomplete
+                if self.stopped.is_set(): break
+                self.queue.put(("cycle",columns))
+                cycle += 1
+            self.queue.put(("done",cycle))
+        except Exception as error:
+            self.queue.put(("error",error))
+        finally:
+            # ends an acquisition cut short by halt before closing
+            try: data.dtaqcpiv.Run(False)
+            except: pass
+            try: data.pstat.Close()
+            except: pass
+            data.backend.threadExit()
+
+    # This function passes newly read points to the UI thread.
+    def batch(self,columns):
+        self.queue.put(("points",columns))
+
+    # This function passes a completed cycle to the UI thread.
+    def cycle(self,columns):
+        self.queue.put(("cycle",columns))
+
+    # This function stops the acquisition and waits for the thread.
+    def halt(self):
+        self.stopped.set()
+        if self.is_alive() and threading.current_thread() != self:
+            self.join()
+
+# This function stops the potentiostat from cycling, ending the
+# acquisition in progress. Unless close is False, the potentiostat is
+# closed as well. A run not stopped by its cycles converging records
+# whether it ran all its cycles.
+def stop(data,close=True):
     data.running = False
     data.complete = True
-    try: data.pstat.Close()
-    except: pass
-    data.ser.write("send")
-    num = int(data.ser.readline()[:2])
-    count = 0
-    data.O2vals = "O2,vals"
-    while(count < num):
-        data.O2vals += "," + data.ser.readline()[:-2]
-        count += 1
+    if data.stopReason == None:
+        if data.cyclesRun >= data.cycles: data.stopReason = "completed"
+        else: data.stopReason = "stopped"
+    # the acquisition thread closes the potentiostat itself
+    if data.worker != None:
+        data.worker.halt()
+        drain(data)
+        data.worker = None
+    else:
+        # an acquisition cut short by halt or by the cycles converging
+        # would go on with the cycles left in its signal, even with the
+        # potentiostat left open for the next run
+        try: data.dtaqcpiv.Run(False)
+        except: pass
+        if close:
+            try: data.pstat.Close()
+            except: pass
+    # uses the streamed O2 readings, or downloads them from a logger
+    # that did not stream any
+    stream = data.o2stream
+    if stream != None: data.o2.stopStream(stream)
+    if stream != None and stream.count > 0:
+        data.O2vals = formatO2(stream.values())
+    elif data.o2 != None: data.O2vals = formatO2(data.o2.download())
+    else: data.O2vals = formatO2([])
     save(data)
 
+# This function reads a signal file of one voltage per line, returning
+# its voltages.
+def readWaveform(fileName):
+    return waveform.load(fileName).array
+
 # This function reads voltage data from a specified file to use in the
 # potentiostat signal, if the file contains valid data.
 def convert(data):
     fileName = data.bText[1][1]
     try: 
-        contents = readFile(fileName)
-        data.array = map(float,contents.split("\n")[:-1])
-    except:
-        print("invalid file")
+        data.array = readWaveform(fileName)
+    except (IOError,ValueError) as error:
+        print("invalid file: " + str(error))
         # removes erroneous file from UI
         data.bText[1][1] = ""
         data.array = None
@@ -422,11 +926,24 @@ def press(data,idx):
     if idx == 7:
         # starts potentiostat cycles
         if not data.running:
-            initWaveform(data)
+            setDefaults(data)
+            initDataset(data)
+            openWriters(data)
             data.graph = initGraph(data)
+            if OVERLAY:
+                data.graph.startOverlay()
+                data.graph.colour = hexColour(cycleColour(0,data.cycles))
+            data.runGraph = initRunGraph(data)
+            data.window = None
+            data.runShown = None
+            data.liveRanges = None
             data.running = True
             data.complete = True
-            data.ser.write("start")
+            if data.o2 != None:
+                data.o2.start()
+                if O2_STREAM: data.o2stream = data.o2.stream()
+            data.worker = Acquisition(data)
+            data.worker.start()
         else: # stops potentiostat cycles
             stop(data)
     # edits the three text boxes
@@ -461,11 +978,38 @@ def mousePressed(event,data):
         elif (col % 2 == 1 and event.x < 1.2*bwidth+col*1.2*bwidth and
             bheight*2 < event.y < 3*bheight+row*1.5*bheight):
                 press(data,col//2+2*row)
+    # starts dragging the time graph
+    data.drag = None
+    if data.view == "run" and data.runGraph.inGraph(event.x,event.y):
+        data.drag = event.x
+
+# This function pans the time graph while the mouse is dragged on it.
+def mouseDragged(event,data):
+    if data.drag == None or data.view != "run": return
+    # nothing to move before the first run
+    if data.lod == None or data.sRate == None: return
+    graph = data.runGraph
+    samples = (data.drag-event.x)/graph.xscale/data.sRate
+    data.drag = event.x
+    panWindow(data,samples)
+    updateRunView(data)
+
+# This function zooms the time graph around the mouse, in for delta
+# above 0 and out for delta below 0.
+def mouseWheel(event,data,delta):
+    if data.view != "run" or not data.runGraph.inGraph(event.x,event.y):
+        return
+    if data.lod == None or data.sRate == None: return
+    centre = data.runGraph.getPoint((event.x,event.y))[0]/data.sRate
+    zoomWindow(data,0.8 if delta > 0 else 1.25,centre)
+    updateRunView(data)
 
 # This function reacts to key presses.
 def keyPressed(event,data): 
-    # edits text boxes if in edit mode
-    if True not in data.editing: return
+    # keys switch and move the graph when no text box is being edited
+    if True not in data.editing:
+        viewKey(event,data)
+        return
     idx = data.editing.index(True)
     # removes the last character
     if event.keysym == "BackSpace":
@@ -491,26 +1035,202 @@ def keyPressed(event,data):
     else:
         data.bText[idx//2][2*(idx%2)+1] += event.char
 
-# This function returns the domain and range for an xy-plot.
-def ranges(lst):
-    xs = map(lambda (x,_): x, lst)
-    ys = map(lambda (_,y): y, lst)
-    return (min(xs),max(xs)),(min(ys),max(ys))
+####################################
+# Time graph
+####################################
+
+# This function reacts to the keys of the graph: v switches between the
+# current vs. voltage and current vs. time graphs, + and - zoom the time
+# graph, the arrow keys pan it and 0 shows the whole run again.
+def viewKey(event,data):
+    if event.char == "v":
+        data.view = "run" if data.view == "iv" else "iv"
+    elif data.view != "run": return
+    elif event.char in ["+","="]: zoomWindow(data,0.5)
+    elif event.char == "-": zoomWindow(data,2.0)
+    elif event.char == "0": data.window = None
+    elif event.keysym in ["Left","Right"]:
+        start,stop = currentWindow(data)
+        step = 0.25*(stop-start)
+        panWindow(data,-step if event.keysym == "Left" else step)
+    updateRunView(data)
+
+# This function returns the samples shown by the time graph.
+def currentWindow(data):
+    if data.window != None: return data.window
+    count = len(data.lod) if data.lod != None else 0
+    return 0,max(count,1)
+
+# This function sets the samples shown by the time graph, kept within
+# the run; a window holding the whole run follows it as it grows.
+def setWindow(data,start,stop):
+    count = len(data.lod) if data.lod != None else 0
+    span = min(max(stop-start,2*LEAF),count)
+    if count == 0 or span >= count:
+        data.window = None
+        return
+    start = min(max(start,0),count-span)
+    data.window = (start,start+span)
+
+# This function zooms the time graph by a factor of its span, around a
+# sample, or around its middle.
+def zoomWindow(data,factor,centre=None):
+    start,stop = currentWindow(data)
+    if centre == None: centre = (start+stop)/2.0
+    setWindow(data,centre-(centre-start)*factor,centre+(stop-centre)*factor)
+
+# This function moves the time graph by a number of samples.
+def panWindow(data,samples):
+    start,stop = currentWindow(data)
+    if data.window == None: return
+    setWindow(data,start+samples,stop+samples)
+
+# This function draws the samples shown by the time graph from the
+# index of the run, one low and one high per pixel column, scaling the
+# graph to them. Nothing is done unless new samples arrived or the
+# window moved, and then only the bins in the window are read.
+@perf.timed("runView")
+def updateRunView(data):
+    if data.view != "run" or data.lod == None: return
+    shown = (len(data.lod),data.window)
+    if shown == data.runShown: return
+    data.runShown = shown
+    graph = data.runGraph
+    start,stop = currentWindow(data)
+    bounds = data.lod.bounds(start,stop)
+    if bounds == None: return
+    pixels = int(graph.axisLimits[2]-graph.axisLimits[0])
+    xs,ys = data.lod.trace(2,start,stop,pixels)
+    graph.points = zip((xs*data.sRate).tolist(),ys.tolist())
+    fitGraph(graph,(start*data.sRate,stop*data.sRate),
+             (bounds[0][2],bounds[1][2]))
+
+####################################
+# Graph limits
+####################################
+
+# This function returns the domain and range of arrays of x and y
+# values, merged with old ones if given.
+@perf.timed("ranges")
+def ranges(xs,ys,old=None):
+    xs = np.asarray(xs,dtype=np.float64)
+    ys = np.asarray(ys,dtype=np.float64)
+    xlim,ylim = (xs.min(),xs.max()),(ys.min(),ys.max())
+    if old == None: return xlim,ylim
+    (xlow,xhigh),(ylow,yhigh) = old
+    return ((min(xlow,xlim[0]),max(xhigh,xlim[1])),
+            (min(ylow,ylim[0]),max(yhigh,ylim[1])))
+
+# This function sets the graph limits, leaving them unchanged while the
+# data does not yet span a range.
+def fitGraph(graph,xlim,ylim):
+    if xlim[0] == xlim[1] or ylim[0] == ylim[1]: return
+    graph.updateLimits(xlim,ylim)
+
+# This function fits the graph to the first cycle, from the index of the
+# run's samples.
+def fitFirstCycle(data):
+    low,high = data.lod.bounds()
+    fitGraph(data.graph,(low[1],high[1]),(low[2],high[2]))
+
+# This function draws a stored cycle into the overlay of the graph,
+# unless it is skipped by OVERLAY_EVERY. A cycle that leaves the graph
+# widens its limits, and the cycles shown so far are drawn again.
+@perf.timed("overlay")
+def overlayCycle(data,cycle):
+    if cycle % OVERLAY_EVERY != 0: return
+    graph = data.graph
+    v = data.dataset.voltage
+    a = data.dataset.current(cycle)
+    n = min(len(v),len(a))
+    if n < 2: return
+    # the cycle is the last n samples of the index
+    low,high = data.lod.bounds(len(data.lod)-n)
+    xlim,ylim = ranges((low[1],high[1]),(low[2],high[2]),
+                       (graph.xlim,graph.ylim))
+    if (xlim,ylim) != (graph.xlim,graph.ylim):
+        graph.updateLimits(widen(xlim,graph.xlim),widen(ylim,graph.ylim))
+        redrawOverlay(data)
+        return
+    graph.overlayCycle(v[:n],a[:n],cycleColour(cycle,data.cycles))
+
+# This function returns limits grown past new limits by a tenth of their
+# span on each side that moved, so that slow drifts do not widen the
+# graph every cycle.
+def widen(new,old):
+    pad = 0.1*(new[1]-new[0])
+    low = new[0]-pad if new[0] < old[0] else new[0]
+    high = new[1]+pad if new[1] > old[1] else new[1]
+    return low,high
+
+# This function draws every stored cycle shown by the overlay again.
+def redrawOverlay(data):
+    data.graph.overlay.clear()
+    v = data.dataset.voltage
+    for cycle in range(0,len(data.dataset),OVERLAY_EVERY):
+        a = data.dataset.current(cycle)
+        n = min(len(v),len(a))
+        data.graph.overlayCycle(v[:n],a[:n],cycleColour(cycle,data.cycles))
+
+# This function stores a cycle completed by the acquisition thread.
+def storeCycle(data,columns):
+    points = addColumns(data,columns)
+    data.cyclesRun += 1
+    graph = data.graph
+    # in overlay mode the finished cycle joins the overlay, and the trace
+    # goes on with the points of the next cycle
+    if graph.overlay != None:
+        if data.first: fitFirstCycle(data)
+        overlayCycle(data,data.cyclesRun-1)
+        graph.points = graph.points[len(points):]
+        graph.colour = hexColour(cycleColour(data.cyclesRun,data.cycles))
+    # for first cycle, sets new graph limits based on data
+    elif data.first:
+        graph.points = points
+        fitFirstCycle(data)
+    data.first = False
+
+# This function handles everything the acquisition thread has sent
+# since the last frame.
+def drain(data):
+    while True:
+        try: kind,value = data.worker.queue.get_nowait()
+        except Queue.Empty: return
+        # shows the first cycle on the graph as it is measured, or in
+        # overlay mode the cycle being measured
+        if kind == "start":
+            data.cycleStart = value
+        elif kind == "points" and (data.first or
+                                   data.graph.overlay != None):
+            data.graph.points.extend(zip(value[4],value[1]))
+            # fits the graph to the points so far, from the new ones only
+            if data.first and len(value[1]) > 0:
+                data.liveRanges = ranges(value[4],value[1],data.liveRanges)
+                fitGraph(data.graph,*data.liveRanges)
+        elif kind == "cycle":
+            storeCycle(data,value)
+            # stops potentiostat when desired number of cycles is reached,
+            # or once the cycles have converged
+            if data.running and (data.cyclesRun == data.cycles or
+                                 data.stopReason != None):
+                stop(data)
+                return
+        elif kind == "error":
+            print("acquisition failed: " + str(value))
+            if data.running:
+                stop(data)
+                return
+        # an acquisition that ended short of its cycles
+        elif kind == "done" and data.running:
+            stop(data)
+            return
 
 # This function operates every frame.
 def timerFired(data): 
     # gets potentiostat values
-    if data.running and data.complete and data.count % 5 == 0: 
-        points = getreading(data)
-        # for first cycle, sets new graph limits based on data
-        if data.first:
-            data.graph.points = points
-            xlim,ylim = ranges(points)
-            data.graph.updateLimits(xlim,ylim)
-            data.first = False
-        # stops potentiostat when desired number of cycles is reached
-        if data.cycles != None and data.cyclesRun == data.cycles:
-            stop(data)
+    if data.running:
+        drain(data)
+        updateRunView(data)
     # editing cursor
     elif data.count % 5 == 0 and True in data.editing:
         data.pipe = not data.pipe
@@ -521,47 +1241,78 @@ def piping(pipe):
     if pipe: return "|"
     return ""
 
-# This function draws the buttons of the UI.
+# This function draws the buttons of the UI. The buttons are created on
+# the first call, and after that only their text is updated.
 def drawButtons(canvas,data): 
     bheight = data.height/13 # 4 buttons down
     bwidth = data.width/5 # 4 buttons across
     center = data.width/2
     left = center-bwidth/2
     right = center+bwidth/2
+    create = data.buttonText == None
+    texts = [] # (x, y, text, font, anchor) of each button text
 
     # draws for rows of buttons
     for i in range(4):
         if i == 0: # top row has only the start/stop button
-            canvas.create_rectangle(left,bheight/2,right,1.5*bheight,
-                fill="white")
+            if create:
+                canvas.create_rectangle(left,bheight/2,right,1.5*bheight,
+                    fill="white")
             if data.running:
                 text = "Stop"
                 text2 = "Finished Cycle " + str(data.cyclesRun)
             else: text,text2 = "Start",""
-            canvas.create_text(left+bwidth/2,bheight,text=text,
-                font="Arial 12 bold")
-            canvas.create_text(data.width-bwidth/4,bheight,
-                text=text2,font="Arial 12 bold",anchor="e")
+            texts.append((left+bwidth/2,bheight,text,"Arial 12 bold",
+                "center"))
+            texts.append((data.width-bwidth/4,bheight,text2,
+                "Arial 12 bold","e"))
+            # peak and its drift over the run, kept after the run ends
+            trend = ""
+            if data.summary != None: trend = formatTrend(data.summary)
+            texts.append((bwidth/4,bheight,trend,"Arial 8 bold","w"))
             
         else: # all other rows have 4 buttons
             for j in range(4):
-                canvas.create_rectangle(bwidth*(0.2*(j+1)+j),
-                    bheight*(0.5*(i+1)+i),bwidth*(0.2*(j+1)+j+1),
-                    bheight*(0.5*(i+1)+i+1),fill="white")
+                if create:
+                    canvas.create_rectangle(bwidth*(0.2*(j+1)+j),
+                        bheight*(0.5*(i+1)+i),bwidth*(0.2*(j+1)+j+1),
+                        bheight*(0.5*(i+1)+i+1),fill="white")
                 if j%2 == 1: # these buttons can be edited
                     text = (data.bText[i-1][j] +
                         piping(data.editing[(i-1)*2+j/2] and data.pipe))
                 else: text = data.bText[i-1][j]
                 # only prints immediate file name to UI (not full path)
                 if j == 1: text = trimFileName(text)
-                canvas.create_text(bwidth*(0.2*(j+1)+j+0.5),
-                    bheight*(0.5*(i+2)+i),text=text,font="Arial 8 bold")
-
-# This function draws the UI every frame.
+                texts.append((bwidth*(0.2*(j+1)+j+0.5),
+                    bheight*(0.5*(i+2)+i),text,"Arial 8 bold","center"))
+
+    # creates the text items, or updates those whose text changed
+    if create:
+        data.buttonText = []
+        for (x,y,text,font,anchor) in texts:
+            item = canvas.create_text(x,y,text=text,font=font,anchor=anchor)
+            data.buttonText.append([item,text])
+    else:
+        for button,(_,_,text,_,_) in zip(data.buttonText,texts):
+            if button[1] != text:
+                canvas.itemconfig(button[0],text=text)
+                button[1] = text
+
+# This function draws the UI every frame. Canvas items are created on
+# the first frame and updated in place after that.
+@perf.timed("redrawAll")
 def redrawAll(canvas,data):
-    canvas.create_rectangle(0,0,data.width+5,data.height+5,fill="white")
-    canvas.create_rectangle(0,0,data.width+5,data.height/2-10,fill="orange")
-    data.graph.drawGraph(canvas)
+    perf.count("frames")
+    if data.buttonText == None:
+        canvas.create_rectangle(0,0,data.width+5,data.height+5,fill="white")
+        canvas.create_rectangle(0,0,data.width+5,data.height/2-10,
+            fill="orange")
+    # replaces the graph when a new one has been made or the view changed
+    graph = data.runGraph if data.view == "run" else data.graph
+    if data.drawnGraph is not graph:
+        if data.drawnGraph != None: data.drawnGraph.eraseGraph(canvas)
+        data.drawnGraph = graph
+    graph.drawGraph(canvas)
     drawButtons(canvas,data)
 
 
@@ -569,9 +1320,9 @@ def redrawAll(canvas,data):
 # runUI function # from 15-112 #
 ####################################
 
-def runUI(width=300, height=300):
+def runUI(width=300, height=300, backend=None):
+    import Tkinter
     def redrawAllWrapper(canvas, data):
-        canvas.delete(ALL)
         redrawAll(canvas, data)
         canvas.update()    
 
@@ -583,7 +1334,21 @@ def runUI(width=300, height=300):
         keyPressed(event, data)
         redrawAllWrapper(canvas, data)
 
+    def mouseDraggedWrapper(event, canvas, data):
+        mouseDragged(event, data)
+        redrawAllWrapper(canvas, data)
+
+    def mouseWheelWrapper(event, canvas, data, delta):
+        mouseWheel(event, data, delta)
+        redrawAllWrapper(canvas, data)
+
     def timerFiredWrapper(canvas, data):
+        # counts the frames missed while a frame ran late
+        now = time.time()
+        if data.lastFrame != None:
+            late = (now-data.lastFrame)*1000.0/data.timerDelay
+            if late >= 2: perf.count("droppedFrames",int(late)-1)
+        data.lastFrame = now
         timerFired(data)
         redrawAllWrapper(canvas, data)
         # pause, then call timerFired again
@@ -594,22 +1359,37 @@ def runUI(width=300, height=300):
     data.width = width
     data.height = height
     data.timerDelay = 50 # milliseconds
+    data.backend = backend
     init(data)
     # create the root and the canvas
-    root = Tk()
-    canvas = Canvas(root, width=data.width, height=data.height)
+    root = Tkinter.Tk()
+    canvas = Tkinter.Canvas(root, width=data.width, height=data.height)
     canvas.pack()
     # set up events
     root.bind("<Button-1>", lambda event:
                             mousePressedWrapper(event, canvas, data))
     root.bind("<Key>", lambda event:
                             keyPressedWrapper(event, canvas, data))
+    root.bind("<B1-Motion>", lambda event:
+                            mouseDraggedWrapper(event, canvas, data))
+    # the wheel is one event with a delta on Windows, buttons 4 and 5 on X
+    root.bind("<MouseWheel>", lambda event:
+                    mouseWheelWrapper(event, canvas, data, event.delta))
+    root.bind("<Button-4>", lambda event:
+                            mouseWheelWrapper(event, canvas, data, 1))
+    root.bind("<Button-5>", lambda event:
+                            mouseWheelWrapper(event, canvas, data, -1))
     timerFiredWrapper(canvas, data)
     # and launch the app
     root.mainloop()  # blocks until window is closed
     # closes connection to potentiostat if still open
+    if data.worker != None: data.worker.halt()
     try: data.pstat.Close()
     except: pass
         
-# dimensions set for Windows XP Dell computer
-runUI(600,400)
+if __name__ == "__main__":
+    # an optional argument selects the instrument backend ("com", "sim")
+    backend = None
+    if len(sys.argv) > 1: backend = gamry.getBackend(sys.argv[1])
+    # dimensions set for Windows XP Dell computer
+    runUI(600,400,backend)
@@ -13,6 +13,24 @@
 // arduino stops measuring oxygen and sends data
 // computer reads data and writes text file
 
+// commands are lines ending in '\n'; a command without a line ending, as
+// older hosts send them, is taken once the line has been quiet for 100 ms
+// - "start"     clears the data and starts measuring, and replies "ok",
+//               which tells the host this sketch reads lines
+// - "send"      stops measuring and prints the number of values, then
+//               one value per line (text mode)
+// - "dump"      stops measuring and writes all values in one binary
+//               frame: 0xA5 0x5A, uint16 count, count float32 values,
+//               uint16 CRC-16/CCITT of the count and values (all
+//               little-endian)
+// - "baud<N>"   replies "ok" at the current rate, then switches to N
+// - "stream"    also prints each reading as it is taken, as a line
+//               "O2,<millis>,<value>"
+// - "stop"      stops measuring and streaming
+
+// readings past the end of O2val are streamed but not stored, so a run
+// of any length only keeps the first len values for send and dump
+
 
 const int O2pin = A0;
 double calibration = 228.0;
@@ -23,8 +41,14 @@ int maxJ = 0;
 
 bool sending = false;
 bool collecting = true;
+bool streaming = false;
 String bitIn;
 
+const unsigned long period = 3000; // ms between readings
+unsigned long lastReading = 0;
+
+const byte frameStart[2] = {0xA5, 0x5A};
+
 void initFloatArray( float arr[], int arraySize) {
   for (int i = 0; i<arraySize; i++) {
     arr[i] = 0.0;
@@ -43,7 +67,36 @@ int calibrate() {
 
 void setup() {
   Serial.begin(9600);
+  // commands end in a line ending, or arrive whole, so they need not
+  // wait out the default 1 s
+  Serial.setTimeout(100);
   initFloatArray(O2val, len);
+  lastReading = millis() - period;
+}
+
+uint16_t crc16(uint16_t crc, const byte *data, int n) {
+  for (int i = 0; i < n; i++) {
+    crc ^= (uint16_t)data[i] << 8;
+    for (int b = 0; b < 8; b++) {
+      if (crc & 0x8000) crc = (crc << 1) ^ 0x1021;
+      else crc = crc << 1;
+    }
+  }
+  return crc;
+}
+
+void sendFrame(float arr[], int n) {
+  byte count[2] = {(byte)(n & 0xFF), (byte)(n >> 8)};
+  uint16_t crc = crc16(0xFFFF, count, 2);
+  Serial.write(frameStart, 2);
+  Serial.write(count, 2);
+  for (int i = 0; i < n; i++) {
+    const byte *value = (const byte *)&arr[i];
+    Serial.write(value, 4);
+    crc = crc16(crc, value, 4);
+  }
+  byte check[2] = {(byte)(crc & 0xFF), (byte)(crc >> 8)};
+  Serial.write(check, 2);
 }
 
 float readO2Vout() {
@@ -67,27 +120,65 @@ float readConcentration() {
 
 void loop() {
   if (Serial.available() > 0) {
-    bitIn = Serial.readString();
+    bitIn = Serial.readStringUntil('\n');
+    bitIn.trim();
     if (bitIn == "start") {
       collecting = true;
       sending = false;
+      streaming = false;
       j = 0;
       maxJ = 0;
+      lastReading = millis() - period;
       initFloatArray(O2val, len);
+      Serial.println("ok");
+    }
+    else if (bitIn == "stream") {
+      streaming = true;
+    }
+    else if (bitIn == "stop") {
+      if (collecting) maxJ = j;
+      collecting = false;
+      streaming = false;
     }
     else if (bitIn == "send") {
       collecting = false;
+      streaming = false;
       sending = true;
       maxJ = j;
       j = 0;
       Serial.println(maxJ);
     }
+    else if (bitIn == "dump") {
+      if (collecting) maxJ = j;
+      collecting = false;
+      streaming = false;
+      sending = false;
+      sendFrame(O2val, maxJ);
+    }
+    else if (bitIn.startsWith("baud")) {
+      long rate = bitIn.substring(4).toInt();
+      if (rate > 0) {
+        Serial.println("ok");
+        Serial.flush();
+        Serial.end();
+        Serial.begin(rate);
+      }
+    }
   }
-  if (collecting) {
+  if (collecting && millis() - lastReading >= period) {
     // read sensor
-    O2val[j] = readConcentration();
-    j ++;
-    delay(3000);
+    lastReading = millis();
+    float value = readConcentration();
+    if (j < len) {
+      O2val[j] = value;
+      j ++;
+    }
+    if (streaming) {
+      Serial.print("O2,");
+      Serial.print(lastReading);
+      Serial.print(",");
+      Serial.println(value);
+    }
   }
   else if (sending && j < maxJ) {
     // print data structure to serial port
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+
+# rack.py
+
+# This file runs every potentiostat on a bench at once. Each section the
+# backend enumerates gets its own Session, with its own waveform, cycle
+# plan and output files, run on its own acquisition thread; the progress
+# of all of them is reported together.
+
+#   rack = Rack("com",{"PCI4-12345": {"cycles": 200}},output="runs/s1",
+#               cycles=50)
+#   rack.run(report=printStatus)
+
+import os
+import sys
+import time
+import threading
+
+import gamry
+from session import Session
+
+# This function returns the output path of one potentiostat's run, by
+# adding the section to the file name.
+def sectionOutput(output,section):
+    root,ext = os.path.splitext(output)
+    return root + "-" + section + ext
+
+# This class runs one Session on its own thread, talking to the
+# instrument from that thread only.
+class Worker(threading.Thread):
+
+    def __init__(self,session):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.session = session
+        self.error = None # exception that ended the run
+        self.started = None
+        self.finished = None
+
+    def run(self):
+        backend = self.session.backend
+        backend.threadInit()
+        self.started = time.time()
+        try: self.session.run()
+        except Exception as error: self.error = error
+        finally:
+            self.finished = time.time()
+            backend.threadExit()
+
+    # This function returns the state of the run.
+    def state(self):
+        if self.error != None: return "failed"
+        if self.finished != None: return "done"
+        if self.started != None: return "running"
+        return "waiting"
+
+# This class runs a Session on every potentiostat of a backend. plans
+# maps a section to the Session arguments that differ for it; options
+# are the arguments shared by all. Each run is saved to output with its
+# section added to the file name, unless its plan gives an output.
+class Rack(object):
+
+    def __init__(self,backend="com",plans=None,output=None,**options):
+        if isinstance(backend,str): backend = gamry.getBackend(backend)
+        self.backend = backend
+        self.sections = list(backend.deviceList().EnumSections())
+        if plans == None: plans = {}
+        for section in plans:
+            if section not in self.sections:
+                raise ValueError("no such device: " + str(section))
+        self.workers = []
+        for section in self.sections:
+            plan = dict(options)
+            plan.update(plans.get(section,{}))
+            if output != None and "output" not in plan:
+                plan["output"] = sectionOutput(output,section)
+            session = Session(backend,section=section,**plan)
+            self.workers.append(Worker(session))
+        self.started = None
+
+    # This function starts every run.
+    def start(self):
+        self.started = time.time()
+        for worker in self.workers:
+            worker.start()
+
+    # This function ends every run once its cycle in progress is read,
+    # and waits for them to be saved.
+    def halt(self):
+        for worker in self.workers:
+            worker.session.halt()
+        for worker in self.workers:
+            if worker.is_alive(): worker.join()
+
+    # This function returns whether any run has not finished.
+    def busy(self):
+        return True in [worker.is_alive() for worker in self.workers]
+
+    # This function returns (section, state, cycles run, cycles) for
+    # every potentiostat.
+    def status(self):
+        return [(worker.session.section,worker.state(),
+                 worker.session.cyclesRun,worker.session.cycles)
+                for worker in self.workers]
+
+    # This function starts every run and waits for them all, calling
+    # report every interval seconds and once at the end. Interrupting the
+    # wait halts the runs, which are still saved.
+    def run(self,interval=1.0,report=None):
+        self.start()
+        try:
+            while self.busy():
+                if report != None: report(self)
+                until = time.time()+interval
+                for worker in self.workers:
+                    worker.join(max(until-time.time(),0))
+        except KeyboardInterrupt:
+            self.halt()
+            raise
+        if report != None: report(self)
+        return [worker.session.dataset for worker in self.workers]
+
+# This function returns the status of a rack as a table, one row per
+# potentiostat and a total.
+def formatStatus(rack):
+    lines = []
+    done = total = 0
+    for (section,state,run,cycles) in rack.status():
+        lines.append("%-16s %-8s %6d/%d cycles" % (section,state,run,cycles))
+        done += run
+        total += cycles
+    elapsed = 0.0
+    if rack.started != None: elapsed = time.time()-rack.started
+    lines.append("%-16s %-8s %6d/%d cycles in %.1f s" %
+                 ("all","",done,total,elapsed))
+    return "\n".join(lines)
+
+# This function prints the status of a rack.
+def printStatus(rack):
+    print(formatStatus(rack) + "\n")
+    sys.stdout.flush()
+
+# This function reads a --plan argument, SECTION:CYCLES[:SRATE[:WAVEFORM]].
+def parsePlan(text):
+    parts = text.split(":",3)
+    plan = {"cycles": int(parts[1])}
+    if len(parts) > 2 and parts[2] != "": plan["sRate"] = float(parts[2])
+    if len(parts) > 3: plan["waveform"] = parts[3]
+    return parts[0],plan
+
+# This function runs every potentiostat from the command line.
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run cycles on every potentiostat at once.")
+    parser.add_argument("--backend",default="com",choices=["com","sim"])
+    parser.add_argument("--devices",type=int,default=4,
+                        help="number of simulated potentiostats")
+    parser.add_argument("--speed",type=float,default=None,
+                        help="simulated seconds per real second")
+    parser.add_argument("--cycles",type=int,default=None)
+    parser.add_argument("--srate",type=float,default=None)
+    parser.add_argument("--waveform",default="")
+    parser.add_argument("--plan",action="append",default=[],
+        help="SECTION:CYCLES[:SRATE[:WAVEFORM]] for one potentiostat")
+    parser.add_argument("--output",default=None,
+                        help="text file name, the section is added to it")
+    parser.add_argument("--binary",action="store_true")
+    parser.add_argument("--interval",type=float,default=5.0,
+                        help="seconds between status reports")
+    args = parser.parse_args()
+
+    if args.backend == "sim":
+        backend = gamry.SimBackend(devices=args.devices,speed=args.speed)
+    else: backend = gamry.getBackend(args.backend)
+    plans = dict(parsePlan(text) for text in args.plan)
+    rack = Rack(backend,plans,args.output,sRate=args.srate,
+                cycles=args.cycles,waveform=args.waveform,
+                binary=args.binary or None)
+    rack.run(args.interval,printStatus)
+    for worker in rack.workers:
+        if worker.error != None:
+            print("%s failed: %s" % (worker.session.section,worker.error))
+
+if __name__ == "__main__":
+    main()
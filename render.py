@@ -0,0 +1,116 @@
+#!/usr/bin/python
+
+# render.py
+
+# This file defines helpers for drawing large data sets on the Tkinter
+# canvas with a bounded number of canvas items: decimated traces, and an
+# off-screen raster that any number of traces are drawn into.
+
+import math
+import base64
+
+import numpy as np
+
+# This function reduces a trace to the lowest and highest point of each
+# of a number of buckets of consecutive samples, kept in their original
+# order, so the shape and spikes of the trace survive at any length. With
+# one bucket per pixel column the result is at most two points per column.
+def decimate(xs,ys,buckets):
+    xs = np.asarray(xs,dtype=np.float64)
+    ys = np.asarray(ys,dtype=np.float64)
+    n = len(ys)
+    if buckets < 1 or n <= 2*buckets: return xs,ys
+    per = int(math.ceil(n/float(buckets)))
+    rows = int(math.ceil(n/float(per)))
+    # pads the last bucket with its final point
+    padded = np.empty(rows*per)
+    padded[:n] = ys
+    padded[n:] = ys[-1]
+    table = padded.reshape(rows,per)
+    lows = table.argmin(axis=1)
+    highs = table.argmax(axis=1)
+    start = np.arange(rows)*per
+    idx = np.empty(2*rows,dtype=np.int64)
+    idx[0::2] = start+np.minimum(lows,highs)
+    idx[1::2] = start+np.maximum(lows,highs)
+    idx = np.minimum(idx,n-1)
+    return xs[idx],ys[idx]
+
+# This function returns canvas coordinates as the flat list taken by
+# canvas.coords, from arrays of x and y coordinates.
+def flatten(xs,ys):
+    coords = np.empty(2*len(xs))
+    coords[0::2] = xs
+    coords[1::2] = ys
+    return coords.tolist()
+
+# colours of the overlay, from the first cycle to the last
+COLOURS = np.array([[68,1,84],[59,82,139],[33,145,140],[94,201,98],
+                    [253,231,37]],dtype=np.float64)
+
+# This function returns the colour of a cycle in an overlay of a number
+# of cycles, as (red, green, blue).
+def cycleColour(cycle,cycles):
+    fraction = cycle/float(max(cycles-1,1))
+    position = min(max(fraction,0.0),1.0)*(len(COLOURS)-1)
+    low = min(int(position),len(COLOURS)-2)
+    mix = COLOURS[low]+(COLOURS[low+1]-COLOURS[low])*(position-low)
+    return tuple(int(round(c)) for c in mix)
+
+# This function returns a colour as the text taken by Tkinter.
+def hexColour(colour):
+    return "#%02x%02x%02x" % colour
+
+# This class holds an off-screen image that traces are drawn into one at
+# a time, so that any number of them can be shown as a single canvas
+# item. Drawing a trace only touches the pixels on its path; version
+# changes each time the image does, so it is only handed to the canvas
+# again once it has changed.
+class Raster(object):
+
+    def __init__(self,width,height,background=(255,255,255)):
+        self.width = max(int(width),1)
+        self.height = max(int(height),1)
+        self.background = background
+        self.pixels = np.empty((self.height,self.width,3),dtype=np.uint8)
+        self.version = 0
+        self.clear()
+
+    # This function fills the image with the background colour.
+    def clear(self):
+        self.pixels[:] = self.background
+        self.drawn = 0 # traces drawn since the last clear
+        self.version += 1
+
+    # This function draws a trace through points given in pixels, as
+    # arrays of x and y coordinates, joining consecutive points with
+    # straight lines. Points off the image are clipped.
+    def drawLine(self,xs,ys,colour):
+        xs = np.asarray(xs,dtype=np.float64)
+        ys = np.asarray(ys,dtype=np.float64)
+        keep = np.isfinite(xs) & np.isfinite(ys)
+        xs,ys = xs[keep],ys[keep]
+        if len(xs) == 0: return
+        # samples each segment once per pixel along its longer side
+        dx,dy = np.diff(xs),np.diff(ys)
+        steps = np.maximum(np.ceil(np.maximum(abs(dx),abs(dy))),1)
+        steps = steps.astype(np.int64)
+        segment = np.repeat(np.arange(len(steps)),steps)
+        starts = np.repeat(np.cumsum(steps)-steps,steps)
+        fraction = ((np.arange(len(segment))-starts)/
+                    np.repeat(steps,steps).astype(np.float64))
+        px = np.append(xs[segment]+dx[segment]*fraction,xs[-1])
+        py = np.append(ys[segment]+dy[segment]*fraction,ys[-1])
+        px = np.rint(px).astype(np.int64)
+        py = np.rint(py).astype(np.int64)
+        inside = ((px >= 0) & (px < self.width) &
+                  (py >= 0) & (py < self.height))
+        self.pixels[py[inside],px[inside]] = colour
+        self.drawn += 1
+        self.version += 1
+
+    # This function returns the image as base64 encoded PPM data, the
+    # form a Tkinter PhotoImage reads.
+    def encoded(self):
+        header = ("P6 %d %d 255\n" % (self.width,self.height)).encode("ascii")
+        return base64.b64encode(header+self.pixels.tostring())
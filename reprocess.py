@@ -0,0 +1,266 @@
+#!/usr/bin/python
+
+# reprocess.py
+
+# This file analyses an archive of saved runs again. Every text file in
+# the layout of getContents is parsed and summarised cycle by cycle
+# (analytics.py) on a pool of processes; each file's summary table is
+# written as its own summary file, and one row per file goes into an
+# index table of the whole archive. Results are cached by file, keyed on
+# its modification time and a hash of its contents, so a repeat run only
+# reads the files that changed.
+
+#   python reprocess.py archive/ --out summaries/ --jobs 8
+
+import os
+import sys
+import time
+import json
+import fnmatch
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+from analytics import Summary
+from channels import COLUMNS, CORE
+from runfile import readText, writeSummary, summaryPath
+
+# columns of the index table, one row per file
+INDEX_FIELDS = ["path","cycles","samples","o2Points","o2Mean","anodicI",
+                "cathodicI","charge","anodicDrift","error"]
+
+# files kept in the output folder
+CACHE_NAME = "reprocess_cache.json"
+INDEX_NAME = "index.csv"
+
+# files handed to a worker process at a time
+CHUNK = 8
+
+####################################
+# Finding runs
+####################################
+
+# This function returns whether a file name is one of the files written
+# next to a run rather than a run itself: <run>_summary or the file of
+# an extra Cook channel, <run>_<channel>, where <run>.txt is one of the
+# names in the same folder. The core columns never get files of their
+# own, so a run named like one is still a run.
+def isSideFile(name,names):
+    root = os.path.splitext(name)[0]
+    suffixes = ["summary"]+[c for c in COLUMNS if c not in CORE]
+    for suffix in suffixes:
+        if (root.endswith("_" + suffix) and
+                root[:-len(suffix)-1] + ".txt" in names):
+            return True
+    return False
+
+# This function returns the run files under the given files and folders,
+# as (path, name) pairs, where name is the path relative to the folder
+# it was found in.
+def findRuns(paths,pattern="*.txt"):
+    runs = []
+    for path in paths:
+        if os.path.isfile(path):
+            runs.append((path,os.path.basename(path)))
+            continue
+        for folder,dirs,files in os.walk(path):
+            dirs.sort()
+            names = set(files)
+            for name in sorted(fnmatch.filter(files,pattern)):
+                if isSideFile(name,names): continue
+                full = os.path.join(folder,name)
+                runs.append((full,os.path.relpath(full,path)))
+    return runs
+
+# This function returns the hash of a file's contents.
+def fileHash(path):
+    digest = hashlib.sha1()
+    with open(path,"rb") as f:
+        while True:
+            block = f.read(1 << 20)
+            if not block: break
+            digest.update(block)
+    return digest.hexdigest()
+
+####################################
+# Analysis
+####################################
+
+# This function parses a run file and returns its summary table, with
+# the number of samples per cycle and its O2 values. The text layout
+# does not line O2 up with the cycles, so the table has no O2 values.
+def summariseRun(path):
+    t,v,currents,O2 = readText(path)
+    summary = Summary(max(len(currents),1))
+    for a in currents:
+        summary.addCycle(t,v,a)
+    return summary,len(t),O2
+
+# This function returns the index row of a summarised run.
+def indexRow(name,summary,samples,O2):
+    row = {"path": name, "cycles": len(summary), "samples": samples,
+           "o2Points": len(O2), "error": ""}
+    row["o2Mean"] = float(O2.mean()) if len(O2) > 0 else np.nan
+    if len(summary) > 0:
+        row["anodicI"] = float(summary.column("anodicI")[-1])
+        row["cathodicI"] = float(summary.column("cathodicI")[-1])
+        row["charge"] = float(np.nanmean(summary.column("charge")))
+    else: row["anodicI"] = row["cathodicI"] = row["charge"] = np.nan
+    row["anodicDrift"] = float(summary.drift("anodicI"))
+    return row
+
+# This function reprocesses one file, in a worker process. task holds
+# the path, its name, the summary file to write, and the hash the cache
+# has for the file, if any. A file whose hash is unchanged is not parsed
+# again. Returns the path, its hash, and its index row, or None for a
+# file left as it was.
+def processRun(task):
+    path,name,output,cached = task
+    try:
+        digest = fileHash(path)
+        if digest == cached and os.path.exists(output):
+            return path,digest,None
+        summary,samples,O2 = summariseRun(path)
+        folder = os.path.dirname(output)
+        if folder != "" and not os.path.isdir(folder):
+            try: os.makedirs(folder)
+            except OSError: pass # made by another worker
+        writeSummary(output,summary)
+        return path,digest,indexRow(name,summary,samples,O2)
+    except Exception as error:
+        row = dict((field,np.nan) for field in INDEX_FIELDS)
+        row.update({"path": name, "cycles": 0, "samples": 0,
+                    "o2Points": 0, "error": str(error)})
+        return path,None,row
+
+####################################
+# Archive
+####################################
+
+# This class reprocesses the runs of an archive into an output folder,
+# keeping the cache and the index table there.
+class Reprocessor(object):
+
+    def __init__(self,out,jobs=None):
+        self.out = out
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.cachePath = os.path.join(out,CACHE_NAME)
+        self.cache = {} # path: mtime, size, hash and index row
+        if os.path.exists(self.cachePath):
+            with open(self.cachePath,"rt") as f:
+                self.cache = json.load(f)
+
+    # This function writes the cache, replacing the file only once it is
+    # all written.
+    def saveCache(self):
+        temp = self.cachePath + ".tmp"
+        with open(temp,"wt") as f:
+            json.dump(self.cache,f,sort_keys=True)
+        # Windows will not rename over an existing file
+        if os.name == "nt" and os.path.exists(self.cachePath):
+            os.remove(self.cachePath)
+        os.rename(temp,self.cachePath)
+
+    # This function returns the summary file written for a run.
+    def summaryFile(self,name):
+        return summaryPath(os.path.join(self.out,name))
+
+    # This function reprocesses the runs found under paths and writes
+    # the index table, calling report with the number of files done and
+    # the total after each one, if given. Files whose modification time
+    # and size match the cache are skipped without being read. Returns
+    # the index rows, in the order of the files.
+    def run(self,paths,pattern="*.txt",report=None):
+        if not os.path.isdir(self.out): os.makedirs(self.out)
+        runs = findRuns(paths,pattern)
+        rows = {}
+        tasks = []
+        for path,name in runs:
+            stat = os.stat(path)
+            entry = self.cache.get(path)
+            output = self.summaryFile(name)
+            if (entry != None and entry["mtime"] == stat.st_mtime and
+                    entry["size"] == stat.st_size and
+                    os.path.exists(output)):
+                rows[path] = entry["row"]
+                continue
+            cached = entry["hash"] if entry != None else None
+            tasks.append((path,name,output,cached))
+        done = len(rows)
+        if report != None: report(done,len(runs))
+        if self.jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(self.jobs,len(tasks)))
+            results = pool.imap_unordered(processRun,tasks,CHUNK)
+        else:
+            pool = None
+            results = (processRun(task) for task in tasks)
+        try:
+            for path,digest,row in results:
+                if row == None: row = self.cache[path]["row"]
+                rows[path] = row
+                if digest != None:
+                    stat = os.stat(path)
+                    self.cache[path] = {"mtime": stat.st_mtime,
+                                        "size": stat.st_size,
+                                        "hash": digest, "row": row}
+                done += 1
+                if report != None: report(done,len(runs))
+        finally:
+            if pool != None:
+                pool.close()
+                pool.join()
+            self.saveCache()
+        index = [rows[path] for path,_ in runs]
+        writeIndex(os.path.join(self.out,INDEX_NAME),index)
+        return index
+
+# This function writes the index table as a comma-separated file with a
+# header line.
+def writeIndex(path,rows):
+    with open(path,"wt") as f:
+        f.write(",".join(INDEX_FIELDS) + "\n")
+        for row in rows:
+            values = []
+            for field in INDEX_FIELDS:
+                value = row[field]
+                if isinstance(value,float): value = "%.9g" % value
+                # keeps each row on one line with a fixed number of fields
+                value = str(value).replace(","," ").replace("\n"," ")
+                values.append(value)
+            f.write(",".join(values) + "\n")
+
+# This function reprocesses an archive from the command line.
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Summarise every saved run of an archive again.")
+    parser.add_argument("paths",nargs="+",
+                        help="run files, or folders searched for them")
+    parser.add_argument("--out",default="reprocessed",
+                        help="folder for the summaries and the index")
+    parser.add_argument("--jobs",type=int,default=None,
+                        help="worker processes, one per CPU by default")
+    parser.add_argument("--pattern",default="*.txt",
+                        help="names of the run files in folders")
+    parser.add_argument("--quiet",action="store_true")
+    args = parser.parse_args()
+
+    start = time.time()
+
+    def report(done,total):
+        if args.quiet: return
+        sys.stdout.write("\r%d of %d files" % (done,total))
+        sys.stdout.flush()
+
+    index = Reprocessor(args.out,args.jobs).run(args.paths,args.pattern,
+                                                 report)
+    failed = [row for row in index if row["error"] != ""]
+    if not args.quiet: print("")
+    for row in failed:
+        print("%s: %s" % (row["path"],row["error"]))
+    print("%d files, %d failed, in %.1f s" % (len(index),len(failed),
+                                               time.time()-start))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+#!/usr/bin/python
+
+# runfile.py
+
+# This file defines the output files of a run: the comma-separated text
+# file, and a binary file that keeps the raw arrays with the run's
+# metadata and can be read a cycle at a time through a memory map.
+
+import os
+import time
+import json
+import zlib
+import struct
+
+import numpy as np
+
+from analytics import FIELDS
+from channels import COLUMNS, TYPES, channelTag
+
+####################################
+# Text output
+####################################
+
+# The spill file a text output is built from while its run goes on
+# starts with a header (magic, samples per cycle, field width), followed
+# by the time and voltage fields of every row, then each cycle's current
+# fields as one block. Every field is one value right-aligned to the
+# width, followed by ", "; a cycle shorter than the first is padded with
+# blank fields.
+SPILL_MAGIC = b"PSTATSPL"
+SPILL = struct.Struct("<8sII")
+
+# This class writes the text output of a run as the cycles complete.
+# The file keeps the layout of getContents in potentiostat.py: one row
+# per sample holding the time, voltage and the current of every cycle,
+# with the O2 values on the last line. Each cycle's current is formatted
+# as it arrives and appended to the spill file (<name>.txt.cycles), so
+# finishing the file only splices the fields of the cycles that ran into
+# rows, copying them a block at a time without formatting anything. A
+# spill left by a run that never finished is turned into its text file
+# by recoverText.
+class TextWriter(object):
+
+    width = 24 # characters per value, enough for str() of any float
+
+    def __init__(self,path,cycles):
+        self.path = path
+        self.cycles = cycles # most cycles the run can write
+        self.written = 0 # number of cycles written
+        self.rows = 0 # samples of the first cycle
+        self.minLength = 0
+        self.spillPath = spillPath(path)
+        self.spill = open(self.spillPath,"w+b")
+
+    # This function formats values as fields of the row layout, in one
+    # format call.
+    def fields(self,values):
+        values = np.asarray(values,dtype=np.float64).tolist()
+        return (("%%%ds, " % self.width)*len(values)) % tuple(values)
+
+    # This function appends the fields of a completed cycle to the spill
+    # file, padded if the cycle is short. The first cycle also writes the
+    # header and the time and voltage of every row.
+    def addCycle(self,t,v,a,channels=None):
+        if self.written == self.cycles: return
+        if self.written == 0:
+            self.rows = self.minLength = min(len(t),len(v))
+            self.spill.write(SPILL.pack(SPILL_MAGIC,self.rows,self.width))
+            # time and voltage interleaved, in the order of the rows
+            values = np.empty(2*self.rows)
+            values[0::2] = np.asarray(t[:self.rows],dtype=np.float64)
+            values[1::2] = np.asarray(v[:self.rows],dtype=np.float64)
+            self.spill.write(self.fields(values).encode("ascii"))
+        count = min(len(a),self.rows)
+        blank = " "*(self.width+2)*(self.rows-count)
+        self.spill.write((self.fields(a[:count])+blank).encode("ascii"))
+        # a run that never finishes keeps its completed cycles
+        self.spill.flush()
+        self.written += 1
+        self.minLength = min(self.minLength,count)
+
+    # This function writes the file from the spill and removes the
+    # spill. A run with no cycles leaves no file. The text layout has no
+    # place for the O2 value of each cycle.
+    def finish(self,O2vals,cycleO2=None):
+        self.spill.close()
+        if self.written == 0:
+            # an older run of the same name is replaced all the same
+            if os.path.exists(self.path): os.remove(self.path)
+        else:
+            spliceText(self.spillPath,self.path,self.rows,self.width,
+                       self.written,self.minLength,O2vals)
+        os.remove(self.spillPath)
+
+# This function returns the spill file of a text file.
+def spillPath(path):
+    return path + ".cycles"
+
+# This function writes a text file from the fields of cycles cycles in a
+# spill file, a block of rows at a time: rows past the shortest cycle
+# (minLength) are dropped, the separator after the last value is
+# removed, and the O2 line is added.
+def spliceText(spill,path,rows,width,cycles,minLength,O2vals,
+               block=1 << 22):
+    field = width+2
+    with open(path,"wb") as f:
+        if minLength == 0:
+            f.write(("\n"+O2vals).encode("ascii"))
+            return
+        data = np.memmap(spill,dtype=np.uint8,mode="r")
+        times = data[SPILL.size:SPILL.size+rows*2*field]
+        times = times.reshape(rows,2*field)
+        first = SPILL.size+rows*2*field
+        currents = data[first:first+cycles*rows*field]
+        currents = currents.reshape(cycles,rows,field)
+        rowLength = (cycles+2)*field+1
+        step = max(block//rowLength,1)
+        for start in range(0,minLength,step):
+            stop = min(start+step,minLength)
+            out = np.empty((stop-start,rowLength),dtype=np.uint8)
+            out[:,:2*field] = times[start:stop]
+            out[:,2*field:-1] = currents[:,start:stop].transpose(
+                1,0,2).reshape(stop-start,cycles*field)
+            out[:,-1] = ord("\n")
+            if stop == minLength:
+                # the last row has no separator after its last value
+                out[-1,-3:-1] = ord(" ")
+            f.write(out.tostring())
+        del data
+        f.write(O2vals.encode("ascii"))
+
+# This function writes the text file of a run that never finished from
+# the spill it left, with the cycles completed in it and the O2 line
+# given, and removes the spill. Returns the path of the text file.
+def recoverText(spill,O2vals="O2,vals"):
+    path = spill[:-len(".cycles")]
+    # a run that ended before its first cycle leaves an empty spill
+    if os.path.getsize(spill) < SPILL.size:
+        os.remove(spill)
+        return None
+    data = np.memmap(spill,dtype=np.uint8,mode="r")
+    magic,rows,width = SPILL.unpack(data[:SPILL.size].tostring())
+    if magic != SPILL_MAGIC: raise ValueError("not a spill file: " + spill)
+    field = width+2
+    first = SPILL.size+rows*2*field
+    cycles = max(len(data)-first,0)//max(rows*field,1)
+    # the last digit of a value is never blank, so padding shows where a
+    # short cycle ends
+    digits = data[first:first+cycles*rows*field].reshape(
+        cycles,rows,field)[:,:,width-1]
+    blank = digits == ord(" ")
+    lengths = np.where(blank.any(axis=1),blank.argmax(axis=1),rows)
+    minLength = int(lengths.min()) if cycles > 0 else 0
+    del data,digits,blank
+    if cycles == 0:
+        os.remove(spill)
+        return None
+    spliceText(spill,path,rows,width,cycles,minLength,O2vals)
+    os.remove(spill)
+    return path
+
+# This function reads a text output file, returning the time, voltage,
+# the cycles x samples current matrix and the O2 values. The values are
+# parsed in one numpy call; only a file whose rows are not all complete
+# is read row by row.
+def readText(path):
+    with open(path,"rt") as f:
+        contents = f.read()
+    body,_,tail = contents.rpartition("\n")
+    # a file without O2 values has data on its last line
+    if not tail.startswith("O2"):
+        body,tail = contents,""
+    lines = body.strip().split("\n")
+    if lines == [""]:
+        return np.empty(0),np.empty(0),np.empty((0,0)),np.empty(0)
+    width = len([x for x in lines[0].split(",") if x.strip() != ""])
+    if width < 2: raise ValueError("not a run file: " + str(path))
+    values = np.fromstring(body.replace(","," "),dtype=np.float64,sep=" ")
+    if len(values) != len(lines)*width: values = completeRows(lines,width)
+    table = values.reshape(-1,width)
+    O2 = []
+    for value in tail.split(",")[2:]:
+        try: O2.append(float(value))
+        except ValueError: pass
+    return table[:,0],table[:,1],table[:,2:].T,np.array(O2)
+
+# This function reads the rows of a text file that are complete, up to
+# the first short one, as left by a run that stopped mid-cycle; like
+# getContents, the columns are cut to the shortest cycle. A value that
+# is not a number raises a ValueError.
+def completeRows(lines,width):
+    rows = []
+    for line in lines:
+        fields = [x for x in line.split(",") if x.strip() != ""]
+        if len(fields) < width: break
+        rows.append([float(x) for x in fields[:width]])
+    return np.array(rows,dtype=np.float64).reshape(-1)
+
+# This class writes an extra Cook channel of a run as a text file laid
+# out like the main one, with the channel in place of the current.
+class ChannelWriter(TextWriter):
+
+    def __init__(self,path,cycles,channel):
+        TextWriter.__init__(self,path,cycles)
+        self.channel = channel
+
+    def addCycle(self,t,v,a,channels=None):
+        TextWriter.addCycle(self,t,v,channels[self.channel])
+
+# This function returns the path of the text file of an extra channel.
+def channelPath(path,channel):
+    return os.path.splitext(path)[0] + "_" + channel + ".txt"
+
+####################################
+# Summary output
+####################################
+
+# This class writes the summary table of a run (analytics.Summary) as a
+# comma-separated file with a header line, one row as each cycle
+# completes. It is added to the writers after the summary is updated.
+class SummaryWriter(object):
+
+    def __init__(self,path,summary):
+        self.path = path
+        self.summary = summary
+        self.file = open(path,"wt")
+        self.file.write(",".join(FIELDS) + "\n")
+        self.file.flush()
+
+    def addCycle(self,t,v,a,channels=None):
+        self.file.write(formatSummaryRow(self.summary.rows()[-1]))
+        self.file.flush()
+
+    def finish(self,O2vals,cycleO2=None):
+        self.file.close()
+
+# This function returns a row of the summary table as a line of the
+# summary file.
+def formatSummaryRow(row):
+    return ("%d," % row[0] +
+            ",".join("%.9g" % value for value in row[1:]) + "\n")
+
+# This function writes a whole summary table as a summary file.
+def writeSummary(path,summary):
+    with open(path,"wt") as f:
+        f.write(",".join(FIELDS) + "\n")
+        f.write("".join(formatSummaryRow(row) for row in summary.rows()))
+
+# This function returns the path of the summary file of a text file.
+def summaryPath(path):
+    return os.path.splitext(path)[0] + "_summary.csv"
+
+# This function reads a summary file, returning its field names and its
+# table of values.
+def readSummary(path):
+    with open(path,"rt") as f:
+        fields = f.readline().strip().split(",")
+        table = np.loadtxt(f,delimiter=",",ndmin=2)
+    return fields,table.reshape(-1,len(fields))
+
+####################################
+# Binary output
+####################################
+
+# The binary file starts with a 16 byte header, followed by records.
+# Each record has a 24 byte header (tag, codec, stored bytes, values)
+# and its payload, padded to 8 bytes so raw arrays can be mapped in
+# place. Records are TIME, VOLT, one CURR per cycle, one record per
+# cycle for each extra Cook channel kept ("C" and the column number),
+# O2, CO2 (the O2 value lined up with each cycle), and META
+# (JSON metadata, written at the start and end of the run; the last one
+# holds everything). Payloads are little-endian float64, either raw or
+# zlib compressed.
+MAGIC = b"PSTATRUN"
+VERSION = 1
+RECORD = struct.Struct("<4sIQQ")
+RAW,ZLIB = 0,1
+
+# This function returns the current local time as text.
+def timestamp():
+    return time.strftime("%Y-%m-%d %H:%M:%S")
+
+# This class writes the binary output of a run as the cycles complete.
+# Metadata added to meta before finish is saved with the run.
+class BinaryWriter(object):
+
+    def __init__(self,path,meta=None,compress=0):
+        self.path = path
+        self.compress = compress # zlib level, or 0 for raw arrays
+        self.meta = dict(meta or {})
+        self.meta["started"] = timestamp()
+        self.written = 0
+        self.file = open(path,"wb")
+        self.file.write(MAGIC+struct.pack("<II",VERSION,0))
+        self.record(b"META",json.dumps(self.meta).encode("utf-8"),RAW,0)
+        self.file.flush()
+
+    # This function appends a record to the file.
+    def record(self,tag,payload,codec,count):
+        self.file.write(RECORD.pack(tag,codec,len(payload),count))
+        self.file.write(payload)
+        self.file.write(b"\0"*(-len(payload) % 8))
+
+    # This function appends an array as a record, compressing it if
+    # asked to.
+    def array(self,tag,values):
+        values = np.ascontiguousarray(values,dtype="<f8")
+        payload = values.tostring()
+        if self.compress:
+            self.record(tag,zlib.compress(payload,self.compress),ZLIB,
+                        len(values))
+        else: self.record(tag,payload,RAW,len(values))
+
+    # This function writes a completed cycle, with any extra channels
+    # given as a dict of arrays by name. The time and voltage are taken
+    # from the first cycle only.
+    def addCycle(self,t,v,a,channels=None):
+        if self.written == 0:
+            self.array(b"TIME",t)
+            self.array(b"VOLT",v)
+        self.array(b"CURR",a)
+        for name in sorted(channels or {}):
+            self.array(channelTag(name),channels[name])
+        self.file.flush()
+        self.written += 1
+
+    # This function completes the file with the O2 values, given as the
+    # "O2,vals,..." line of the text output, the O2 value of each cycle,
+    # and the final metadata.
+    def finish(self,O2vals,cycleO2=None):
+        O2 = []
+        for value in O2vals.split(",")[2:]:
+            try: O2.append(float(value))
+            except ValueError: pass
+        self.array(b"O2  ",O2)
+        if cycleO2 is not None: self.array(b"CO2 ",cycleO2)
+        self.meta["finished"] = timestamp()
+        self.meta["cyclesRun"] = self.written
+        self.record(b"META",json.dumps(self.meta).encode("utf-8"),RAW,0)
+        self.file.close()
+
+# This class reads a binary output file. Only the record headers are read
+# when the file is opened; arrays are mapped or decompressed when they
+# are asked for, so single cycles or samples of a long run can be read
+# without loading the whole file.
+class RunFile(object):
+
+    def __init__(self,path):
+        self.path = path
+        self.meta = {}
+        self.records = {} # tag -> list of (codec, offset, bytes, values)
+        self.map = None
+        with open(path,"rb") as f:
+            if f.read(8) != MAGIC:
+                raise ValueError("not a potentiostat run file: " + path)
+            f.read(8)
+            offset = 16
+            size = os.fstat(f.fileno()).st_size
+            while offset+RECORD.size <= size:
+                tag,codec,length,count = RECORD.unpack(f.read(RECORD.size))
+                offset += RECORD.size
+                # a run that did not finish may end in a partial record
+                if offset+length > size: break
+                if tag == b"META":
+                    meta = f.read(length).decode("utf-8")
+                    self.meta.update(json.loads(meta))
+                else:
+                    self.records.setdefault(tag,[]).append(
+                        (codec,offset,length,count))
+                offset += length+(-length % 8)
+                f.seek(offset)
+        self.cycles = len(self.records.get(b"CURR",[]))
+        if size > 0: self.map = np.memmap(path,dtype=np.uint8,mode="r")
+
+    # This function returns the array stored in a record. Raw arrays are
+    # views of the memory map.
+    def load(self,record):
+        codec,offset,length,count = record
+        if codec == ZLIB:
+            raw = zlib.decompress(self.map[offset:offset+length].tostring())
+            return np.frombuffer(raw,dtype="<f8")
+        return np.ndarray((count,),dtype="<f8",buffer=self.map,
+                          offset=offset)
+
+    # This function returns the array of the only record with a tag.
+    def single(self,tag):
+        if tag not in self.records: return np.empty(0)
+        return self.load(self.records[tag][0])
+
+    # These functions return the time, voltage and O2 arrays.
+    def time(self):
+        return self.single(b"TIME")
+
+    def voltage(self):
+        return self.single(b"VOLT")
+
+    def O2(self):
+        return self.single(b"O2  ")
+
+    def cycleO2(self):
+        return self.single(b"CO2 ")
+
+    # This function returns the current of a cycle.
+    def cycle(self,idx):
+        return self.load(self.records[b"CURR"][idx])
+
+    # This function returns the names of the extra channels stored.
+    def channelNames(self):
+        return [name for name in COLUMNS if channelTag(name) in self.records]
+
+    # This function returns an extra channel of a cycle, as the type it
+    # was kept as.
+    def channel(self,name,idx):
+        values = self.load(self.records[channelTag(name)][idx])
+        if TYPES[name] == np.float64: return values
+        return values.astype(TYPES[name])
+
+    # This function returns the current at sample idx of each cycle in
+    # the given range of cycles, or nan for cycles without that sample.
+    def column(self,idx,start=0,stop=None):
+        records = self.records.get(b"CURR",[])[start:stop]
+        values = np.empty(len(records))
+        for i,record in enumerate(records):
+            codec,offset,length,count = record
+            if idx >= count: values[i] = np.nan
+            elif codec == RAW:
+                values[i] = np.ndarray((1,),dtype="<f8",buffer=self.map,
+                                       offset=offset+8*idx)[0]
+            else: values[i] = self.load(record)[idx]
+        return values
+
+    # This function returns the number of samples stored in every
+    # column, as in the text output.
+    def minLength(self):
+        if self.cycles == 0: return 0
+        lengths = [count for (_,_,_,count) in self.records[b"CURR"]]
+        return min(min(lengths),len(self.time()))
+
+    def close(self):
+        self.map = None
+
+####################################
+# Conversion
+####################################
+
+# This function converts a text output file to a binary one.
+def textToBinary(textPath,binaryPath,meta=None,compress=0):
+    t,v,currents,O2 = readText(textPath)
+    writer = BinaryWriter(binaryPath,meta,compress)
+    for a in currents:
+        writer.addCycle(t,v,a)
+    writer.finish("O2,vals" + "".join("," + str(x) for x in O2))
+
+# This function converts a binary output file to a text one.
+def binaryToText(binaryPath,textPath):
+    run = RunFile(binaryPath)
+    writer = TextWriter(textPath,run.cycles)
+    t,v = run.time(),run.voltage()
+    for i in range(run.cycles):
+        writer.addCycle(t,v,run.cycle(i))
+    writer.finish("O2,vals" + "".join("," + str(x) for x in run.O2().tolist()))
+    run.close()
+
+# This function writes the text files of runs that never finished from
+# the spill files they left, given on the command line.
+def main():
+    import sys
+    if len(sys.argv) < 2:
+        print("usage: runfile.py NAME.txt.cycles ...")
+        raise SystemExit(2)
+    for spill in sys.argv[1:]:
+        path = recoverText(spill)
+        if path == None: print("%s: no completed cycles" % spill)
+        else: print("%s: recovered %s" % (spill,path))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+
+# session.py
+
+# This file defines a headless way to run the potentiostat, for scripts,
+# batch jobs and unattended runs. A Session holds the run state the UI
+# keeps in its data struct and runs the same acquisition functions of
+# potentiostat.py on it, so a run needs no display. The instrument
+# backend and the O2 logger are only imported once they are selected.
+
+#   session = Session("sim",cycles=10,output="runs/sample1")
+#   session.run()
+
+import os
+import sys
+import time
+import threading
+
+import gamry
+import perf
+import potentiostat
+from analytics import formatTrend
+
+# This class holds the state of one run. backend is a backend object or
+# its name; section is the potentiostat to use, or None for the first
+# one found; output is the path of the text file, without it nothing is
+# saved; o2 is the serial port of the O2 logger, or None to run without
+# one; channels names the extra Cook channels to keep; converge is the
+# tolerance the run stops early at once convergeCycles cycles in a row
+# have stayed within it (see potentiostat.CONVERGE_TOLERANCE). Parameters
+# left as None take the defaults of the UI. A session can run several
+# times, with configure setting up each run.
+class Session(object):
+
+    def __init__(self,backend="com",sRate=None,cycles=None,array=None,
+                 waveform="",output=None,o2=None,stream=True,binary=None,
+                 compress=None,section=None,channels=None,feed=None,
+                 converge=None,convergeCycles=None):
+        if isinstance(backend,str): backend = gamry.getBackend(backend)
+        self.backend = backend
+        self.section = section # potentiostat to use
+        self.opened = False # potentiostat is open
+        self.o2 = None
+        self.o2Port = None
+        self.dataset = None # data of the run, once started
+        self.running = False
+        self.stopped = threading.Event() # set to end the run early
+        self.complete = True
+        self.worker = None
+        self.configure(sRate,cycles,array,waveform,output,o2,stream,binary,
+                       compress,channels,feed,converge,convergeCycles)
+
+    # This function sets the parameters of the next run. The O2 logger
+    # is only reopened if its port changed.
+    def configure(self,sRate=None,cycles=None,array=None,waveform="",
+                  output=None,o2=None,stream=True,binary=None,
+                  compress=None,channels=None,feed=None,converge=None,
+                  convergeCycles=None):
+        self.sRate = sRate # seconds per sample
+        self.cycles = cycles # cycles to run
+        self.array = array # signal voltages
+        if waveform != "" and array == None:
+            self.array = potentiostat.readWaveform(waveform)
+        if o2 != self.o2Port:
+            if self.o2 != None: self.o2.ser.close()
+            self.o2 = None
+            if o2 != None: self.o2 = potentiostat.openO2(o2)
+            self.o2Port = o2
+        self.stream = stream # streams O2 during the run
+        self.binary = binary # also saves a binary file
+        self.compress = compress # zlib level of the binary file
+        self.channels = channels # extra Cook channels to keep
+        self.feed = feed # publishes the cycles to a live feed file
+        self.converge = converge # tolerance of the cycles converging
+        self.convergeCycles = convergeCycles
+        self.stopReason = None # why the last run ended
+        self.cyclesRun = 0
+
+        # output names, as the UI keeps them
+        folder,name = "",""
+        if output != None:
+            folder,name = os.path.split(os.path.splitext(output)[0])
+            if folder == "": folder = "."
+        self.bText = [["Folder name",folder,"Sample rate\n(s/sample)",""],
+                      ["Signal file",waveform,"# Cycles",""],
+                      ["File name",name,"",""]]
+
+        potentiostat.setDefaults(self)
+
+    # This function opens the potentiostat, unless it is still open from
+    # the last run, and the output files, and starts the O2 logger, for a
+    # new run.
+    def start(self):
+        if not self.opened:
+            potentiostat.initPstat(self)
+            self.opened = True
+        else: potentiostat.resetSignal(self)
+        potentiostat.initDataset(self)
+        potentiostat.openWriters(self,self.binary,self.compress,self.feed)
+        self.running = True
+        self.stopped.clear()
+        if self.o2 != None:
+            self.o2.start()
+            if self.stream: self.o2stream = self.o2.stream()
+
+    # This function runs one cycle, returning its (voltage, current)
+    # points.
+    def reading(self):
+        points = potentiostat.getreading(self)
+        self.first = False
+        return points
+
+    # This function stops the run and saves it. Unless close is False,
+    # the potentiostat is closed as well.
+    def stop(self,close=True):
+        potentiostat.stop(self,close)
+        if close: self.opened = False
+
+    # This function closes the potentiostat, if it is open.
+    def close(self):
+        if not self.opened: return
+        try: self.pstat.Close()
+        except: pass
+        self.opened = False
+
+    # This function ends the run once the cycle in progress is read. It
+    # can be called from another thread.
+    def halt(self):
+        self.running = False
+        self.stopped.set()
+
+    # This function runs every cycle, calling progress after each one,
+    # as one acquisition if potentiostat.CONTINUOUS is set, until the
+    # cycles converge if asked to. The run is saved even if it is
+    # interrupted. With close False the potentiostat
+    # is left open for the next run. Returns the Dataset.
+    def run(self,progress=None,close=True):
+        self.start()
+        try:
+            if potentiostat.CONTINUOUS:
+                done = None
+                if progress != None: done = lambda: progress(self)
+                potentiostat.getreadings(self,done,self.stopped)
+                self.first = False
+            while (self.running and self.cyclesRun < self.cycles and
+                   self.stopReason == None):
+                self.reading()
+                if progress != None: progress(self)
+        finally:
+            self.stop(close)
+        return self.dataset
+
+# This function runs the potentiostat from the command line.
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run potentiostat cycles without the UI.")
+    parser.add_argument("--backend",default="com",choices=["com","sim"])
+    parser.add_argument("--cycles",type=int,default=None)
+    parser.add_argument("--srate",type=float,default=None)
+    parser.add_argument("--waveform",default="",
+                        help="signal file of one voltage per line")
+    parser.add_argument("--output",default=None,
+                        help="text file to save the run to")
+    parser.add_argument("--o2",default=None,
+                        help="serial port of the O2 logger")
+    parser.add_argument("--no-stream",action="store_true",
+                        help="download O2 at the end instead of streaming")
+    parser.add_argument("--binary",action="store_true",
+                        help="also save a binary .run file")
+    parser.add_argument("--compress",type=int,default=None)
+    parser.add_argument("--channels",nargs="*",default=None,
+                        help="extra Cook channels to keep, e.g. vu ierange")
+    parser.add_argument("--no-feed",action="store_true",
+                        help="do not publish the cycles to a live feed")
+    parser.add_argument("--converge",type=float,default=None,
+                        help="stop once each cycle's current is within this "
+                             "fraction of the last cycle's")
+    parser.add_argument("--converge-cycles",type=int,default=None,
+                        help="cycles in a row the tolerance must hold")
+    parser.add_argument("--quiet",action="store_true")
+    parser.add_argument("--no-timing",action="store_true",
+                        help="do not time the run or write its report")
+    args = parser.parse_args()
+
+    perf.setEnabled(not args.no_timing)
+
+    session = Session(args.backend,args.srate,args.cycles,
+                      waveform=args.waveform,output=args.output,o2=args.o2,
+                      stream=not args.no_stream,binary=args.binary or None,
+                      compress=args.compress,channels=args.channels,
+                      feed=False if args.no_feed else None,
+                      converge=args.converge,
+                      convergeCycles=args.converge_cycles)
+    start = time.time()
+
+    def progress(session):
+        if args.quiet: return
+        print("finished cycle %d of %d  %s" % (session.cyclesRun,
+            session.cycles,formatTrend(session.summary)))
+        sys.stdout.flush()
+
+    session.run(progress)
+    points = int(session.dataset.lengths.sum())
+    print("%d cycles, %d points in %.3f s" % (session.cyclesRun,points,
+                                              time.time()-start))
+    if session.convergence != None and session.convergence.converged:
+        print(session.stopReason)
+
+if __name__ == "__main__":
+    main()
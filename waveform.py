@@ -0,0 +1,181 @@
+#!/usr/bin/python
+
+# waveform.py
+
+# This file defines the potentiostat signal: a list of voltages, one per
+# sample. Signals are generated from common shapes or read from a signal
+# file (one voltage per line), checked against the limits of the
+# instrument, and compiled once into the tuple uploaded to the
+# GamrySignalArray. Compiled signals are cached by a hash of their
+# voltages, so the same signal is never parsed or converted twice.
+
+#   python waveform.py triangle 0 1 2000 > cv.txt
+
+import sys
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+# voltage range of the signal (V) and its largest number of points
+LIMITS = (-10.0,10.0)
+MAX_POINTS = 262144
+
+# compiled signals kept by the cache
+CACHE_SIZE = 32
+
+####################################
+# Compiled signals
+####################################
+
+# This class holds a checked signal. values is the float64 array of
+# voltages, array the same voltages as the tuple uploaded to the
+# potentiostat, and key the hash that identifies them.
+class Waveform(object):
+
+    def __init__(self,values,key=None):
+        self.values = np.ascontiguousarray(values,dtype=np.float64)
+        if key == None: key = signalKey(self.values)
+        self.key = key
+        self.array = tuple(self.values.tolist())
+        self.points = len(self.values)
+
+    def __len__(self):
+        return self.points
+
+# compiled signals by key, oldest first
+cache = OrderedDict()
+
+# compiled signals by the id of their array, for the tuples handed out
+# as data.array, which cannot change
+compiled = {}
+
+# signal keys by the hash of the signal file they were read from
+files = {}
+
+# This function returns the hash that identifies an array of voltages.
+def signalKey(values):
+    return hashlib.sha1(values.tobytes()).hexdigest()
+
+# This function checks that a signal can be sent to the potentiostat,
+# raising a ValueError saying why if not.
+def validate(values,limits=LIMITS,maxPoints=MAX_POINTS):
+    if values.ndim != 1 or len(values) < 2:
+        raise ValueError("signal needs at least two points")
+    if len(values) > maxPoints:
+        raise ValueError("signal has %d points, at most %d are allowed" %
+                         (len(values),maxPoints))
+    if not np.isfinite(values).all():
+        raise ValueError("signal has a value that is not a number")
+    low,high = values.min(),values.max()
+    if low < limits[0] or high > limits[1]:
+        raise ValueError("signal spans %g to %g V, outside %g to %g V" %
+                         (low,high,limits[0],limits[1]))
+
+# This function returns the compiled signal of some voltages, checking
+# and converting them only the first time they are seen. The tuple of a
+# compiled signal is recognized without hashing it again.
+def compileSignal(values,limits=LIMITS):
+    if isinstance(values,Waveform): return values
+    if isinstance(values,tuple) and id(values) in compiled:
+        wave = compiled[id(values)]
+        if wave.array is values: return wave
+    values = np.ascontiguousarray(values,dtype=np.float64)
+    validate(values,limits)
+    key = signalKey(values)
+    if key in cache:
+        wave = cache.pop(key)
+    else:
+        wave = Waveform(values,key)
+    cache[key] = wave
+    compiled[id(wave.array)] = wave
+    # forgets the oldest signals once the cache is full
+    while len(cache) > CACHE_SIZE:
+        old = cache.popitem(last=False)[1]
+        compiled.pop(id(old.array),None)
+    return wave
+
+####################################
+# Signal files
+####################################
+
+# This function reads a signal file of one voltage per line and returns
+# its compiled signal. The whole file is split and converted in one
+# numpy call, which fails on any value that is not a number, and a file
+# whose contents were read before is not parsed again.
+def load(path,limits=LIMITS):
+    with open(path,"rb") as f:
+        contents = f.read()
+    raw = hashlib.sha1(contents).hexdigest()
+    if files.get(raw) in cache:
+        wave = cache[files[raw]]
+        validate(wave.values,limits)
+        return wave
+    try: values = np.array(contents.split(),dtype=np.float64)
+    except ValueError:
+        raise ValueError("signal file has a line that is not a number")
+    wave = compileSignal(values,limits)
+    # forgets files whose signals have left the cache
+    if len(files) >= 2*CACHE_SIZE:
+        for old in [f for f in files if files[f] not in cache]:
+            del files[old]
+    files[raw] = wave.key
+    return wave
+
+# This function writes a signal file of one voltage per line.
+def save(path,wave):
+    with open(path,"wt") as f:
+        f.write(formatSignal(wave))
+
+# This function returns the contents of a signal file.
+def formatSignal(wave):
+    return "".join("%r\n" % value for value in compileSignal(wave).array)
+
+####################################
+# Shapes
+####################################
+
+# These functions generate common signals, with points given in samples
+# at the sample rate of the run.
+
+# A linear sweep from start towards stop, not reaching it, so that
+# cycles join smoothly. ramp(0,1,1000) is the default signal of the UI.
+def ramp(start,stop,points):
+    return compileSignal(start+(stop-start)*np.arange(points)/float(points))
+
+# A cyclic voltammetry sweep from low up to high and back.
+def triangle(low,high,points):
+    up = points//2
+    rising = np.linspace(low,high,up,endpoint=False)
+    falling = np.linspace(high,low,points-up,endpoint=False)
+    return compileSignal(np.concatenate((rising,falling)))
+
+# Steps levels from start to stop, holding each for hold samples.
+def staircase(start,stop,steps,hold):
+    return compileSignal(np.repeat(np.linspace(start,stop,steps),hold))
+
+# Count pulses of height above base, each width samples long, one every
+# period samples.
+def pulses(base,height,width,period,count):
+    one = np.full(period,float(base))
+    one[:width] += height
+    return compileSignal(np.tile(one,count))
+
+SHAPES = {"ramp": ramp, "triangle": triangle, "staircase": staircase,
+          "pulses": pulses}
+
+# This function writes a generated signal file to stdout.
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in SHAPES:
+        print("usage: waveform.py ramp START STOP POINTS\n"
+              "       waveform.py triangle LOW HIGH POINTS\n"
+              "       waveform.py staircase START STOP STEPS HOLD\n"
+              "       waveform.py pulses BASE HEIGHT WIDTH PERIOD COUNT")
+        raise SystemExit(2)
+    shape = sys.argv[1]
+    args = [float(x) if "." in x or "e" in x else int(x)
+            for x in sys.argv[2:]]
+    sys.stdout.write(formatSignal(SHAPES[shape](*args)))
+
+if __name__ == "__main__":
+    main()